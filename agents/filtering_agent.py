@@ -1,18 +1,41 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from langchain.prompts import PromptTemplate
 from config import GEMINI_API_KEY  # Use Gemini API key from config
 from langchain_google_genai import ChatGoogleGenerativeAI
+from core.llm_clients import get_llm_client
+from core.llm_cache import llm_cache, model_identity
+from core.llm_dispatch import invoke_llm, LLMRateLimited
 from utils.logger import get_logger
 from utils.formatter import clean_text
 
 logger = get_logger(__name__)
 
-def filter_and_categorize_email(email: dict, tenant_info: dict = None, property_info: dict = None) -> dict:
-    """
-    Uses an LLM to analyze the email and classify it into property management categories, extracting key information.
-    Categories: maintenance_request, rent_inquiry, lockout_emergency, lease_question, general_inquiry, spam, other
-    Extracts: issue summary, urgency, tenant name, property address, unit
-    """
+# Bump when the classification prompt changes so cached results are not reused.
+CLASSIFICATION_PROMPT_VERSION = "1"
+
+CATEGORY_INSTRUCTIONS = (
+    "Categorize into ONE of the following: "
+    "'maintenance_request', 'rent_inquiry', 'lockout_emergency', "
+    "'lease_question', 'general_inquiry', 'spam', 'other'.\n"
+    "Also extract key information: \n"
+    " - 'extracted_issue_summary' (for maintenance, a brief summary of the problem) \n"
+    " - 'urgency' ('low', 'normal', 'high', 'emergency') \n"
+    " - 'tenant_name_mentioned' (if different from known sender) \n"
+    " - 'property_address_mentioned' (if any specific address is in the email) \n"
+    " - 'unit_mentioned' (e.g., Apt 3B) \n"
+)
+
+def _classification_model():
+    return get_llm_client(
+        ChatGoogleGenerativeAI,
+        model="gemini-2.0-flash",
+        temperature=0.2,
+        google_api_key=GEMINI_API_KEY
+    )
+
+def _build_classification_prompt(email: dict, tenant_info: dict = None, property_info: dict = None) -> str:
     prompt_template = PromptTemplate(
         input_variables=["subject", "body", "tenant_name", "property_address"],
         template=(
@@ -22,39 +45,37 @@ def filter_and_categorize_email(email: dict, tenant_info: dict = None, property_
             "Email Body:\n{body}\n\n"
             "Known Tenant: {tenant_name}\n"
             "Known Property Address: {property_address}\n\n"
-            "Categorize into ONE of the following: "
-            "'maintenance_request', 'rent_inquiry', 'lockout_emergency', "
-            "'lease_question', 'general_inquiry', 'spam', 'other'.\n"
-            "Also extract key information: \n"
-            " - 'extracted_issue_summary' (for maintenance, a brief summary of the problem) \n"
-            " - 'urgency' ('low', 'normal', 'high', 'emergency') \n"
-            " - 'tenant_name_mentioned' (if different from known sender) \n"
-            " - 'property_address_mentioned' (if any specific address is in the email) \n"
-            " - 'unit_mentioned' (e.g., Apt 3B) \n"
+            + CATEGORY_INSTRUCTIONS +
             "Respond with a JSON object with keys: 'category', 'extracted_issue_summary', 'urgency', 'tenant_name_mentioned', 'property_address_mentioned', 'unit_mentioned'. "
             "If a field is not applicable or found, use null or an empty string for its value."
         )
     )
 
-    prompt = prompt_template.format(
+    return prompt_template.format(
         subject=email.get("subject", ""),
         body=email.get("body", ""),
         tenant_name=tenant_info.get("name", "Unknown") if tenant_info else "Unknown",
         property_address=property_info.get("address", "Unknown") if property_info else "Unknown"
     )
 
-    model = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        temperature=0.2,
-        google_api_key=GEMINI_API_KEY
-    )
+def filter_and_categorize_email(email: dict, tenant_info: dict = None, property_info: dict = None) -> dict:
+    """
+    Uses an LLM to analyze the email and classify it into property management categories, extracting key information.
+    Categories: maintenance_request, rent_inquiry, lockout_emergency, lease_question, general_inquiry, spam, other
+    Extracts: issue summary, urgency, tenant name, property address, unit
+    """
+    prompt = _build_classification_prompt(email, tenant_info, property_info)
+    model = _classification_model()
 
-    result = model.invoke(prompt)
-    classification_text = clean_text(str(result.content if hasattr(result, "content") else result))
-    logger.debug("Raw model output: %s", classification_text)
+    return llm_cache.get_or_compute(
+        "classification", CLASSIFICATION_PROMPT_VERSION, model_identity(model), 0.2, prompt,
+        lambda: _classify(model, prompt),
+        cacheable=lambda parsed: "error" not in parsed
+    )
 
+def _strip_code_fences(text: str) -> str:
     # Remove markdown code block markers if present
-    text = classification_text.strip()
+    text = text.strip()
     if text.startswith("```"):
         # Handle single-line code block: e.g., ```json { ... } ```
         if text.endswith("```"):
@@ -77,7 +98,13 @@ def filter_and_categorize_email(email: dict, tenant_info: dict = None, property_
                     text = "\n".join(lines[1:-1])
                 else:
                     text = "\n".join(line for line in lines if not line.strip().startswith("```"))
-        classification_text = text
+    return text
+
+def _classify(model, prompt: str) -> dict:
+    result = invoke_llm(model, prompt)
+    classification_text = clean_text(str(result.content if hasattr(result, "content") else result))
+    logger.debug("Raw model output: %s", classification_text)
+    classification_text = _strip_code_fences(classification_text)
 
     try:
         parsed_output = json.loads(classification_text)
@@ -85,4 +112,115 @@ def filter_and_categorize_email(email: dict, tenant_info: dict = None, property_
         return parsed_output
     except json.JSONDecodeError:
         logger.error(f"Failed to parse JSON from LLM: {classification_text}")
-        return {"category": "unknown_format", "error": "LLM output not valid JSON"}
\ No newline at end of file
+        return {"category": "unknown_format", "error": "LLM output not valid JSON"}
+
+# --- Batch classification ---
+
+def _build_batch_prompt(items: list) -> str:
+    """items: (batch_id, email, tenant_info, property_info) tuples."""
+    parts = [
+        "You are an AI assistant for a property management company. "
+        "Analyze each of the following emails independently and categorize it.\n\n"
+    ]
+    for batch_id, email, tenant_info, property_info in items:
+        parts.append(
+            f"### Email id: {batch_id}\n"
+            f"Email Subject: {email.get('subject', '')}\n"
+            f"Email Body:\n{email.get('body', '')}\n"
+            f"Known Tenant: {tenant_info.get('name', 'Unknown') if tenant_info else 'Unknown'}\n"
+            f"Known Property Address: {property_info.get('address', 'Unknown') if property_info else 'Unknown'}\n\n"
+        )
+    parts.append(
+        "For EACH email:\n" + CATEGORY_INSTRUCTIONS +
+        "Respond with a JSON array containing one object per email, each with keys: 'id' (the email id given above), "
+        "'category', 'extracted_issue_summary', 'urgency', 'tenant_name_mentioned', 'property_address_mentioned', 'unit_mentioned'. "
+        "If a field is not applicable or found, use null or an empty string for its value. Respond with the JSON array only."
+    )
+    return "".join(parts)
+
+def _parse_batch_response(content: str) -> dict:
+    """Returns {batch_id: result} for every well-formed entry in the model's reply."""
+    text = _strip_code_fences(content)
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("["), text.rfind("]")
+        if start == -1 or end <= start:
+            return {}
+        try:
+            parsed = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+    if isinstance(parsed, dict):
+        parsed = parsed.get("results", [])
+    results = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if isinstance(entry, dict) and entry.get("id") is not None and entry.get("category"):
+            entry = dict(entry)
+            results[str(entry.pop("id"))] = entry
+    return results
+
+def _classify_batch(model, items: list) -> dict:
+    prompt = _build_batch_prompt(items)
+    try:
+        result = invoke_llm(model, prompt)
+    except LLMRateLimited:
+        # Not worth falling back to one call per email
+        raise
+    except Exception as e:
+        logger.error(f"Batch classification of {len(items)} emails failed: {e}")
+        return {}
+    content = str(result.content if hasattr(result, "content") else result)
+    return _parse_batch_response(content)
+
+def filter_and_categorize_emails(emails: list, contexts: list = None, batch_size: int = None, max_concurrency: int = None) -> list:
+    """
+    Classifies many emails, packing `batch_size` emails into each prompt and running up to
+    `max_concurrency` batch prompts at once (defaults: CLASSIFICATION_BATCH_SIZE=10,
+    CLASSIFICATION_MAX_CONCURRENCY=4).
+
+    contexts, if given, holds one (tenant_info, property_info) pair per email; ValueError if the counts differ.
+    Returns one result per email, in input order, in the same shape as filter_and_categorize_email.
+    Emails already in the cache are not sent again, and emails whose entry is missing or unparseable
+    in a batch reply fall back to an individual filter_and_categorize_email call.
+    """
+    batch_size = batch_size or int(os.getenv("CLASSIFICATION_BATCH_SIZE", "10"))
+    max_concurrency = max_concurrency or int(os.getenv("CLASSIFICATION_MAX_CONCURRENCY", "4"))
+    if contexts is None:
+        contexts = [(None, None)] * len(emails)
+    elif len(contexts) != len(emails):
+        raise ValueError(f"Got {len(contexts)} contexts for {len(emails)} emails")
+    model = _classification_model()
+    model_id = model_identity(model)
+
+    results = [None] * len(emails)
+    prompts = {}
+    pending = []
+    for index, (email, (tenant_info, property_info)) in enumerate(zip(emails, contexts)):
+        prompts[index] = _build_classification_prompt(email, tenant_info, property_info)
+        cached = llm_cache.lookup("classification", CLASSIFICATION_PROMPT_VERSION, model_id, 0.2, prompts[index])
+        if cached is not None:
+            results[index] = cached
+        else:
+            # Positional ids avoid collisions between emails that share (or lack) an "id".
+            pending.append((f"e{index}", email, tenant_info, property_info))
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        batch_results = list(executor.map(lambda batch: _classify_batch(model, batch), batches))
+
+        fallbacks = []
+        for batch, parsed in zip(batches, batch_results):
+            for batch_id, email, tenant_info, property_info in batch:
+                index = int(batch_id[1:])
+                if batch_id in parsed:
+                    results[index] = parsed[batch_id]
+                    llm_cache.store("classification", CLASSIFICATION_PROMPT_VERSION, model_id, 0.2, prompts[index], parsed[batch_id])
+                else:
+                    logger.warning(f"No parseable batch result for email {email.get('id', index)}; classifying individually")
+                    fallbacks.append((index, email, tenant_info, property_info))
+
+        fallback_results = executor.map(lambda item: filter_and_categorize_email(*item[1:]), fallbacks)
+        for (index, *_), result in zip(fallbacks, fallback_results):
+            results[index] = result
+    return results
@@ -2,6 +2,8 @@ from langchain.prompts import PromptTemplate
 from config import DEEPSEEK_API_KEY, GEMINI_API_KEY  # Import the key from your config
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
+from core.llm_clients import get_llm_client
+from core.llm_dispatch import invoke_llm, stream_llm
 
 from utils.formatter import clean_text, format_email
 
@@ -33,23 +35,22 @@ def generate_response(email: dict, summary: str, recipient_name: str, your_name:
         user_name=your_name
     )
     
-    model = ChatGoogleGenerativeAI(
+    model = get_llm_client(
+        ChatGoogleGenerativeAI,
         model="gemini-2.0-flash",
         temperature=0.5,
         google_api_key=GEMINI_API_KEY
     )
     
-    response = model.invoke(prompt)
+    response = invoke_llm(model, prompt)
     response_text = response.content if hasattr(response, "content") else str(response)
     
     # Pass recipient_name (for greeting) and your_name (for signature)
     formatted_response = format_email(email.get("subject", ""), recipient_name, response_text, your_name)
     return formatted_response.strip()
 
-def generate_property_management_response(category: str, email_data: dict, analysis_results: dict, tenant_details: dict = None, property_details: dict = None) -> str:
-    """
-    Generate a property management–specific response using extracted info and database context.
-    """
+def build_property_management_prompt(category: str, email_data: dict, analysis_results: dict, tenant_details: dict = None, property_details: dict = None) -> str:
+    """The prompt for a property management response, from the extracted info and database context."""
     # Build context for the prompt
     prompt_context = f"Responding to a '{category}'.\n"
     if tenant_details:
@@ -94,20 +95,44 @@ def generate_property_management_response(category: str, email_data: dict, analy
 
     prompt = PromptTemplate(input_variables=["context", "original_subject", "original_body_snippet"], template=template)
 
-    final_prompt_str = prompt.format(
+    return prompt.format(
         context=prompt_context,
         original_subject=email_data.get("subject", ""),
         original_body_snippet=email_data.get("body", "")[:200] + "..."
     )
 
-    model = ChatGoogleGenerativeAI(
+def property_management_model():
+    return get_llm_client(
+        ChatGoogleGenerativeAI,
         model="gemini-2.0-flash",
         temperature=0.5,
         google_api_key=GEMINI_API_KEY
     )
 
-    response = model.invoke(final_prompt_str)
-    response_text = response.content if hasattr(response, "content") else str(response)
+def format_property_management_response(email_data: dict, response_text: str, tenant_details: dict = None) -> str:
     # Optionally, format the response with a signature
     formatted_response = format_email(email_data.get("subject", ""), tenant_details["name"] if tenant_details else "Resident", response_text, "Secretary Property Management Team")
     return formatted_response.strip()
+
+def generate_property_management_response(category: str, email_data: dict, analysis_results: dict, tenant_details: dict = None, property_details: dict = None) -> str:
+    """
+    Generate a property management–specific response using extracted info and database context.
+    """
+    final_prompt_str = build_property_management_prompt(category, email_data, analysis_results, tenant_details, property_details)
+    response = invoke_llm(property_management_model(), final_prompt_str)
+    response_text = response.content if hasattr(response, "content") else str(response)
+    return format_property_management_response(email_data, response_text, tenant_details)
+
+def stream_property_management_response(category: str, email_data: dict, analysis_results: dict, tenant_details: dict = None, property_details: dict = None):
+    """
+    Same response as generate_property_management_response, yielding the body's text as the model
+    produces it. The caller joins the pieces and passes them to format_property_management_response.
+    """
+    final_prompt_str = build_property_management_prompt(category, email_data, analysis_results, tenant_details, property_details)
+    for chunk in stream_llm(property_management_model(), final_prompt_str):
+        text = chunk.content if hasattr(chunk, "content") else chunk
+        # Some providers send a chunk's content as a list of parts
+        if isinstance(text, list):
+            text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+        if text:
+            yield text
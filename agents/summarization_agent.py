@@ -1,6 +1,8 @@
 from langchain.prompts import PromptTemplate
 from config import DEEPSEEK_API_KEY  # Import the key from your config
 from langchain_openai import ChatOpenAI
+from core.llm_clients import get_llm_client
+from core.llm_dispatch import invoke_llm
 from utils.formatter import clean_text
 
 
@@ -17,14 +19,15 @@ def summarize_email(email: dict) -> str:
     prompt = prompt_template.format(content=email.get("body", ""))
     
     # Initialize the model with Deepseek's configurations
-    model = ChatOpenAI(
+    model = get_llm_client(
+        ChatOpenAI,
         base_url="https://api.deepseek.com/v1",  # Deepseek's API endpoint
         model="deepseek-chat",
         temperature=0.3,
         openai_api_key=DEEPSEEK_API_KEY         # Your Deepseek API key (from .env)
     )
     
-    summary = model.invoke(prompt)
+    summary = invoke_llm(model, prompt)
     summary_text = summary.content if hasattr(summary, "content") else str(summary)
     
     
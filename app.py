@@ -1,17 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, send_file
-import json
+from flask import (Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, send_file,
+                   Response, stream_with_context)
 from agents.filtering_agent import filter_and_categorize_email
 from agents.response_agent import generate_property_management_response
-from core.state import EmailState
-from core.supervisor import supervisor_pm_workflow
+from core.database import (get_pool_stats, setup_database, get_email, list_emails, update_email_status,
+                           get_email_dashboard_stats, rebuild_email_rollups, get_document_job_counts,
+                           get_legal_document, list_legal_documents, list_legal_events, count_legal_documents,
+                           count_legal_events, get_document_ocr_pages, get_document_job, get_document_route_stats)
+from core.legal_results import import_result_files, LLM_RESULTS_DIR
+from core.document_jobs import file_content_hash
+from core.email_ingestion import ingest_json_file, ingest_imap
+from core.llm_clients import evict_llm_clients, registry as llm_client_registry
+from core.llm_cache import llm_cache
+from core.llm_dispatch import buckets as llm_budgets
+from core.task_events import stream_task_events, stream_response_events, set_response_owner, get_response_owner
+from core.gevent_io import run_concurrently
+from core.app_database import app_database_url, engine_options, setup_schema, copy_tables
+from core.result_search import search_results, encode_search_cursor, decode_search_cursor, RESULTS_PAGE_SIZE
+from core.imap_idle import imap_latencies
+from utils.metrics import latency
 import os
 from datetime import datetime
 from collections import Counter, defaultdict
-import glob
+import click
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from celery.result import AsyncResult
+from celery.states import READY_STATES
 import csv
 from io import StringIO, BytesIO
 from functools import wraps
@@ -21,18 +36,22 @@ try:
 except ImportError:
     pass
 
-# Import Celery OCR task
+# Import Celery document tasks (OCR itself is queued once per document at ingestion, see core/document_jobs.py)
 try:
-    from celery_worker import ocr_pdf, summarize_legal_document, qa_legal_document, analyze_for_party
+    from celery_worker import (summarize_legal_document, qa_legal_document, analyze_for_party, generate_email_response,
+                               queue_monitor)
 except ImportError:
-    ocr_pdf = None  # For local dev if celery_worker not available
-    summarize_legal_document = None
+    summarize_legal_document = None  # For local dev if celery_worker not available
     qa_legal_document = None
     analyze_for_party = None
+    generate_email_response = None
+    queue_monitor = None
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "devsecret")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///paralegal.db'
+# Users, results and the other app models: a shared database such as Postgres via APP_DATABASE_URL (core/app_database.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = app_database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
@@ -63,9 +82,22 @@ class LegalDocumentResult(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     question = db.Column(db.Text, nullable=True)
     party = db.Column(db.String(32), nullable=True)
+    task_id = db.Column(db.String(155), nullable=True, index=True)  # Celery task that produced it
+    # The /results listing without a search: a user's results newest first, a page at a time. Searches use the
+    # full-text index core/result_search.py sets up (a Postgres tsvector column, or a SQLite FTS5 table)
+    __table_args__ = (db.Index('ix_legal_document_result_user_created', 'user_id', 'created_at', 'id'),)
 
     user = db.relationship('User', backref=db.backref('legal_results', lazy=True))
 
+    def as_dict(self):
+        return {
+            'result_type': self.result_type,
+            'content': self.content,
+            'question': self.question,
+            'party': self.party,
+            'created_at': self.created_at.isoformat()
+        }
+
 class LLMService(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -106,7 +138,11 @@ def load_user(user_id):
 
 # Create DB if not exists
 with app.app_context():
-    db.create_all()
+    setup_schema(db.metadata, db.engine)
+try:
+    setup_database()
+except Exception as e:
+    app.logger.warning(f"Postgres schema setup skipped: {e}")
 
 # Signup route
 @app.route('/signup', methods=['GET', 'POST'])
@@ -147,12 +183,99 @@ def logout():
     flash('Logged out successfully.')
     return redirect(url_for('login'))
 
-# For demo, load emails from sample_emails.json
+# Demo emails for `flask ingest-emails`
 EMAILS_PATH = os.getenv("EMAILS_PATH", "sample_emails.json")
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "50"))
+DASHBOARD_UNADDRESSED_LIMIT = int(os.getenv("DASHBOARD_UNADDRESSED_LIMIT", "20"))
+
+DASHBOARD_LEGAL_PAGE_SIZE = int(os.getenv("DASHBOARD_LEGAL_PAGE_SIZE", "10"))
+# Dashboard queries run side by side on a gevent worker, each holding one of the worker's POSTGRES_POOL_MAX connections
+DASHBOARD_QUERY_CONCURRENCY = int(os.getenv("DASHBOARD_QUERY_CONCURRENCY", "2"))
+
+def encode_page_cursor(row, key="received_at"):
+    return f"{row[key].isoformat()}~{row['id']}"
+
+def decode_page_cursor(cursor, id_type=str):
+    """Returns the (timestamp, id) keyset of a list query, or None for a missing or malformed cursor."""
+    if not cursor or "~" not in cursor:
+        return None
+    timestamp, row_id = cursor.split("~", 1)
+    try:
+        return datetime.fromisoformat(timestamp), id_type(row_id)
+    except ValueError:
+        return None
 
-def load_emails():
-    with open(EMAILS_PATH) as f:
-        return json.load(f)
+@app.cli.command("ingest-emails")
+@click.option("--json", "json_path", help="Load emails from a JSON export (defaults to EMAILS_PATH).")
+@click.option("--imap", "use_imap", is_flag=True, help="Sync new messages from IMAP_SERVER for IMAP_USERNAME.")
+@click.option("--user", "username", help="Username the analyses of attached legal documents belong to.")
+def ingest_emails_command(json_path, use_imap, username):
+    """Load emails into the Postgres emails table."""
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f"No user named {username}")
+        user_id = user.id
+    setup_database()
+    if use_imap:
+        from config import IMAP_USERNAME, IMAP_PASSWORD, IMAP_SERVER
+        count = ingest_imap(IMAP_USERNAME, IMAP_PASSWORD, IMAP_SERVER, user_id=user_id)
+    else:
+        count = ingest_json_file(json_path or EMAILS_PATH, user_id=user_id)
+    click.echo(f"Ingested {count} emails.")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the dashboard rollup tables from the emails table."""
+    setup_database()
+    count = rebuild_email_rollups()
+    click.echo(f"Rebuilt dashboard rollups from {count} emails.")
+
+@app.cli.command("import-legal-results")
+@click.option("--dir", "results_dir", default=LLM_RESULTS_DIR, show_default=True, help="Directory of analysis JSON files.")
+def import_legal_results_command(results_dir):
+    """Load legal analysis JSON files into the legal_documents and legal_events tables."""
+    setup_database()
+    count = import_result_files(results_dir)
+    click.echo(f"Imported {count} legal document results.")
+
+@app.cli.command("copy-app-db")
+@click.argument("source_url")
+def copy_app_db_command(source_url):
+    """Copy users, results and the other app models from SOURCE_URL (e.g. sqlite:///instance/paralegal.db) into APP_DATABASE_URL."""
+    from sqlalchemy import create_engine
+    source = create_engine(source_url)
+    try:
+        with app.app_context():
+            copied = copy_tables(db.metadata, source, db.engine)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        source.dispose()
+    for table, count in copied.items():
+        click.echo(f"{table}: {count} rows")
+
+@app.cli.command("ocr-timings")
+@click.argument("pdf_path")
+@click.option("--top", default=10, show_default=True, help="Number of slowest pages to list.")
+def ocr_timings_command(pdf_path, top):
+    """Show how ocr_pdf produced a PDF's text and where the OCR time went."""
+    content_hash = file_content_hash(pdf_path)
+    job = get_document_job(content_hash)
+    if job and job["route"]:
+        saved = "unknown" if job["saved_seconds"] is None else f"~{job['saved_seconds']:.1f}s"
+        click.echo(f"Route: {job['route']}, text ready in {job['text_seconds']:.1f}s, "
+                   f"{job['page_count'] - job['ocr_page_count']} page(s) read from the text layer (OCR time saved: {saved}).")
+    pages = get_document_ocr_pages(content_hash)
+    if not pages:
+        click.echo("No OCR timings recorded for this document.")
+        return
+    ocr_pages = [page for page in pages if page["ocr"]]
+    click.echo(f"{len(ocr_pages)} of {len(pages)} pages OCR'd, {sum(p['seconds'] for p in pages):.1f}s in total "
+               f"across {len({p['shard'] for p in pages})} shard(s).")
+    for page in sorted(ocr_pages, key=lambda p: -p["seconds"])[:top]:
+        click.echo(f"  page {page['page']:>4}  shard {page['shard']:>3}  {page['seconds']:.2f}s")
 
 @app.route("/")
 def home():
@@ -160,35 +283,94 @@ def home():
 
 @app.route("/email/<email_id>", methods=["GET", "POST"])
 def process_email(email_id):
-    emails = load_emails()
-    email = next((e for e in emails if e["id"] == email_id), None)
+    email = get_email(email_id)
     if not email:
         flash("Email not found.")
         return redirect(url_for("home"))
 
     if request.method == "POST":
+        # The task's events and result are shown only to the user who started it
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        wants_json = request.accept_mimetypes.best == "application/json"
+        if not generate_email_response:
+            if wants_json:
+                return jsonify({"error": "Response generation not available."}), 503
+            flash("Response generation not available.")
+            return render_template("process_email.html", email=email), 503
         your_name = request.form.get("your_name")
         recipient_name = request.form.get("recipient_name")
-        # Run workflow
-        state = EmailState()
-        state.emails = [email]
-        state.current_email = email
-        state = supervisor_pm_workflow(email, state)
-        response = state.current_email.get("response", "No response generated.")
-        return render_template("edit_response.html", email=email, response=response, your_name=your_name, recipient_name=recipient_name)
+        user_id = int(current_user.get_id())
+        # The workflow runs on the interactive Celery queue; the page fills the response in as the worker writes it
+        task = generate_email_response.delay(email_id, user_id=user_id)
+        set_response_owner(task.id, user_id)
+        status_url = url_for("email_task_status", task_id=task.id)
+        events_url = url_for("email_task_events", task_id=task.id)
+        if wants_json:
+            return jsonify({"task_id": task.id, "status_url": status_url, "events_url": events_url}), 202
+        return render_template("edit_response.html", email=email, response="", your_name=your_name, recipient_name=recipient_name,
+                               task_id=task.id, stream_url=events_url)
 
     return render_template("process_email.html", email=email)
 
+def email_task_result(task_id):
+    """An email response task's state and, once it succeeded, its result (celery_worker.generate_email_response)."""
+    result = AsyncResult(task_id)
+    status = result.status
+    return status, (result.result if status == "SUCCESS" else None)
+
+def is_own_email_task(task_id, user_id):
+    """Whether user_id started the email response task: as recorded when it was queued, or as its result says."""
+    owner = get_response_owner(task_id)
+    if owner is None:
+        _, result = email_task_result(task_id)
+        owner = result.get("user_id") if result else None
+    return owner is not None and owner == user_id
+
+def finished_email_task_event(task_id):
+    """The (name, data) event that ends a finished email response task's stream, or None while it runs."""
+    status, result = email_task_result(task_id)
+    if status == "SUCCESS" and result:
+        return "done", {"response": result.get("response")}
+    if status in READY_STATES:
+        return "error", {"error": "Generating the response failed."}
+    return None
+
+@app.route("/email/task/<task_id>")
+@login_required
+def email_task_status(task_id):
+    """State of the user's email response task; once done, its response, category, actions and step timings."""
+    if not is_own_email_task(task_id, int(current_user.get_id())):
+        return jsonify({"error": "Task not found."}), 404
+    status, result = email_task_result(task_id)
+    return jsonify({"task_id": task_id, "status": status, "result": result})
+
+@app.route("/email/task/<task_id>/events")
+@login_required
+def email_task_events(task_id):
+    """
+    Server-sent events of the user's email response task as the worker adds them (core.task_events.stream_response_events):
+    status events, the response's text as it is generated, then "done" with the formatted response or "error".
+    """
+    if not is_own_email_task(task_id, int(current_user.get_id())):
+        return jsonify({"error": "Task not found."}), 404
+    events = stream_response_events(task_id, finished_email_task_event)
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route("/email/<email_id>/submit", methods=["POST"])
 def submit_response(email_id):
-    emails = load_emails()
-    email = next((e for e in emails if e["id"] == email_id), None)
+    email = get_email(email_id)
     if not email:
         flash("Email not found.")
         return redirect(url_for("home"))
     response = request.form.get("response")
     action = request.form.get("action")
     recipient_name = request.form.get("recipient_name", "")
+    if action == "send":
+        update_email_status(email_id, replied=True)
+    elif action == "draft":
+        update_email_status(email_id, draft_saved=True)
     # Here you would send or draft the email using core.email_sender
     # For demo, just show a success page
     return render_template("success.html", email=email, response=response, action=action, recipient_name=recipient_name)
@@ -196,99 +378,48 @@ def submit_response(email_id):
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    emails = load_emails()
-    # For demo, assume emails with a 'response' field are replied, others are not
-    # In a real app, this would come from the database
-    # We'll simulate by marking even IDs as replied
-    for e in emails:
-        e["replied"] = int(e["id"]) % 2 == 0
-        # Simulate legal communication detection
-        subj = e["subject"].lower()
-        sender = e["from"].lower()
-        legal_keywords = ["law", "court", "attorney", "judge", "legal", "firm", "clerk"]
-        e["is_legal_communication"] = any(k in subj or k in sender for k in legal_keywords)
-        # Simulate attachments
-        e["attachments"] = []
-        if any(word in subj for word in ["document", "attachment", "pdf", "serve", "motion", "order"]):
-            filename = f"{e['id']}_document.pdf"
-            e["attachments"].append(filename)
-            # Enqueue OCR task for each legal PDF attachment (simulate path)
-            if e["is_legal_communication"] and ocr_pdf:
-                pdf_path = f"/app/attachments/{filename}"
-                user_id = current_user.get_id() if current_user.is_authenticated else None
-                # This will enqueue the OCR task in the background, with user_id for tracking
-                ocr_pdf.delay(pdf_path, user_id)
-        # Simulate categories using filtering agent (could be cached in DB in real app)
-        if "category" not in e:
-            if e["is_legal_communication"]:
-                e["category"] = "legal_document"
-            else:
-                e["category"] = "general_communication"
-        # Parse timestamp
-        e["dt"] = datetime.fromisoformat(e["timestamp"])
-    # Unaddressed messages
-    unaddressed = [e for e in emails if not e["replied"]]
+    user_id = current_user.id
+    filter_type = request.args.get('filter')
+    docs_before = decode_page_cursor(request.args.get('docs_before'), id_type=int)
+    events_after = decode_page_cursor(request.args.get('events_after'), id_type=int)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # The Postgres queries are independent; on a gevent worker they run DASHBOARD_QUERY_CONCURRENCY at a time
+    # (core/gevent_io.py), so concurrent dashboards share the connection pool instead of draining it
+    stats, unaddressed, recent_legal_docs, upcoming_events, user_doc_count, user_event_count = run_concurrently(
+        get_email_dashboard_stats,
+        # Newest unanswered emails only; the rest of the page is built from aggregates
+        lambda: list_emails(limit=DASHBOARD_UNADDRESSED_LIMIT, replied=False),
+        # Legal document analyses and their events, one indexed page of each
+        lambda: list_legal_documents(limit=DASHBOARD_LEGAL_PAGE_SIZE + 1, before=docs_before,
+                                     user_id=user_id if filter_type == 'mydocs' else None),
+        lambda: list_legal_events(limit=DASHBOARD_LEGAL_PAGE_SIZE + 1, after=events_after, since=today,
+                                  user_id=user_id if filter_type == 'myevents' else None),
+        # Per-user stats
+        lambda: count_legal_documents(user_id),
+        lambda: count_legal_events(user_id, since=today),
+        limit=DASHBOARD_QUERY_CONCURRENCY,
+    )
     # Issue counts by category
-    category_counts = Counter(e["category"] for e in emails)
+    category_counts = Counter(stats["category_counts"])
     category_counts_dict = {k: int(v) for k, v in category_counts.items()}
-    # Issues by day/week/month
-    by_day = Counter(e["dt"].date() for e in emails)
-    by_day = {str(k): v for k, v in by_day.items()}
-    by_week = Counter(e["dt"].strftime("%Y-W%U") for e in emails)
-    by_week = {str(k): v for k, v in by_week.items()}
-    by_month = Counter(e["dt"].strftime("%Y-%m") for e in emails)
-    by_month = {str(k): v for k, v in by_month.items()}
-    # Replied vs not replied by period
+    # Issues by day/week/month, and replied vs not replied by day, from per-day counts
+    by_day, by_week, by_month = Counter(), Counter(), Counter()
     replied_by_day = defaultdict(lambda: [0,0])  # [replied, not replied]
-    for e in emails:
-        d = e["dt"].date()
-        if e["replied"]:
-            replied_by_day[d][0] += 1
-        else:
-            replied_by_day[d][1] += 1
-    replied_by_day = {str(k): v for k, v in replied_by_day.items()}
-    # Drafts saved (simulate: odd IDs are drafts for demo)
-    drafts = [e for e in emails if int(e["id"]) % 2 == 1]
-    num_drafts = len(drafts)
+    for day, replied, count in stats["daily"]:
+        by_day[str(day)] += count
+        by_week[day.strftime("%Y-W%U")] += count
+        by_month[day.strftime("%Y-%m")] += count
+        replied_by_day[str(day)][0 if replied else 1] += count
+    by_day, by_week, by_month, replied_by_day = dict(by_day), dict(by_week), dict(by_month), dict(replied_by_day)
+    num_drafts = stats["drafts"]
     # Top issues (by extracted_issue_summary, if present)
-    issue_summaries = [e.get("extracted_issue_summary", e["subject"]) for e in emails if e.get("category") != "spam"]
-    top_issues = Counter(issue_summaries).most_common(5)
-    # Top categories (sorted)
-    top_categories = category_counts.most_common(5)
-    # Load LLM results (legal document analysis)
-    llm_results_dir = '/app/llm_results'
-    recent_legal_docs = []
-    upcoming_events = []
-    user_id = current_user.get_id() if current_user.is_authenticated else None
-    if os.path.exists(llm_results_dir):
-        for fpath in glob.glob(os.path.join(llm_results_dir, '*.json')):
-            try:
-                with open(fpath) as f:
-                    doc = json.load(f)
-                    # If user_id is in doc, filter by user if requested
-                    doc_user_id = doc.get('user_id')
-                    recent_legal_docs.append(doc)
-                    for dt in doc.get('event_dates', []):
-                        upcoming_events.append({
-                            'date': dt,
-                            'case_number': doc.get('case_number'),
-                            'document_type': doc.get('document_type'),
-                            'court': doc.get('court'),
-                            'user_id': doc_user_id
-                        })
-            except Exception as e:
-                print(f"Error loading LLM result {fpath}: {e}")
-    # Sort events chronologically
-    upcoming_events.sort(key=lambda x: x['date'])
-    # Filtering by user
-    filter_type = request.args.get('filter')
-    if filter_type == 'mydocs':
-        recent_legal_docs = [d for d in recent_legal_docs if d.get('user_id') == user_id]
-    if filter_type == 'myevents':
-        upcoming_events = [e for e in upcoming_events if e.get('user_id') == user_id]
-    # Per-user stats
-    user_doc_count = sum(1 for d in recent_legal_docs if d.get('user_id') == user_id)
-    user_event_count = sum(1 for e in upcoming_events if e.get('user_id') == user_id)
+    top_issues = stats["top_issues"]
+    next_docs_cursor = (encode_page_cursor(recent_legal_docs[DASHBOARD_LEGAL_PAGE_SIZE - 1], key='analyzed_at')
+                        if len(recent_legal_docs) > DASHBOARD_LEGAL_PAGE_SIZE else None)
+    recent_legal_docs = recent_legal_docs[:DASHBOARD_LEGAL_PAGE_SIZE]
+    next_events_cursor = (encode_page_cursor(upcoming_events[DASHBOARD_LEGAL_PAGE_SIZE - 1], key='starts_at')
+                          if len(upcoming_events) > DASHBOARD_LEGAL_PAGE_SIZE else None)
+    upcoming_events = upcoming_events[:DASHBOARD_LEGAL_PAGE_SIZE]
     # Notifications: last 10 results for this user
     notifications = LegalDocumentResult.query.filter_by(user_id=user_id).order_by(LegalDocumentResult.created_at.desc()).limit(10).all() if user_id else []
     # AI users for this user
@@ -301,12 +432,15 @@ def dashboard():
         by_week=by_week,
         by_month=by_month,
         replied_by_day=replied_by_day,
-        emails=emails,
+        total_emails=stats["total"],
+        replied_count=stats["replied"],
         num_drafts=num_drafts,
         top_issues=top_issues,
         top_categories=category_counts.most_common(5),
         recent_legal_docs=recent_legal_docs,
         upcoming_events=upcoming_events,
+        next_docs_cursor=next_docs_cursor,
+        next_events_cursor=next_events_cursor,
         current_user=current_user,
         user_doc_count=user_doc_count,
         user_event_count=user_event_count,
@@ -317,8 +451,9 @@ def dashboard():
 @app.route("/inbox")
 @login_required
 def inbox():
-    emails = load_emails()
-    return render_template("home.html", emails=emails)
+    emails = list_emails(limit=INBOX_PAGE_SIZE + 1, before=decode_page_cursor(request.args.get("before")))
+    next_cursor = encode_page_cursor(emails[INBOX_PAGE_SIZE - 1]) if len(emails) > INBOX_PAGE_SIZE else None
+    return render_template("home.html", emails=emails[:INBOX_PAGE_SIZE], next_cursor=next_cursor)
 
 @app.route("/scoreboard")
 def scoreboard():
@@ -334,21 +469,12 @@ def scoreboard():
 def download_ics(filename):
     return send_from_directory("/app/ics", filename, as_attachment=True)
 
-# Helper to get txt_path from doc_id (base name of JSON file)
+# Helper to get txt_path from doc_id (the analyzed text file's base name)
 def get_txt_path_from_doc_id(doc_id):
-    llm_results_dir = '/app/llm_results'
-    json_path = os.path.join(llm_results_dir, f'{doc_id}.json')
-    if not os.path.exists(json_path):
+    document = get_legal_document(doc_id)
+    if not document or not document["txt_path"] or not os.path.exists(document["txt_path"]):
         return None
-    # Assume original txt is in /app/attachments or /app/llm_results
-    # Try both
-    txt_path = os.path.join('/app/llm_results', f'{doc_id}.txt')
-    if os.path.exists(txt_path):
-        return txt_path
-    txt_path = os.path.join('/app/attachments', f'{doc_id}.txt')
-    if os.path.exists(txt_path):
-        return txt_path
-    return None
+    return document["txt_path"]
 
 @app.route('/summarize/<doc_id>', methods=['POST'])
 @login_required
@@ -398,33 +524,42 @@ def analyze_doc(doc_id):
     task = analyze_for_party.delay(txt_path, party, user_id=user_id, doc_id=doc_id, ai_user_id=ai_user.id if ai_user else None)
     return {"status": f"Analysis for {party} started", "task_id": task.id}
 
-from celery.result import AsyncResult
+def task_event(task_id, user_id, status=None):
+    """
+    A document task's state and the result it saved for the user. status is the state the worker published
+    when the task finished; without it the result backend is asked.
+    """
+    result = LegalDocumentResult.query.filter_by(task_id=task_id, user_id=user_id).first()
+    if result:
+        return {'task_id': task_id, 'status': 'SUCCESS', 'result': result.as_dict()}
+    return {'task_id': task_id, 'status': status or AsyncResult(task_id).status, 'result': None}
+
+def finished_task_event(task_id, user_id, status=None):
+    event = task_event(task_id, user_id, status)
+    return event if event['status'] in READY_STATES else None
 
 @app.route('/task_status/<task_id>')
 @login_required
 def task_status(task_id):
-    # Check Celery task status
-    res = AsyncResult(task_id)
-    status = res.status
-    # Try to find result in DB for this user
-    user_id = current_user.get_id()
-    result = LegalDocumentResult.query.filter_by(user_id=user_id).order_by(LegalDocumentResult.created_at.desc()).first()
-    result_data = None
-    if result:
-        result_data = {
-            'result_type': result.result_type,
-            'content': result.content,
-            'question': result.question,
-            'party': result.party,
-            'created_at': result.created_at.isoformat()
-        }
-    return jsonify({'status': status, 'result': result_data})
+    return jsonify(task_event(task_id, int(current_user.get_id())))
+
+@app.route('/task_events')
+@login_required
+def task_events():
+    """Server-sent events announcing when each ?task_id= finishes (core/task_events.py)."""
+    user_id = int(current_user.get_id())
+    task_ids = request.args.getlist('task_id')
+    events = stream_task_events(user_id, task_ids, lambda task_id, status: finished_task_event(task_id, user_id, status))
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def user_settings():
     if request.method == 'POST':
         gemini_api_key = request.form.get('gemini_api_key')
+        if current_user.gemini_api_key != gemini_api_key:
+            evict_llm_clients(current_user.gemini_api_key)
         current_user.gemini_api_key = gemini_api_key
         db.session.commit()
         flash('Gemini API key updated.')
@@ -434,21 +569,26 @@ def user_settings():
 @app.route('/results')
 @login_required
 def results():
-    q = request.args.get('q', '')
-    result_type = request.args.get('type')
-    party = request.args.get('party')
-    doc_id = request.args.get('doc_id')
-    query = LegalDocumentResult.query.filter_by(user_id=current_user.id)
+    q = request.args.get('q', '').strip()
+    filters = {'result_type': request.args.get('type'), 'party': request.args.get('party'),
+               'doc_id': request.args.get('doc_id')}
     if q:
-        query = query.filter(LegalDocumentResult.content.ilike(f'%{q}%'))
-    if result_type:
-        query = query.filter_by(result_type=result_type)
-    if party:
-        query = query.filter_by(party=party)
-    if doc_id:
-        query = query.filter_by(doc_id=doc_id)
-    results = query.order_by(LegalDocumentResult.created_at.desc()).all()
-    return render_template('results.html', results=results, q=q, result_type=result_type, party=party, doc_id=doc_id)
+        # Ranked matches from the full-text index, with highlighted snippets (core/result_search.py)
+        results = search_results(db.session, current_user.id, q, filters,
+                                 after=decode_search_cursor(request.args.get('after')), limit=RESULTS_PAGE_SIZE + 1)
+        next_cursor = encode_search_cursor(results[RESULTS_PAGE_SIZE - 1]) if len(results) > RESULTS_PAGE_SIZE else None
+    else:
+        query = LegalDocumentResult.query.filter_by(user_id=current_user.id)
+        query = query.filter_by(**{column: value for column, value in filters.items() if value})
+        after = decode_page_cursor(request.args.get('after'), id_type=int)
+        if after:
+            query = query.filter(db.or_(LegalDocumentResult.created_at < after[0],
+                                        db.and_(LegalDocumentResult.created_at == after[0], LegalDocumentResult.id < after[1])))
+        results = query.order_by(LegalDocumentResult.created_at.desc(), LegalDocumentResult.id.desc()).limit(RESULTS_PAGE_SIZE + 1).all()
+        next_cursor = (encode_page_cursor(vars(results[RESULTS_PAGE_SIZE - 1]), key='created_at')
+                       if len(results) > RESULTS_PAGE_SIZE else None)
+    return render_template('results.html', results=results[:RESULTS_PAGE_SIZE], next_cursor=next_cursor, q=q,
+                           result_type=filters['result_type'], party=filters['party'], doc_id=filters['doc_id'])
 
 @app.route('/results/export/csv')
 @login_required
@@ -511,6 +651,22 @@ def admin_dashboard():
     llm_services = LLMService.query.all()
     return render_template('admin_dashboard.html', users=users, ai_users=ai_users, llm_services=llm_services)
 
+@app.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    return jsonify({
+        "db_pool": get_pool_stats(),
+        "llm_clients": llm_client_registry.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_budgets": llm_budgets.stats(),
+        "latency": latency.stats(),
+        "document_jobs": get_document_job_counts(),
+        "document_routes": get_document_route_stats(),
+        "task_queues": queue_monitor.stats() if queue_monitor else None,
+        "imap_latency": imap_latencies.stats(),
+    })
+
 @app.route('/llm_services', methods=['GET', 'POST'])
 @login_required
 def llm_services():
@@ -537,6 +693,7 @@ def edit_llm_service(llm_id):
         flash('Not authorized.')
         return redirect(url_for('llm_services'))
     if request.method == 'POST':
+        evict_llm_clients(llm.api_key)
         llm.name = request.form.get('name')
         llm.service_type = request.form.get('service_type')
         llm.api_key = request.form.get('api_key')
@@ -552,6 +709,7 @@ def delete_llm_service(llm_id):
     if llm.user_id != current_user.id:
         flash('Not authorized.')
         return redirect(url_for('llm_services'))
+    evict_llm_clients(llm.api_key)
     db.session.delete(llm)
     db.session.commit()
     flash('LLM service deleted.')
@@ -0,0 +1,136 @@
+"""
+Concurrent writers on the app models' database: SQLite (the default) versus Postgres (APP_DATABASE_URL).
+
+Forks --processes processes of --threads threads each, standing in for web containers and Celery workers
+saving document results. Every write loads the user and adds a LegalDocumentResult in one transaction,
+like a request or a save_* step does, using the engine options the app would (core/app_database.py).
+Reports commits/sec, commit latency and how many writes failed with "database is locked" (or any other
+error). SQLite runs on a temporary file; Postgres gets a `bench-writers` user whose rows are deleted
+afterwards.
+
+    python -m benchmarks.bench_app_db_writers --processes 4 --threads 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from core.app_database import engine_options, setup_schema
+from app import db, User, LegalDocumentResult
+
+USERNAME = "bench-writers"
+
+
+def postgres_url():
+    return (f"postgresql+psycopg2://{os.getenv('POSTGRES_USER', 'secretary')}:{os.getenv('POSTGRES_PASSWORD', 'secretarypass')}"
+            f"@{os.getenv('POSTGRES_HOST', 'db')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'secretary_pm')}")
+
+
+def prepare(engine):
+    setup_schema(db.metadata, engine)
+    with Session(engine) as session:
+        user = session.query(User).filter_by(username=USERNAME).first()
+        if user is None:
+            user = User(username=USERNAME, email=f"{USERNAME}@example.com", password_hash="-")
+            session.add(user)
+            session.commit()
+        return user.id
+
+
+def clean_up(engine, user_id):
+    with Session(engine) as session:
+        session.query(LegalDocumentResult).filter_by(user_id=user_id).delete()
+        session.query(User).filter_by(id=user_id).delete()
+        session.commit()
+
+
+def write_for(engine, user_id, seconds, writer, results):
+    latencies, locked, failed = [], 0, 0
+    deadline = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        with Session(engine) as session:
+            try:
+                user = session.get(User, user_id)
+                session.add(LegalDocumentResult(user_id=user.id, doc_id=f"bench-{writer}-{n}", result_type="summary",
+                                                content="A summary of a lease dispute. " * 20, task_id=f"bench-{writer}-{n}"))
+                session.commit()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError as e:
+                session.rollback()
+                if "database is locked" in str(e):
+                    locked += 1
+                else:
+                    failed += 1
+        n += 1
+    results.append((latencies, locked, failed))
+
+
+def run_process(url, user_id, threads, seconds, index, queue):
+    # A forked process must not reuse the parent's connections
+    engine = create_engine(url, **engine_options(url))
+    results = []
+    workers = [threading.Thread(target=write_for, args=(engine, user_id, seconds, f"{index}-{t}", results))
+               for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    engine.dispose()
+    queue.put(results)
+
+
+def run(url, processes, threads, seconds):
+    engine = create_engine(url, **engine_options(url))
+    user_id = prepare(engine)
+    engine.dispose()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    children = [context.Process(target=run_process, args=(url, user_id, threads, seconds, i, queue))
+                for i in range(processes)]
+    for child in children:
+        child.start()
+    latencies, locked, failed = [], 0, 0
+    for _ in children:
+        for thread_latencies, thread_locked, thread_failed in queue.get():
+            latencies.extend(thread_latencies)
+            locked += thread_locked
+            failed += thread_failed
+    for child in children:
+        child.join()
+    engine = create_engine(url)
+    clean_up(engine, user_id)
+    engine.dispose()
+    latencies.sort()
+    return latencies, locked, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--postgres-url", default=None, help="defaults to the POSTGRES_* settings")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        targets = [("sqlite", f"sqlite:///{os.path.join(directory, 'bench.db')}"),
+                   ("postgres", args.postgres_url or postgres_url())]
+        print(f"{'database':>10}{'writers':>9}{'commits/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'locked':>8}{'other errors':>14}")
+        for name, url in targets:
+            latencies, locked, failed = run(url, args.processes, args.threads, args.seconds)
+            p50 = 1000 * latencies[int(0.5 * (len(latencies) - 1))] if latencies else float("nan")
+            p99 = 1000 * latencies[int(0.99 * (len(latencies) - 1))] if latencies else float("nan")
+            print(f"{name:>10}{args.processes * args.threads:>9}{len(latencies) / args.seconds:>11.1f}{p50:>9.1f}"
+                  f"{p99:>9.1f}{locked:>8}{failed:>14}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Backlog throughput of email classification: one LLM call per email versus
+filter_and_categorize_emails packing emails into batched prompts.
+
+The Gemini client is replaced with a fake model that sleeps --latency seconds per call,
+so the numbers reflect request count and concurrency rather than real model speed.
+The LLM response cache is disabled for the run.
+
+    python -m benchmarks.bench_batch_classification --emails 500 --batch-size 10 --concurrency 4
+"""
+import argparse
+import json
+import re
+import time
+from unittest.mock import patch
+
+from agents import filtering_agent
+from core.llm_cache import LLMResponseCache
+from core.llm_clients import registry
+
+BATCH_ID = re.compile(r"### Email id: (\S+)")
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeModel:
+    def __init__(self, latency, **kwargs):
+        self.latency = latency
+        self.model = kwargs.get("model")
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        result = {"category": "maintenance_request", "extracted_issue_summary": "leak", "urgency": "normal",
+                  "tenant_name_mentioned": "", "property_address_mentioned": "", "unit_mentioned": ""}
+        ids = BATCH_ID.findall(prompt)
+        if not ids:
+            return FakeResponse(json.dumps(result))
+        return FakeResponse(json.dumps([dict(result, id=batch_id) for batch_id in ids]))
+
+
+def synthetic_emails(n):
+    return [
+        {"id": str(i), "from": f"tenant{i}@example.com", "subject": f"Issue #{i}", "body": f"The sink in unit {i} is leaking."}
+        for i in range(n)
+    ]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per LLM call")
+    args = parser.parse_args()
+    emails = synthetic_emails(args.emails)
+
+    models = []
+    def make_model(**kwargs):
+        models.append(FakeModel(args.latency, **kwargs))
+        return models[-1]
+
+    registry.clear()
+    with patch.object(filtering_agent, "ChatGoogleGenerativeAI", make_model), \
+         patch.object(filtering_agent, "llm_cache", LLMResponseCache(None)):
+        model = filtering_agent._classification_model()
+        results = []
+        for name, fn in [
+            ("one call per email", lambda: [filtering_agent.filter_and_categorize_email(email) for email in emails]),
+            ("batched", lambda: filtering_agent.filter_and_categorize_emails(
+                emails, batch_size=args.batch_size, max_concurrency=args.concurrency)),
+        ]:
+            calls_before = model.calls
+            results.append((name, timed(fn), model.calls - calls_before))
+    registry.clear()
+
+    print(f"{'mode':<22}{'total s':>10}{'LLM calls':>11}{'emails/s':>10}")
+    for name, seconds, calls in results:
+        print(f"{name:<22}{seconds:>10.2f}{calls:>11}{len(emails) / seconds:>10.1f}")
+    print(f"speedup: {results[0][1] / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Dashboard aggregate cost: GROUP BY over the whole emails table on every page view versus reading the
+trigger-maintained rollup tables, plus what the triggers add to ingestion.
+
+Seeds `bench-*` rows into the emails table of the configured database and deletes them afterwards.
+
+    python -m benchmarks.bench_dashboard_rollups --sizes 10000 100000
+"""
+import argparse
+import time
+
+from core.database import setup_database, db_cursor, get_email_dashboard_stats, rebuild_email_rollups
+from core.email_ingestion import ingest_emails
+from benchmarks.bench_email_queries import synthetic_emails, per_call_ms
+
+# The queries the dashboard ran before rollups existed.
+FULL_SCAN_QUERIES = [
+    'SELECT COUNT(*), COUNT(*) FILTER (WHERE replied), COUNT(*) FILTER (WHERE draft_saved) FROM emails',
+    'SELECT category, COUNT(*) FROM emails GROUP BY category',
+    'SELECT received_at::date AS day, replied, COUNT(*) FROM emails GROUP BY day, replied',
+    "SELECT COALESCE(extracted_issue_summary, subject) AS issue, COUNT(*) AS count FROM emails "
+    "WHERE category IS DISTINCT FROM 'spam' GROUP BY issue ORDER BY count DESC LIMIT 5",
+]
+
+
+def full_scan_stats():
+    with db_cursor() as cursor:
+        for query in FULL_SCAN_QUERIES:
+            cursor.execute(query)
+            cursor.fetchall()
+
+
+def timed_ingest(emails, triggers):
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM emails WHERE source = 'bench'")
+        if not triggers:
+            cursor.execute("ALTER TABLE emails DISABLE TRIGGER USER")
+    try:
+        started = time.perf_counter()
+        ingest_emails(emails, source="bench")
+        return time.perf_counter() - started
+    finally:
+        if not triggers:
+            with db_cursor() as cursor:
+                cursor.execute("ALTER TABLE emails ENABLE TRIGGER USER")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    setup_database()
+
+    print(f"{'emails':>8}{'full scan ms':>14}{'rollups ms':>12}{'ingest s':>10}{'ingest no-trigger s':>21}")
+    try:
+        for size in args.sizes:
+            emails = synthetic_emails(size)
+            plain = timed_ingest(emails, triggers=False)
+            with_triggers = timed_ingest(emails, triggers=True)
+            with db_cursor() as cursor:
+                cursor.execute("ANALYZE emails")
+            scan_ms = per_call_ms(full_scan_stats, args.repeat)
+            rollup_ms = per_call_ms(get_email_dashboard_stats, args.repeat)
+            print(f"{size:>8}{scan_ms:>14.2f}{rollup_ms:>12.2f}{with_triggers:>10.2f}{plain:>21.2f}")
+    finally:
+        with db_cursor() as cursor:
+            cursor.execute("DELETE FROM emails WHERE source = 'bench'")
+        rebuild_email_rollups()
+
+
+if __name__ == "__main__":
+    main()
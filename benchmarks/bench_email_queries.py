@@ -0,0 +1,71 @@
+"""
+Request-path cost of looking up and paging emails: the old approach (parse the JSON export and scan it
+on every request) versus the indexed Postgres emails table, as the mailbox grows.
+
+Seeds `bench-*` rows into the emails table of the configured database and deletes them afterwards.
+
+    python -m benchmarks.bench_email_queries --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from core.database import setup_database, db_cursor, get_email, list_emails
+from core.email_ingestion import ingest_emails
+
+
+def synthetic_emails(n):
+    start = datetime(2030, 1, 1)
+    return [
+        {"id": f"bench-{i}", "from": f"tenant{i % 500}@example.com", "subject": f"Issue #{i}",
+         "body": "The sink is leaking again.", "timestamp": (start + timedelta(minutes=i)).isoformat()}
+        for i in range(n)
+    ]
+
+
+def per_call_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    setup_database()
+
+    print(f"{'emails':>8}{'json lookup ms':>16}{'db lookup ms':>14}{'db page ms':>12}{'db deep page ms':>17}")
+    try:
+        for size in args.sizes:
+            emails = synthetic_emails(size)
+            ingest_emails(emails, source="bench")
+            with db_cursor() as cursor:
+                cursor.execute("ANALYZE emails")
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+                json.dump(emails, f)
+            target = emails[size // 2]["id"]
+
+            def json_lookup():
+                with open(f.name) as fh:
+                    return next(e for e in json.load(fh) if e["id"] == target)
+
+            middle = get_email(target)
+            json_ms = per_call_ms(json_lookup, max(1, args.repeat // 4))
+            lookup_ms = per_call_ms(lambda: get_email(target), args.repeat)
+            page_ms = per_call_ms(lambda: list_emails(limit=50), args.repeat)
+            deep_ms = per_call_ms(lambda: list_emails(limit=50, before=(middle["received_at"], middle["id"])), args.repeat)
+            os.unlink(f.name)
+            print(f"{size:>8}{json_ms:>16.2f}{lookup_ms:>14.2f}{page_ms:>12.2f}{deep_ms:>17.2f}")
+    finally:
+        with db_cursor() as cursor:
+            cursor.execute("DELETE FROM emails WHERE source = 'bench'")
+
+
+if __name__ == "__main__":
+    main()
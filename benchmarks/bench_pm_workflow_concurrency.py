@@ -0,0 +1,67 @@
+"""
+Inbox throughput of the property management workflow: supervisor_pm_workflow called for one
+email after another versus run_pm_workflow_batch at increasing concurrency limits.
+
+Tenant/property lookups, classification and response generation are replaced with stubs that
+sleep for fixed latencies, so the numbers reflect how well blocking work overlaps.
+
+    python -m benchmarks.bench_pm_workflow_concurrency --emails 100 --concurrency 1 4 16
+"""
+import argparse
+import copy
+import time
+from unittest.mock import patch
+
+from agents import filtering_agent, response_agent
+from core import supervisor
+from core.state import EmailState
+
+
+def synthetic_emails(n):
+    return [
+        {"id": str(i), "from": f"tenant{i}@example.com", "subject": f"Issue #{i}", "body": "The sink is leaking again."}
+        for i in range(n)
+    ]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--db-latency", type=float, default=0.005, help="simulated seconds per DB lookup")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="simulated seconds per LLM call")
+    args = parser.parse_args()
+    emails = synthetic_emails(args.emails)
+
+    def lookup(email):
+        time.sleep(args.db_latency)
+        return None
+
+    def llm(result):
+        def call(*args_, **kwargs):
+            time.sleep(args.llm_latency)
+            return result
+        return call
+
+    with patch.object(supervisor, "get_tenant_by_email", lookup), \
+         patch.object(filtering_agent, "filter_and_categorize_email", llm({"category": "general_inquiry"})), \
+         patch.object(response_agent, "generate_property_management_response", llm("Thanks, we are on it.")):
+        sequential = lambda: [supervisor.supervisor_pm_workflow(email, EmailState()) for email in copy.deepcopy(emails)]
+        results = [("sequential", timed(sequential))]
+        for limit in args.concurrency:
+            state = EmailState(emails=copy.deepcopy(emails))
+            results.append((f"concurrency={limit}", timed(lambda: supervisor.process_pm_emails(state, limit))))
+
+    print(f"{'mode':<18}{'total s':>10}{'emails/s':>10}{'speedup':>9}")
+    for name, seconds in results:
+        print(f"{name:<18}{seconds:>10.2f}{len(emails) / seconds:>10.1f}{results[0][1] / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
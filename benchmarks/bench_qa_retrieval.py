@@ -0,0 +1,84 @@
+"""
+Prompt size and answer coverage per question for qa_legal_document: the old fixed 4000-character prefix,
+asking every chunk (map-reduce over the whole document), and the per-document BM25 passage index.
+
+Builds synthetic filings with facts planted on random pages and asks one question per fact. Coverage is
+the share of questions whose fact is in the text sent to the model. No LLM is called.
+
+    python -m benchmarks.bench_qa_retrieval --pages 10 100 1000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from core.chunking import iter_chunk_spans
+from core.retrieval import build_passage_index, load_passage_index
+
+PREFIX_CHARS = 4000
+FILLER = [
+    "The parties shall comply with all applicable rules of civil procedure.",
+    "Counsel for the plaintiff submitted the attached exhibits for the record.",
+    "The court has reviewed the pleadings and the arguments of counsel.",
+    "Nothing in this order shall be construed as a ruling on the merits.",
+    "All discovery disputes shall be raised with the magistrate judge.",
+]
+WITNESSES = ["Alvarez", "Brennan", "Castellano", "Delacroix", "Eriksen", "Fairbanks", "Galloway", "Hollister",
+             "Iverson", "Jablonski", "Kowalczyk", "Lindqvist", "Montgomery", "Nakamura", "Okonkwo", "Pemberton"]
+
+
+def write_filing(directory, pages, facts, rng):
+    fact_pages = rng.sample(range(pages), min(facts, pages, len(WITNESSES)))
+    planted = {}
+    path = os.path.join(directory, f"filing-{pages}.txt")
+    with open(path, "w") as f:
+        for page in range(pages):
+            lines = [rng.choice(FILLER) for _ in range(25)]
+            if page in fact_pages:
+                witness = WITNESSES[fact_pages.index(page)]
+                fact = f"The deposition of witness {witness} is set for {page % 28 + 1} March 2099."
+                lines.insert(rng.randrange(len(lines)), fact)
+                planted[witness] = fact
+            f.write(f"Page {page + 1}\n" + " ".join(lines) + "\f")
+    return path, planted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--facts", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    print(f"{'pages':>6}{'prefix chars':>14}{'prefix cov':>12}{'map-reduce chars':>18}"
+          f"{'retrieval chars':>17}{'retrieval cov':>15}{'build s':>9}{'query ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for pages in args.pages:
+            path, planted = write_filing(directory, pages, args.facts, rng)
+            with open(path) as f:
+                prefix = f.read(PREFIX_CHARS)
+            map_reduce_chars = sum(end - start for start, end in iter_chunk_spans(path))
+
+            started = time.perf_counter()
+            build_passage_index(path)
+            build_s = time.perf_counter() - started
+            index = load_passage_index(path)
+
+            prefix_hits = retrieval_hits = retrieval_chars = 0
+            started = time.perf_counter()
+            for witness, fact in planted.items():
+                passages = index.search(f"When is the deposition of {witness}?", args.top_k)
+                retrieval_chars += sum(len(p.text) for p in passages)
+                retrieval_hits += any(fact in p.text for p in passages)
+                prefix_hits += fact in prefix
+            query_ms = 1000 * (time.perf_counter() - started) / len(planted)
+
+            n = len(planted)
+            print(f"{pages:>6}{len(prefix):>14}{prefix_hits / n:>12.0%}{map_reduce_chars:>18}"
+                  f"{retrieval_chars // n:>17}{retrieval_hits / n:>15.0%}{build_s:>9.2f}{query_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+/results search over many document results: the old `content ILIKE '%q%'` query (every match loaded,
+newest first) versus the full-text index of core/result_search.py (ranked, one page with snippets).
+
+Seeds --rows synthetic results of about 40 words for one user, in a throwaway Postgres schema and a
+temporary SQLite file, with the schema setup_schema gives the app. Then times, for a rare term (a few
+hundred matches) and a common one (about one row in twenty): the ILIKE query, the first search page and
+the page --depth pages in (reached through the cursors). Reports the median of --repeat runs and the
+number of matches. The schema and the file are removed afterwards.
+
+    python -m benchmarks.bench_results_search --rows 1000000 --repeat 5
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+from core.app_database import setup_schema
+from core.result_search import RESULTS_PAGE_SIZE, search_results, encode_search_cursor, decode_search_cursor
+from app import db, User, LegalDocumentResult
+
+SCHEMA = "bench_result_search"
+USER_ID = 1
+SEED_BATCH = 50000
+COMMON_WORDS = ["lease", "tenant", "landlord", "notice", "rent", "deposit", "repair", "court", "hearing", "party",
+                "agreement", "payment", "property", "premises", "term", "clause", "damages", "breach", "order", "claim"]
+FILLER = ["the", "a", "of", "to", "and", "is", "for", "on", "by", "with", "under", "shall", "be", "this", "that"]
+# One rare word per 2,500 rows or so
+RARE_WORDS = [f"matter{n:05d}" for n in range(400)]
+
+
+def postgres_url():
+    return (f"postgresql+psycopg2://{os.getenv('POSTGRES_USER', 'secretary')}:{os.getenv('POSTGRES_PASSWORD', 'secretarypass')}"
+            f"@{os.getenv('POSTGRES_HOST', 'db')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'secretary_pm')}")
+
+
+def synthetic_content(rng):
+    words = [rng.choice(FILLER) if rng.random() < 0.5 else rng.choice(COMMON_WORDS[:rng.randint(1, len(COMMON_WORDS))])
+             for _ in range(40)]
+    if rng.random() < 0.15:
+        words[rng.randrange(40)] = rng.choice(RARE_WORDS)
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_rows(rows):
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1)
+    for n in range(rows):
+        yield {"user_id": USER_ID, "doc_id": f"bench-{n % 5000}", "result_type": "summary",
+               "content": synthetic_content(rng), "created_at": start + timedelta(seconds=30 * n)}
+
+
+def seed(engine, rows):
+    setup_schema(db.metadata, engine)
+    with Session(engine) as session:
+        session.add(User(id=USER_ID, username="bench-search", email="bench-search@example.com", password_hash="-"))
+        session.commit()
+    batches = synthetic_rows(rows)
+    seeded = 0
+    while seeded < rows:
+        batch = [next(batches) for _ in range(min(SEED_BATCH, rows - seeded))]
+        if engine.dialect.name == "postgresql":
+            # COPY is much faster than INSERT; the tsvector column and the GIN index update as rows arrive
+            buffer = io.StringIO("".join(f"{r['user_id']}\t{r['doc_id']}\t{r['result_type']}\t{r['content']}\t"
+                                         f"{r['created_at'].isoformat()}\n" for r in batch))
+            connection = engine.raw_connection()
+            try:
+                connection.cursor().copy_expert("COPY legal_document_result (user_id, doc_id, result_type, content, created_at) "
+                                                "FROM STDIN", buffer)
+                connection.commit()
+            finally:
+                connection.close()
+        else:
+            with engine.begin() as connection:
+                connection.execute(insert(LegalDocumentResult.__table__), batch)
+        seeded += len(batch)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE legal_document_result"))
+
+
+def timed(call, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - started)
+    return 1000 * statistics.median(timings), result
+
+
+def ilike(session, term):
+    # The query /results ran before the full-text index
+    return (session.query(LegalDocumentResult).filter_by(user_id=USER_ID)
+            .filter(LegalDocumentResult.content.ilike(f"%{term}%"))
+            .order_by(LegalDocumentResult.created_at.desc()).all())
+
+
+def deep_cursor(session, term, depth):
+    """The cursor of the page depth pages in, or of the last page if there are fewer."""
+    after = None
+    for _ in range(depth):
+        page = search_results(session, USER_ID, term, after=after, limit=RESULTS_PAGE_SIZE + 1)
+        if len(page) <= RESULTS_PAGE_SIZE:
+            break
+        after = decode_search_cursor(encode_search_cursor(page[RESULTS_PAGE_SIZE - 1]))
+    return after
+
+
+def report(name, engine, terms, repeat, depth):
+    with Session(engine) as session:
+        for label, term in terms:
+            ilike_ms, matches = timed(lambda: ilike(session, term), repeat)
+            session.expunge_all()
+            first_ms, _ = timed(lambda: search_results(session, USER_ID, term, limit=RESULTS_PAGE_SIZE), repeat)
+            after = deep_cursor(session, term, depth)
+            deep_ms, _ = timed(lambda: search_results(session, USER_ID, term, after=after, limit=RESULTS_PAGE_SIZE), repeat)
+            print(f"{name:>10}{label:>8}{len(matches):>10}{ilike_ms:>12.1f}{first_ms:>14.1f}{deep_ms:>14.1f}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=5, help="pages walked before the deep page")
+    parser.add_argument("--postgres-url", default=None, help="defaults to the POSTGRES_* settings")
+    args = parser.parse_args()
+
+    terms = [("rare", RARE_WORDS[0]), ("common", COMMON_WORDS[-1])]
+    print(f"{'database':>10}{'term':>8}{'matches':>10}{'ILIKE ms':>12}{'first page ms':>14}{'deep page ms':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        seed(engine, args.rows)
+        report("sqlite", engine, terms, args.repeat, args.depth)
+        engine.dispose()
+
+    url = args.postgres_url or postgres_url()
+    admin = create_engine(url)
+    with admin.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    try:
+        seed(engine, args.rows)
+        report("postgres", engine, terms, args.repeat, args.depth)
+    finally:
+        engine.dispose()
+        with admin.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+        admin.dispose()
+
+
+if __name__ == "__main__":
+    main()
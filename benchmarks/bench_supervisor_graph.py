@@ -0,0 +1,65 @@
+"""
+Microbenchmark: per-email overhead of supervisor_langgraph when the graph is
+rebuilt and compiled for every email versus reusing the module-level compiled graph.
+
+The agents are replaced with no-op stubs so only graph construction/invocation is measured.
+
+    python -m benchmarks.bench_supervisor_graph --emails 3000
+"""
+import argparse
+import time
+from unittest.mock import patch
+
+from agents import filtering_agent, summarization_agent, response_agent
+from core import supervisor
+from core.state import EmailState
+
+
+def synthetic_emails(n):
+    return [
+        {"id": str(i), "from": f"tenant{i}@example.com", "subject": f"Issue #{i}", "body": "The sink is leaking again."}
+        for i in range(n)
+    ]
+
+
+def run_per_email_compile(emails):
+    # The pre-change behaviour: build and compile a graph for every email.
+    for email in emails:
+        state = EmailState(current_email=email, user_name="Secretary", recipient_name="Tenant")
+        supervisor.build_email_graph().compile().invoke(state)
+
+
+def run_shared_graph(emails):
+    for email in emails:
+        supervisor.supervisor_langgraph(email, EmailState(), "Secretary", "Tenant")
+
+
+def timed(fn, emails):
+    started = time.perf_counter()
+    fn(emails)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=3000)
+    args = parser.parse_args()
+    emails = synthetic_emails(args.emails)
+
+    with patch.object(filtering_agent, "filter_email", lambda email: "ham", create=True), \
+         patch.object(summarization_agent, "summarize_email", lambda email: "summary"), \
+         patch.object(response_agent, "generate_response", lambda *a, **kw: "Noted."):
+        supervisor.get_email_graph()  # exclude the one-time compile from the steady-state numbers
+        results = [
+            ("compile per email", timed(run_per_email_compile, emails)),
+            ("shared compiled graph", timed(run_shared_graph, emails)),
+        ]
+
+    print(f"{'mode':<24}{'total s':>10}{'per email ms':>15}")
+    for name, seconds in results:
+        print(f"{name:<24}{seconds:>10.2f}{1000 * seconds / len(emails):>15.3f}")
+    print(f"speedup: {results[0][1] / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Requests/sec and latency of the web tier under gunicorn's sync workers (one request per worker at a
+time, the deployment before gunicorn.conf.py) versus gevent workers (WEB_WORKER_CONNECTIONS per worker).
+
+Seeds a `bench-web` user with results in the app's SQLite database and `bench-web-*` emails in Postgres
+(all deleted afterwards), then for each worker setup starts `gunicorn app:app` and has --clients logged-in
+clients request /dashboard, /results, /task_status/<id> and /email/<id> in turn for --seconds. Postgres is
+reached through a proxy that delays each reply by --db-latency seconds, standing in for a database on
+another host; with --db-latency 0 the benchmark mostly measures this machine's CPU.
+
+    python -m benchmarks.bench_web_workers --clients 64 --seconds 15 --db-latency 0.005 --setups sync:2 gevent:2
+"""
+import argparse
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+USERNAME = "bench-web"
+PASSWORD = "bench-web-password"
+EMAIL_IDS = [f"bench-web-{i}" for i in range(20)]
+TASK_IDS = [f"bench-web-task-{i}" for i in range(20)]
+
+
+def start_latency_proxy(target, latency):
+    """A TCP proxy to target that holds each chunk coming back from it for latency seconds."""
+    def pump(source, sink, delay):
+        try:
+            while data := source.recv(65536):
+                if delay:
+                    time.sleep(delay)
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, sink):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            upstream = socket.create_connection(target)
+            threading.Thread(target=pump, args=(self.request, upstream, 0), daemon=True).start()
+            pump(upstream, self.request, latency)
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+        request_queue_size = 1024
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def seed():
+    from app import app, db, User, LegalDocumentResult
+    from core.database import setup_database
+    from core.email_ingestion import ingest_emails
+    setup_database()
+    ingest_emails([{"id": email_id, "from": "tenant@example.com", "subject": f"Bench subject {i}",
+                    "body": "The heater is broken.", "timestamp": f"2099-01-01T10:{i:02d}:00"}
+                   for i, email_id in enumerate(EMAIL_IDS)], source="bench", enqueue_documents=False)
+    with app.app_context():
+        user = User.query.filter_by(username=USERNAME).first()
+        if user is None:
+            user = User(username=USERNAME, email=f"{USERNAME}@example.com")
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+        LegalDocumentResult.query.filter_by(user_id=user.id).delete()
+        db.session.add_all(LegalDocumentResult(user_id=user.id, doc_id=f"bench-doc-{i}", result_type="summary",
+                                               content=f"Summary {i} of a lease dispute.", task_id=task_id)
+                           for i, task_id in enumerate(TASK_IDS))
+        db.session.commit()
+
+
+def clean_up():
+    from app import app, db, User, LegalDocumentResult
+    from core.database import db_cursor
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM emails WHERE id = ANY(%s)", (EMAIL_IDS,))
+    with app.app_context():
+        user = User.query.filter_by(username=USERNAME).first()
+        if user is not None:
+            LegalDocumentResult.query.filter_by(user_id=user.id).delete()
+            db.session.delete(user)
+            db.session.commit()
+
+
+def urls(base, i):
+    paths = ["/dashboard", "/results", f"/task_status/{TASK_IDS[i % len(TASK_IDS)]}",
+             f"/email/{EMAIL_IDS[i % len(EMAIL_IDS)]}"]
+    return base + paths[i % len(paths)]
+
+
+def start_gunicorn(worker_class, workers, port, env, log):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+         "--worker-class", worker_class, "--workers", str(workers)],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=2)
+            return server
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start within 120s")
+
+
+def run_load(base, clients, seconds):
+    """Latencies of the requests completed in the timed window, and the number of failed ones."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    window = {}
+    # The window starts once every client has logged in and warmed up
+    ready = threading.Barrier(clients + 1, action=lambda: window.update(end=time.perf_counter() + seconds))
+
+    def client(n):
+        session = requests.Session()
+        session.post(base + "/login", data={"username": USERNAME, "password": PASSWORD}, timeout=60)
+        for i in range(4):  # warm-up: one request per route
+            session.get(urls(base, n + i), timeout=60)
+        ready.wait()
+        mine, failed, i = [], 0, n
+        while time.perf_counter() < window["end"]:
+            started = time.perf_counter()
+            try:
+                ok = session.get(urls(base, i), timeout=60, allow_redirects=False).status_code == 200
+            except requests.RequestException:
+                ok = False
+            finished = time.perf_counter()
+            if finished <= window["end"]:
+                if ok:
+                    mine.append(finished - started)
+                else:
+                    failed += 1
+            i += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds added to each Postgres reply")
+    parser.add_argument("--setups", nargs="+", default=["sync:2", "gevent:2"], help="worker_class:workers pairs")
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    seed()
+    proxy = start_latency_proxy((os.getenv("POSTGRES_HOST", "db"), int(os.getenv("POSTGRES_PORT", "5432"))),
+                                args.db_latency)
+    env = dict(os.environ, POSTGRES_HOST="127.0.0.1", POSTGRES_PORT=str(proxy.server_address[1]))
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        print(f"{'workers':>10}{'clients':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for setup in args.setups:
+            worker_class, workers = setup.split(":")
+            log_path = f"bench_web_workers_{worker_class}.log"
+            with open(log_path, "w") as log:
+                server = start_gunicorn(worker_class, int(workers), args.port, env, log)
+                try:
+                    latencies, errors = run_load(base, args.clients, args.seconds)
+                finally:
+                    server.terminate()
+                    server.wait(timeout=60)
+            if not latencies:
+                with open(log_path) as f:
+                    sys.stderr.write(f.read())
+                raise RuntimeError(f"No request succeeded with {setup}")
+            os.remove(log_path)
+            p50 = latencies[int(0.5 * (len(latencies) - 1))]
+            p99 = latencies[int(0.99 * (len(latencies) - 1))]
+            print(f"{setup:>10}{args.clients:>9}{len(latencies) / args.seconds:>9.1f}{1000 * p50:>9.1f}"
+                  f"{1000 * p99:>9.1f}{errors:>8}", flush=True)
+    finally:
+        proxy.shutdown()
+        clean_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Throughput and memory of Celery worker pools for LLM-bound tasks: prefork (one process per task in
+flight), threads and gevent (hundreds of tasks in flight in one process).
+
+Starts a local OpenAI-compatible endpoint that answers every chat completion after --latency seconds,
+then for each pool starts a worker of celery_worker.celery_app on its own queue, sends --tasks tasks
+that each make one call through the shared LLM client registry, and reports tasks/sec and the peak RSS
+of the worker and its child processes. The broker and result backend are directories in a temporary
+folder, so no Redis is needed; that broker hands out messages far slower than Redis, so past a few dozen
+tasks in flight the tasks/sec of threads and gevent measure it rather than the pool.
+
+    python -m benchmarks.bench_worker_pools --tasks 400 --latency 0.5 --pools prefork:4 threads:100 gevent:200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+
+def configure(directory, outbox="broker"):
+    """
+    Points celery_worker.celery_app at a directory broker and registers the benchmark task. The sender
+    writes to outbox and release() moves the messages into the broker folder, so a worker never reads a
+    message file that is still being written.
+    """
+    from langchain_openai import ChatOpenAI
+    from celery_worker import celery_app, response_text
+    from core.llm_clients import get_llm_client
+
+    celery_app.conf.broker_url = "filesystem://"
+    celery_app.conf.broker_transport_options = {
+        "data_folder_in": os.path.join(directory, "broker"), "data_folder_out": os.path.join(directory, outbox),
+        "control_folder": os.path.join(directory, "control"), "polling_interval": 0.01,
+    }
+    celery_app.conf.result_backend = "file://" + os.path.join(directory, "results")
+
+    @celery_app.task(name="bench.ask_mock_llm")
+    def ask_mock_llm(prompt):
+        client = get_llm_client(ChatOpenAI, model="mock", temperature=0.0, openai_api_key="bench",
+                                base_url=os.environ["BENCH_LLM_URL"], max_retries=0)
+        return response_text(client.invoke(prompt))
+
+    return celery_app, ask_mock_llm
+
+
+# The workers started below import this module with the benchmark's directory set.
+if os.getenv("BENCH_WORKER_POOLS_DIR"):
+    app, _ = configure(os.environ["BENCH_WORKER_POOLS_DIR"])
+
+
+def release(directory):
+    for name in sorted(os.listdir(os.path.join(directory, "outbox"))):
+        os.replace(os.path.join(directory, "outbox", name), os.path.join(directory, "broker", name))
+
+
+def start_mock_llm(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            body = json.dumps({
+                "id": "mock", "object": "chat.completion", "created": 0, "model": "mock",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def tree_rss(process):
+    total = 0
+    for p in [process, *process.children(recursive=True)]:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def run_pool(task, directory, pool, concurrency, tasks, env, log):
+    from celery.result import ResultSet
+    queue = f"bench-{pool}"
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "benchmarks.bench_worker_pools:app", "worker", "-P", pool,
+         "-c", str(concurrency), "-Q", queue, "--loglevel=error", "-n", f"{queue}@%h", "--without-heartbeat",
+         "--without-gossip", "--without-mingle"],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    process = psutil.Process(worker.pid)
+    peak = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, tree_rss(process))
+            time.sleep(0.1)
+
+    try:
+        warm_up = task.apply_async(("warm-up",), queue=queue)
+        release(directory)
+        warm_up.get(timeout=300)
+        idle = tree_rss(process)
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        results = ResultSet([task.apply_async((f"question {i}",), queue=queue) for i in range(tasks)])
+        started = time.perf_counter()
+        release(directory)
+        results.join(timeout=600, interval=0.05)
+        elapsed = time.perf_counter() - started
+        done.set()
+        sampler.join()
+        return tasks / elapsed, idle, max(peak, idle)
+    finally:
+        done.set()
+        worker.terminate()
+        worker.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the mock LLM takes per call")
+    parser.add_argument("--pools", nargs="+", default=["prefork:4", "threads:100", "gevent:200"],
+                        help="pool:concurrency pairs")
+    args = parser.parse_args()
+
+    server = start_mock_llm(args.latency)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("broker", "outbox", "control", "results"):
+            os.makedirs(os.path.join(directory, name))
+        env = dict(os.environ, BENCH_WORKER_POOLS_DIR=directory,
+                   BENCH_LLM_URL=f"http://127.0.0.1:{server.server_port}/v1")
+        os.environ["BENCH_LLM_URL"] = env["BENCH_LLM_URL"]
+        _, task = configure(directory, outbox="outbox")
+
+        print(f"{'pool':>10}{'concurrency':>13}{'tasks/s':>10}{'idle RSS MB':>13}{'peak RSS MB':>13}{'MB/in-flight':>14}")
+        for spec in args.pools:
+            pool, concurrency = spec.split(":")
+            log_path = os.path.join(directory, f"{pool}.log")
+            with open(log_path, "w") as log:
+                try:
+                    rate, idle, peak = run_pool(task, directory, pool, int(concurrency), args.tasks, env, log)
+                except Exception:
+                    with open(log_path) as f:
+                        sys.stderr.write(f.read())
+                    raise
+            print(f"{pool:>10}{concurrency:>13}{rate:>10.1f}{idle / 2**20:>13.0f}{peak / 2**20:>13.0f}"
+                  f"{peak / 2**20 / int(concurrency):>14.1f}", flush=True)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
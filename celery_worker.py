@@ -1,92 +1,329 @@
-from celery import Celery
-import subprocess
+from celery import Celery, chord
+from celery.signals import before_task_publish, task_prerun
+from kombu import Queue
 import os
+import shutil
 import json
+import time
+import re
+import ast
+import logging
 from config import GEMINI_API_KEY
 from langchain_google_genai import ChatGoogleGenerativeAI
+from core.llm_clients import get_llm_client, get_llm_client_for_service
+from core.llm_cache import llm_cache, model_identity
+from core.state import EmailState
+from core.supervisor import supervisor_pm_workflow, stream_pm_workflow
+from core.email_ingestion import ingest_emails
+from core.database import (start_document_job, finish_document_job, save_document_ocr_pages, save_document_route,
+                           get_ocr_seconds_per_page, get_email)
+from core.legal_results import store_analysis, ics_filename, merge_legal_fields
+from core.chunking import iter_chunk_spans, read_span, combine_partials
+from core.retrieval import build_passage_index, load_passage_index
+from core.ocr import (OCR_SHARD_MIN_PAGES, text_layer, needs_ocr, ocr_shards, split_pdf, work_dir, ocr_range,
+                      ocr_output_path, write_text, assemble, page_timings)
+from core.task_queues import QUEUES, OCR_QUEUE, INTERACTIVE_QUEUE, BATCH_QUEUE, QueueMonitor, current_queue
+from core.task_events import publish_task_event, append_response_event
+from core.llm_dispatch import invoke_llm, LLMRateLimited
+from core.gevent_io import enable_gevent_io
+from core.imap_idle import imap_latencies
+from utils.metrics import record_latency
 from ics import Calendar, Event
 
-# Configure Celery to use Redis as the broker
-celery_app = Celery('paralegal', broker='redis://redis:6379/0')
+# Configure Celery to use Redis as the broker, and as the result backend that chords and task status polling need
+celery_app = Celery(
+    'paralegal',
+    broker=os.getenv("CELERY_BROKER_URL", 'redis://redis:6379/0'),
+    backend=os.getenv("CELERY_RESULT_BACKEND", 'redis://redis:6379/0')
+)
+
+# Separate queues for OCR, interactive LLM work and batch LLM work (core/task_queues.py). Tasks not routed
+# here go to the batch queue; chunk subtasks follow the queue of the task that split the document.
+celery_app.conf.update(
+    task_queues=[Queue(name) for name in QUEUES],
+    task_default_queue=BATCH_QUEUE,
+    task_routes={
+        'celery_worker.ocr_pdf': {'queue': OCR_QUEUE},
+        'celery_worker.ocr_pdf_shard': {'queue': OCR_QUEUE},
+        'celery_worker.finish_ocr_shards': {'queue': OCR_QUEUE},
+        'celery_worker.qa_legal_document': {'queue': INTERACTIVE_QUEUE},
+        'celery_worker.summarize_legal_document': {'queue': INTERACTIVE_QUEUE},
+        'celery_worker.analyze_for_party': {'queue': INTERACTIVE_QUEUE},
+        'celery_worker.generate_email_response': {'queue': INTERACTIVE_QUEUE},
+    },
+    # Long tasks: reserve one message per slot so a busy worker does not hold back work another could start
+    worker_prefetch_multiplier=1,
+    # Redis: consume a worker's queues in the order given to -Q instead of round robin
+    broker_transport_options={'queue_order_strategy': 'priority'},
+    task_track_started=True,
+)
+queue_monitor = QueueMonitor(celery_app)
+
+# The LLM workers run on the gevent pool (docker-compose.yml), which monkey-patches the standard library
+# before this module is imported; OCR workers stay on prefork. See core/gevent_io.py.
+GEVENT_IO = enable_gevent_io()
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    headers.setdefault('enqueued_at', time.time())
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    queue = current_queue(task)
+    if enqueued_at and queue in QUEUES:
+        queue_monitor.record_wait(queue, max(0.0, time.time() - enqueued_at))
+
+# A task whose LLM calls stay rate limited (core/llm_dispatch.py) runs again later, after a growing, jittered
+# countdown, instead of its work being dropped.
+RATE_LIMIT_RETRY = dict(autoretry_for=(LLMRateLimited,), retry_backoff=30, retry_backoff_max=600, retry_jitter=True,
+                        max_retries=int(os.getenv("LLM_TASK_RATE_LIMIT_RETRIES", "10")))
+
+# Bump a version whenever its prompt changes so cached LLM responses are not reused.
+SUMMARY_PROMPT_VERSION = "1"
+QA_PROMPT_VERSION = "1"
+PARTY_ANALYSIS_PROMPT_VERSION = "1"
 
 try:
-    from app import db, LegalDocumentResult, User
-    from flask import Flask
-    flask_app = Flask(__name__)
-    flask_app.app_context().push()
+    from app import app as flask_app, db, LegalDocumentResult, User, AIUser
 except Exception:
     db = None
     LegalDocumentResult = None
+    User = None
+    AIUser = None
     flask_app = None
 
-@celery_app.task
-def ocr_pdf(pdf_path, user_id=None):
+class AppContextTask(celery_app.Task):
     """
-    Run ocrmypdf on the given PDF and save the extracted text to a .txt file.
+    Runs each task in its own Flask app context, for the models and the database session. A context pushed
+    at import time would not do: on the gevent pool every task runs in a new greenlet, which does not see it.
+    """
+    def __call__(self, *args, **kwargs):
+        if flask_app is None:
+            return super().__call__(*args, **kwargs)
+        with flask_app.app_context():
+            return super().__call__(*args, **kwargs)
+
+celery_app.Task = AppContextTask
+
+@celery_app.task(bind=True)
+def ocr_pdf(self, pdf_path, user_id=None, content_hash=None):
+    """
+    Extract the text of the given PDF to a .txt file (core/ocr.py): pages with a text layer are read as they
+    are and only the rest are OCR'd. More than OCR_SHARD_MIN_PAGES pages to OCR are split into shards OCR'd
+    in parallel by ocr_pdf_shard tasks; the task is replaced by that chord and finish_ocr_shards completes it.
+    With a content_hash (see core/document_jobs.py) the run is tracked in document_jobs and
+    skipped if that job is not queued, so a redelivered task never runs OCR twice.
     """
     base, _ = os.path.splitext(pdf_path)
     txt_path = base + '.txt'
+    if content_hash and not start_document_job(content_hash):
+        print(f"Skipping OCR for {pdf_path}: job {content_hash[:12]} is not queued")
+        return None
+    started = time.time()
     try:
-        # Run ocrmypdf with --sidecar to extract text
-        subprocess.run([
-            'ocrmypdf', '--sidecar', txt_path, pdf_path, pdf_path
-        ], check=True)
-        print(f"OCR complete for {pdf_path}, text saved to {txt_path}")
-        # After OCR, trigger LLM analysis
-        analyze_legal_document.delay(txt_path, user_id)
+        texts = text_layer(pdf_path)
     except Exception as e:
-        print(f"OCR failed for {pdf_path}: {e}")
-    return txt_path
+        # Unreadable here; let ocrmypdf try the whole file and report why it fails
+        print(f"Reading the text layer of {pdf_path} failed: {e}")
+        try:
+            result = ocr_range(pdf_path, ocr_output_path(pdf_path), txt_path)
+        except Exception as e:
+            return fail_ocr(pdf_path, txt_path, content_hash, e)
+        pages = range(len(result["ocr"]))
+        return finish_ocr(pdf_path, txt_path, len(pages), page_timings(result, pages), user_id, content_hash, started)
+
+    ocr_pages = [page for page, text in enumerate(texts) if needs_ocr(text)]
+    if not ocr_pages:
+        write_text(txt_path, "\f".join(texts))
+        return finish_ocr(pdf_path, txt_path, len(texts), [], user_id, content_hash, started)
+    shards = ocr_shards(ocr_pages) if len(ocr_pages) > OCR_SHARD_MIN_PAGES else [ocr_pages]
+    try:
+        shard_paths = split_pdf(pdf_path, shards, work_dir(pdf_path))
+    except Exception as e:
+        return fail_ocr(pdf_path, txt_path, content_hash, e)
+    if len(shards) == 1:
+        return finish_ocr_shards([ocr_pdf_shard(shard_paths[0], ocr_pages)], pdf_path, txt_path, user_id, content_hash, started)
+    print(f"OCR of {pdf_path}: {len(ocr_pages)} of {len(texts)} pages in {len(shards)} shards")
+    header = [ocr_pdf_shard.s(path, pages) for path, pages in zip(shard_paths, shards)]
+    raise self.replace(chord(header, finish_ocr_shards.s(pdf_path, txt_path, user_id, content_hash, started)))
+
+@celery_app.task
+def ocr_pdf_shard(shard_path, pages):
+    base, _ = os.path.splitext(shard_path)
+    try:
+        result = ocr_range(shard_path, base + '.ocr.pdf', base + '.txt', force=True)
+    except Exception as e:
+        print(f"OCR of {shard_path} failed: {e}")
+        return {"error": str(e)}
+    return dict(result, pages=pages, pdf_path=base + '.ocr.pdf', txt_path=base + '.txt')
 
 @celery_app.task
-def analyze_legal_document(txt_path, user_id=None):
+def finish_ocr_shards(results, pdf_path, txt_path, user_id=None, content_hash=None, started=None):
+    try:
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(results)} OCR shards failed: {errors[0]}")
+        page_total = assemble(pdf_path, results, txt_path, ocr_output_path(pdf_path))
+    except Exception as e:
+        return fail_ocr(pdf_path, txt_path, content_hash, e)
+    finally:
+        shutil.rmtree(work_dir(pdf_path), ignore_errors=True)
+    timings = [row for shard, result in enumerate(results) for row in page_timings(result, result["pages"], shard)]
+    return finish_ocr(pdf_path, txt_path, page_total, timings, user_id, content_hash, started)
+
+def fail_ocr(pdf_path, txt_path, content_hash, error):
+    print(f"OCR failed for {pdf_path}: {error}")
+    if content_hash:
+        finish_document_job(content_hash, "failed", error=str(error))
+    return txt_path
+
+def finish_ocr(pdf_path, txt_path, page_total, timings, user_id, content_hash, started):
+    """Queues analysis of the finished text, then records how it was produced."""
+    # The text is ready: start the analysis before any bookkeeping
+    analyze_legal_document.delay(txt_path, user_id)
+    elapsed = time.time() - started
+    ocr_timings = [row for row in timings if row["ocr"]]
+    route = "text_layer" if not ocr_timings else "ocr" if len(ocr_timings) == page_total else "mixed"
+    record_latency(f"document_text_{route}", elapsed)
+    print(f"Text of {pdf_path} ready in {elapsed:.1f}s via {route} "
+          f"({len(ocr_timings)} of {page_total} pages OCR'd), saved to {txt_path}")
+    if content_hash:
+        if ocr_timings:
+            seconds_per_page = sum(row["seconds"] for row in ocr_timings) / len(ocr_timings)
+        else:
+            seconds_per_page = get_ocr_seconds_per_page()
+        saved = (page_total - len(ocr_timings)) * seconds_per_page if seconds_per_page is not None else None
+        save_document_ocr_pages(content_hash, timings)
+        save_document_route(content_hash, route, page_total, len(ocr_timings), elapsed, saved)
+        finish_document_job(content_hash, "done", txt_path=txt_path)
+    # Index the text once so questions only send relevant passages
+    try:
+        build_passage_index(txt_path)
+    except Exception as e:
+        print(f"Indexing {txt_path} failed: {e}")
+    return txt_path
+
+# --- Long documents: chunked map-reduce ---
+# The OCR text is split into overlapping chunks (core/chunking.py). A document that fits in one chunk is
+# processed inline; a longer one is replaced by a chord of map_document_chunk subtasks, one per chunk, whose
+# results reach reduce_document_chunks in document order. Chunks are passed as byte offsets and read by the
+# subtask, so no process holds the whole document.
+DOCUMENT_CHUNK_SIZE = int(os.getenv("DOCUMENT_CHUNK_SIZE", "4000"))
+DOCUMENT_CHUNK_OVERLAP = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "400"))
+
+def document_chunk_spans(txt_path):
+    return list(iter_chunk_spans(txt_path, DOCUMENT_CHUNK_SIZE, DOCUMENT_CHUNK_OVERLAP)) or [(0, 0)]
+
+def map_chunk(kind, txt_path, start, end, index, total, **params):
+    try:
+        return CHUNK_MAPPERS[kind](read_span(txt_path, start, end), index, total, **params)
+    except LLMRateLimited:
+        raise
+    except Exception as e:
+        print(f"{kind} of chunk {index + 1}/{total} of {txt_path} failed: {e}")
+        return None
+
+def run_chunked(task, kind, txt_path, **params):
+    try:
+        spans = document_chunk_spans(txt_path)
+    except OSError as e:
+        print(f"Reading {txt_path} for {kind} failed: {e}")
+        return None
+    if len(spans) == 1:
+        start, end = spans[0]
+        return reduce_chunks(kind, [map_chunk(kind, txt_path, start, end, 0, 1, **params)], txt_path, **params)
+    print(f"Splitting {txt_path} into {len(spans)} chunks for {kind}")
+    options = {'queue': current_queue(task)} if current_queue(task) else {}
+    header = [map_document_chunk.s(kind, txt_path, start, end, index, len(spans), **params).set(**options)
+              for index, (start, end) in enumerate(spans)]
+    # The chord takes over this task's id, so callers polling it see the reduced result.
+    raise task.replace(chord(header, reduce_document_chunks.s(kind, txt_path, **params).set(**options)))
+
+@celery_app.task(**RATE_LIMIT_RETRY)
+def map_document_chunk(kind, txt_path, start, end, index, total, **params):
+    return map_chunk(kind, txt_path, start, end, index, total, **params)
+
+def reduce_chunks(kind, partials, txt_path, **params):
+    result = CHUNK_REDUCERS[kind](partials, txt_path, **params)
+    # Tasks a user started from the dashboard carry their id; tell the user's open /task_events streams
+    if params.get("task_id"):
+        publish_task_event(params.get("user_id"), params["task_id"], "SUCCESS" if result else "FAILURE")
+    return result
+
+@celery_app.task(**RATE_LIMIT_RETRY)
+def reduce_document_chunks(partials, kind, txt_path, **params):
+    return reduce_chunks(kind, partials, txt_path, **params)
+
+def combine_texts(partials, model, namespace, version, temperature, instruction):
+    """Merges per-chunk texts with the LLM, a bounded group per call, until one text is left."""
+    def combine(group):
+        prompt = instruction + "\n\n" + "\n\n".join(f"Part {i + 1}:\n{text}" for i, text in enumerate(group))
+        return ask_llm(model, namespace, version, temperature, prompt)
+    return combine_partials(partials, combine, DOCUMENT_CHUNK_SIZE)
+
+def ask_llm(model, namespace, version, temperature, prompt):
+    return llm_cache.get_or_compute(
+        namespace, version, model_identity(model), temperature, prompt,
+        lambda: response_text(invoke_llm(model, prompt))
+    )
+
+def parse_json_object(content):
+    """Returns the first JSON object in a model reply, or None."""
+    match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not match:
+        logging.error(f"No JSON found in LLM response: {content}")
+        return None
+    json_str = match.group(0)
+    try:
+        return json.loads(json_str)
+    except Exception:
+        # Try ast.literal_eval as fallback
+        try:
+            return ast.literal_eval(json_str)
+        except Exception as e:
+            logging.error(f"Failed to parse LLM JSON: {e}\nRaw: {json_str}")
+            return None
+
+@celery_app.task(bind=True, **RATE_LIMIT_RETRY)
+def analyze_legal_document(self, txt_path, user_id=None):
     """
     Call Gemini LLM to analyze the legal document text and extract metadata.
+    Long documents are analyzed chunk by chunk and the extracted fields merged.
     """
+    return run_chunked(self, "legal_analysis", txt_path, user_id=user_id)
+
+def extract_legal_fields(text, index, total, **params):
+    scope = "legal document text" if total == 1 else f"text of part {index + 1} of {total} of a legal document"
+    # Build prompt for Gemini
+    prompt = (
+        "You are a legal document analysis assistant. "
+        f"Given the following {scope}, extract the following as JSON: "
+        "document_type (e.g. Motion, Order, Notice, etc.), "
+        "case_number, court, parties (list), event_dates (list of ISO 8601 datetimes for hearings, deadlines, etc.)"
+        + (", and a raw_excerpt (first 200 chars of the text). " if index == 0 else ". ") +
+        "If any field is missing, use null or an empty list.\n\n"
+        f"Document Text:\n{text}"
+    )
+    model = get_llm_client(
+        ChatGoogleGenerativeAI,
+        model="gemini-2.0-flash",
+        temperature=0.2,
+        google_api_key=GEMINI_API_KEY
+    )
+    result = parse_json_object(response_text(invoke_llm(model, prompt)))
+    # Add excerpt if not present
+    if result is not None and index == 0 and 'raw_excerpt' not in result:
+        result['raw_excerpt'] = text[:200]
+    return result
+
+def save_legal_analysis(partials, txt_path, user_id=None):
     try:
-        with open(txt_path, 'r') as f:
-            text = f.read()
-        # Build prompt for Gemini
-        prompt = (
-            "You are a legal document analysis assistant. "
-            "Given the following legal document text, extract the following as JSON: "
-            "document_type (e.g. Motion, Order, Notice, etc.), "
-            "case_number, court, parties (list), event_dates (list of ISO 8601 datetimes for hearings, deadlines, etc.), "
-            "and a raw_excerpt (first 200 chars of the text). "
-            "If any field is missing, use null or an empty list.\n\n"
-            f"Document Text:\n{text[:4000]}"
-        )
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0.2,
-            google_api_key=GEMINI_API_KEY
-        )
-        response = model.invoke(prompt)
-        # Try to parse the response as JSON
-        import re
-        import ast
-        import logging
-        # Extract JSON from response
-        content = response.content if hasattr(response, "content") else str(response)
-        # Try to find the first JSON object in the response
-        match = re.search(r'\{.*\}', content, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-            try:
-                result = json.loads(json_str)
-            except Exception:
-                # Try ast.literal_eval as fallback
-                try:
-                    result = ast.literal_eval(json_str)
-                except Exception as e:
-                    logging.error(f"Failed to parse LLM JSON: {e}\nRaw: {json_str}")
-                    return None
-        else:
-            logging.error(f"No JSON found in LLM response: {content}")
+        partials = [partial for partial in partials if partial]
+        if not partials:
+            print(f"LLM analysis for {txt_path} produced no result")
             return None
-        # Add excerpt if not present
-        if 'raw_excerpt' not in result:
-            result['raw_excerpt'] = text[:200]
+        result = partials[0] if len(partials) == 1 else merge_legal_fields(partials)
         # Add user_id to result
         result['user_id'] = user_id
         print(f"LLM analysis for {txt_path}: {result}")
@@ -98,6 +335,8 @@ def analyze_legal_document(txt_path, user_id=None):
         with open(result_path, 'w') as out:
             json.dump(result, out)
         print(f"Saved LLM result to {result_path}")
+        # Index the result for the dashboard
+        store_analysis(base, result, user_id, txt_path)
         # Generate ICS files for each event date
         ics_dir = '/app/ics'
         os.makedirs(ics_dir, exist_ok=True)
@@ -110,14 +349,7 @@ def analyze_legal_document(txt_path, user_id=None):
             e.begin = dt
             e.description = f"{doc_type} in {result.get('court', '')} for case {case_number}. Parties: {', '.join(result.get('parties', []))}"
             c.events.add(e)
-            safe_case = case_number.replace('/', '_').replace(' ', '_')
-            safe_doc = doc_type.replace(' ', '_')
-            safe_dt = dt.replace(':', '').replace('-', '').replace('T', '_')
-            ics_filename = f"{safe_case}_{safe_doc}_{safe_dt}"
-            if user_id:
-                ics_filename += f"_user{user_id}"
-            ics_filename += ".ics"
-            ics_path = os.path.join(ics_dir, ics_filename)
+            ics_path = os.path.join(ics_dir, ics_filename(case_number, doc_type, dt, user_id))
             with open(ics_path, 'w') as icsfile:
                 icsfile.writelines(c)
             print(f"Generated ICS file: {ics_path}")
@@ -126,6 +358,78 @@ def analyze_legal_document(txt_path, user_id=None):
         print(f"LLM analysis failed for {txt_path}: {e}")
         return None
 
+@celery_app.task(**RATE_LIMIT_RETRY)
+def process_incoming_email(email, profile_id=None, enqueued_at=None, user_id=None):
+    """
+    Run the property management workflow on a message picked up by the IMAP IDLE listener
+    (core/imap_idle.py) and record how long it took from arrival to classification. Documents attached
+    to it are analysed for user_id, the owner of the profile.
+    """
+    started = time.time()
+    if enqueued_at:
+        imap_latencies.record("imap_queue_wait", max(0.0, started - enqueued_at))
+    try:
+        state = supervisor_pm_workflow(email, EmailState(emails=[email]))
+    except LLMRateLimited:
+        raise
+    except Exception as e:
+        print(f"PM workflow failed for email {email.get('id')} from profile {profile_id}: {e}")
+        return None
+    processed = state.current_email
+    if processed.get("received_at") and processed.get("classified_at"):
+        imap_latencies.record("imap_arrival_to_classified", max(0.0, processed["classified_at"] - processed["received_at"]))
+    try:
+        ingest_emails([processed], source="imap", user_id=user_id)
+    except Exception as e:
+        print(f"Storing email {processed.get('id')} failed: {e}")
+    return {
+        "email_id": processed.get("id"),
+        "profile_id": profile_id,
+        "category": processed.get("category"),
+        "actions_taken": processed.get("actions_taken", []),
+    }
+
+@celery_app.task(bind=True, **RATE_LIMIT_RETRY)
+def generate_email_response(self, email_id, user_id=None):
+    """
+    Run the property management workflow on a stored email for the edit-response page. Each event of
+    stream_pm_workflow (status, the response text as it is written, done) goes to the task's Redis stream
+    as it happens (core/task_events.py), so the web process only relays it. The result carries the
+    response, how long each step took and user_id, the user who asked for it.
+    """
+    task_id = self.request.id
+    email = get_email(email_id)
+    if not email:
+        append_response_event(task_id, "error", {"error": "Email not found."})
+        raise ValueError(f"Email {email_id} not found")
+    email = dict(email)
+    state = EmailState(emails=[email])
+    try:
+        for name, data in stream_pm_workflow(email, state):
+            # A retry (after an LLM rate limit) repeats the workflow; its ticket is not opened twice
+            # (create_maintenance_ticket_db), and the page has already had "classifying"
+            if self.request.retries and (name, data) == ("status", {"step": "classifying"}):
+                continue
+            append_response_event(task_id, name, data)
+    except LLMRateLimited:
+        if self.request.retries < self.max_retries:
+            append_response_event(task_id, "status", {"step": "rate_limited"})
+        else:
+            append_response_event(task_id, "error", {"error": "The language model is at its rate limit; try again later."})
+        raise
+    except Exception:
+        append_response_event(task_id, "error", {"error": "Generating the response failed."})
+        raise
+    processed = state.current_email
+    return {
+        "email_id": email_id,
+        "category": processed.get("category"),
+        "actions_taken": processed.get("actions_taken", []),
+        "response": processed.get("response"),
+        "step_timings": processed.get("step_timings", {}),
+        "user_id": user_id,
+    }
+
 def get_user_gemini_key(user_id):
     if db and User and user_id:
         user = User.query.get(user_id)
@@ -133,26 +437,62 @@ def get_user_gemini_key(user_id):
             return user.gemini_api_key
     return GEMINI_API_KEY
 
-@celery_app.task
-def summarize_legal_document(txt_path, user_id=None, doc_id=None):
+def response_text(response):
+    return response.content if hasattr(response, "content") else str(response)
+
+def get_llm_for_user(user_id, temperature, ai_user_id=None):
+    """
+    Returns a shared chat client for a task: the AI user's configured LLM service if it has one,
+    otherwise Gemini with the user's own key (falling back to the global key).
+    """
+    if db and AIUser and ai_user_id:
+        ai_user = AIUser.query.filter_by(id=ai_user_id, user_id=user_id).first()
+        if ai_user and ai_user.llm_service:
+            service = ai_user.llm_service
+            return get_llm_client_for_service(service.service_type, service.api_key, temperature)
+    return get_llm_client(
+        ChatGoogleGenerativeAI,
+        model="gemini-2.0-flash",
+        temperature=temperature,
+        google_api_key=get_user_gemini_key(user_id)
+    )
+
+@celery_app.task(bind=True, **RATE_LIMIT_RETRY)
+def summarize_legal_document(self, txt_path, user_id=None, doc_id=None, ai_user_id=None):
     """
     Summarize the legal document in 3-5 sentences using the LLM.
+    Long documents are summarized chunk by chunk and the chunk summaries combined.
     """
-    try:
-        with open(txt_path, 'r') as f:
-            text = f.read()
+    return run_chunked(self, "summary", txt_path, user_id=user_id, doc_id=doc_id, ai_user_id=ai_user_id,
+                       task_id=self.request.id)
+
+def summarize_chunk(text, index, total, user_id=None, ai_user_id=None, **params):
+    if total == 1:
         prompt = (
             "You are a legal assistant. Summarize the following legal document in 3-5 sentences, focusing on the main issues, parties, and outcomes.\n\n"
-            f"Document Text:\n{text[:4000]}"
+            f"Document Text:\n{text}"
+        )
+        namespace = "legal_summary"
+    else:
+        prompt = (
+            f"You are a legal assistant. Summarize part {index + 1} of {total} of a legal document in a few sentences, "
+            "keeping every party, date, deadline and amount it mentions.\n\n"
+            f"Document Text:\n{text}"
         )
-        api_key = get_user_gemini_key(user_id)
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0.3,
-            google_api_key=api_key
+        namespace = "legal_summary_chunk"
+    return ask_llm(get_llm_for_user(user_id, 0.3, ai_user_id), namespace, SUMMARY_PROMPT_VERSION, 0.3, prompt)
+
+def save_summary(partials, txt_path, user_id=None, doc_id=None, ai_user_id=None, task_id=None):
+    try:
+        partials = [partial for partial in partials if partial]
+        if not partials:
+            print(f"Summarization of {txt_path} produced no result")
+            return None
+        summary = combine_texts(
+            partials, get_llm_for_user(user_id, 0.3, ai_user_id), "legal_summary_combine", SUMMARY_PROMPT_VERSION, 0.3,
+            "You are a legal assistant. The following are summaries of consecutive parts of one legal document. "
+            "Combine them into a single summary of 3-5 sentences, focusing on the main issues, parties, and outcomes."
         )
-        response = model.invoke(prompt)
-        summary = response.content if hasattr(response, "content") else str(response)
         # Save summary as a .summary.txt file next to the original txt
         summary_path = txt_path + ".summary.txt"
         with open(summary_path, 'w') as out:
@@ -164,35 +504,84 @@ def summarize_legal_document(txt_path, user_id=None, doc_id=None):
                 user_id=user_id,
                 doc_id=doc_id,
                 result_type='summary',
-                content=summary
+                content=summary,
+                task_id=task_id
             )
             db.session.add(result)
             db.session.commit()
         return summary_path
+    except LLMRateLimited:
+        raise
     except Exception as e:
         print(f"Summarization failed for {txt_path}: {e}")
         return None
 
-@celery_app.task
-def qa_legal_document(txt_path, question, user_id=None, doc_id=None):
+# Reply from a chunk that does not answer the question
+NOT_IN_PART = "NOT_IN_PART"
+# Passages sent to the model per question
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+
+@celery_app.task(bind=True, **RATE_LIMIT_RETRY)
+def qa_legal_document(self, txt_path, question, user_id=None, doc_id=None, ai_user_id=None):
     """
     Answer a user question about the legal document using the LLM.
+    Only the passages most relevant to the question are sent (core/retrieval.py); if the document
+    cannot be indexed it is asked chunk by chunk instead.
     """
     try:
-        with open(txt_path, 'r') as f:
-            text = f.read()
+        index = load_passage_index(txt_path)
+    except Exception as e:
+        print(f"No passage index for {txt_path} ({e}); asking chunk by chunk")
+        return run_chunked(self, "qa", txt_path, question=question, user_id=user_id, doc_id=doc_id, ai_user_id=ai_user_id,
+                           task_id=self.request.id)
+    try:
+        # Passages go to the model in document order, whatever their rank
+        passages = sorted(index.search(question, RETRIEVAL_TOP_K), key=lambda passage: passage.start)
+        excerpts = "\n\n".join(f"[Excerpt {i + 1}]\n{passage.text}" for i, passage in enumerate(passages))
+        prompt = (
+            "You are a legal assistant. Given the following excerpts from a legal document, answer the user's question as clearly and concisely as possible. "
+            "If the excerpts do not contain the answer, say that the document does not appear to answer it.\n\n"
+            f"Document Excerpts:\n{excerpts}\n\nQuestion: {question}\nAnswer:"
+        )
+        answer = ask_llm(get_llm_for_user(user_id, 0.2, ai_user_id), "legal_qa_retrieval", QA_PROMPT_VERSION, 0.2, prompt)
+    except LLMRateLimited:
+        raise
+    except Exception as e:
+        print(f"QA failed for {txt_path}: {e}")
+        answer = None
+    return reduce_chunks("qa", [answer], txt_path, question=question, user_id=user_id, doc_id=doc_id,
+                         ai_user_id=ai_user_id, task_id=self.request.id)
+
+def answer_from_chunk(text, index, total, question, user_id=None, ai_user_id=None, **params):
+    if total == 1:
         prompt = (
             "You are a legal assistant. Given the following legal document, answer the user's question as clearly and concisely as possible.\n\n"
-            f"Document Text:\n{text[:4000]}\n\nQuestion: {question}\nAnswer:"
+            f"Document Text:\n{text}\n\nQuestion: {question}\nAnswer:"
         )
-        api_key = get_user_gemini_key(user_id)
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0.2,
-            google_api_key=api_key
+        namespace = "legal_qa"
+    else:
+        prompt = (
+            f"You are a legal assistant. Given part {index + 1} of {total} of a legal document, answer the user's question "
+            f"using only this part. If this part does not contain the answer, reply with exactly {NOT_IN_PART}.\n\n"
+            f"Document Text:\n{text}\n\nQuestion: {question}\nAnswer:"
         )
-        response = model.invoke(prompt)
-        answer = response.content if hasattr(response, "content") else str(response)
+        namespace = "legal_qa_chunk"
+    return ask_llm(get_llm_for_user(user_id, 0.2, ai_user_id), namespace, QA_PROMPT_VERSION, 0.2, prompt)
+
+def save_answer(partials, txt_path, question, user_id=None, doc_id=None, ai_user_id=None, task_id=None):
+    try:
+        if not any(partials):
+            print(f"QA on {txt_path} produced no result")
+            return None
+        relevant = [partial for partial in partials if partial and partial.strip() != NOT_IN_PART]
+        if not relevant:
+            answer = "The document does not appear to answer this question."
+        else:
+            answer = combine_texts(
+                relevant, get_llm_for_user(user_id, 0.2, ai_user_id), "legal_qa_combine", QA_PROMPT_VERSION, 0.2,
+                "You are a legal assistant. The following are answers to the same question, each taken from a different "
+                f"part of one legal document. Combine them into one clear, concise answer.\n\nQuestion: {question}"
+            )
         print(f"QA answer: {answer}")
         # Save to DB if possible
         if db and LegalDocumentResult and user_id and doc_id:
@@ -201,36 +590,56 @@ def qa_legal_document(txt_path, question, user_id=None, doc_id=None):
                 doc_id=doc_id,
                 result_type='qa',
                 content=answer,
-                question=question
+                question=question,
+                task_id=task_id
             )
             db.session.add(result)
             db.session.commit()
         return answer
+    except LLMRateLimited:
+        raise
     except Exception as e:
         print(f"QA failed for {txt_path}: {e}")
         return None
 
-@celery_app.task
-def analyze_for_party(txt_path, party, user_id=None, doc_id=None):
+@celery_app.task(bind=True, **RATE_LIMIT_RETRY)
+def analyze_for_party(self, txt_path, party, user_id=None, doc_id=None, ai_user_id=None):
     """
     Generate legal analysis in support of either the defendant or plaintiff.
+    Long documents are analyzed chunk by chunk and the notes combined into one analysis.
     """
-    try:
-        with open(txt_path, 'r') as f:
-            text = f.read()
+    return run_chunked(self, "party_analysis", txt_path, party=party, user_id=user_id, doc_id=doc_id, ai_user_id=ai_user_id,
+                       task_id=self.request.id)
+
+def analyze_chunk_for_party(text, index, total, party, user_id=None, ai_user_id=None, **params):
+    if total == 1:
         prompt = (
             f"You are a legal assistant. Read the following legal document and generate a legal analysis in support of the {party}. "
             "List key arguments, cite relevant facts, and suggest possible legal precedents if appropriate.\n\n"
-            f"Document Text:\n{text[:4000]}"
+            f"Document Text:\n{text}"
         )
-        api_key = get_user_gemini_key(user_id)
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0.3,
-            google_api_key=api_key
+        namespace = "legal_party_analysis"
+    else:
+        prompt = (
+            f"You are a legal assistant. Read part {index + 1} of {total} of a legal document and list the arguments and "
+            f"facts in it that support the {party}, citing dates, amounts and parties.\n\n"
+            f"Document Text:\n{text}"
+        )
+        namespace = "legal_party_analysis_chunk"
+    return ask_llm(get_llm_for_user(user_id, 0.3, ai_user_id), namespace, PARTY_ANALYSIS_PROMPT_VERSION, 0.3, prompt)
+
+def save_party_analysis(partials, txt_path, party, user_id=None, doc_id=None, ai_user_id=None, task_id=None):
+    try:
+        partials = [partial for partial in partials if partial]
+        if not partials:
+            print(f"Legal analysis for {party} of {txt_path} produced no result")
+            return None
+        analysis = combine_texts(
+            partials, get_llm_for_user(user_id, 0.3, ai_user_id), "legal_party_analysis_combine", PARTY_ANALYSIS_PROMPT_VERSION, 0.3,
+            f"You are a legal assistant. The following are notes on consecutive parts of one legal document. Combine them "
+            f"into a single legal analysis in support of the {party}. List key arguments, cite relevant facts, and suggest "
+            "possible legal precedents if appropriate."
         )
-        response = model.invoke(prompt)
-        analysis = response.content if hasattr(response, "content") else str(response)
         # Save analysis as a .analysis.{party}.txt file
         analysis_path = txt_path + f".analysis.{party}.txt"
         with open(analysis_path, 'w') as out:
@@ -243,11 +652,28 @@ def analyze_for_party(txt_path, party, user_id=None, doc_id=None):
                 doc_id=doc_id,
                 result_type='analysis',
                 content=analysis,
-                party=party
+                party=party,
+                task_id=task_id
             )
             db.session.add(result)
             db.session.commit()
         return analysis_path
+    except LLMRateLimited:
+        raise
     except Exception as e:
         print(f"Legal analysis for {party} failed for {txt_path}: {e}")
-        return None 
\ No newline at end of file
+        return None
+
+# Per kind: map(text, index, total, **params) -> partial result, reduce(partials, txt_path, **params) -> task result
+CHUNK_MAPPERS = {
+    "legal_analysis": extract_legal_fields,
+    "summary": summarize_chunk,
+    "qa": answer_from_chunk,
+    "party_analysis": analyze_chunk_for_party,
+}
+CHUNK_REDUCERS = {
+    "legal_analysis": save_legal_analysis,
+    "summary": save_summary,
+    "qa": save_answer,
+    "party_analysis": save_party_analysis,
+}
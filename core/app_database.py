@@ -0,0 +1,112 @@
+# core/app_database.py
+"""Where the web app's own SQLAlchemy models (users, document results, LLM services, AI users, email
+profiles) are stored.
+
+APP_DATABASE_URL (or DATABASE_URL) points them at a shared database, normally the Postgres instance that
+core.database already uses for emails and tenants, so every web container and Celery worker sees the same
+users and results. Without it they stay in a SQLite file per container, which serializes writers and
+fails them with "database is locked" under concurrent load (benchmarks/bench_app_db_writers.py).
+
+On a server database each process keeps a pool of APP_DB_POOL_SIZE connections plus up to
+APP_DB_MAX_OVERFLOW more under bursts; connections are pinged before use and replaced after
+APP_DB_POOL_RECYCLE seconds, so a database restart or an idle timeout in between costs no request.
+setup_schema creates the tables, adds columns introduced since and the results' full-text index
+(core/result_search.py); copy_tables moves an existing SQLite database's rows over (`flask --app app copy-app-db`).
+"""
+import os
+from sqlalchemy import Integer, func, insert, inspect, select, text
+from core.result_search import setup_search
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_APP_DATABASE_URL = "sqlite:///paralegal.db"
+APP_DB_POOL_SIZE = int(os.getenv("APP_DB_POOL_SIZE", "10"))
+APP_DB_MAX_OVERFLOW = int(os.getenv("APP_DB_MAX_OVERFLOW", "10"))
+APP_DB_POOL_TIMEOUT = float(os.getenv("APP_DB_POOL_TIMEOUT", "30"))
+APP_DB_POOL_RECYCLE = int(os.getenv("APP_DB_POOL_RECYCLE", "1800"))
+COPY_BATCH_SIZE = 1000
+# Serializes the schema setup of processes starting together (core.database uses its own lock id)
+APP_SCHEMA_LOCK_ID = 7245111
+# Columns added to the models after their tables were first created: (table, column, type, index)
+ADDED_COLUMNS = [
+    ("legal_document_result", "task_id", "VARCHAR(155)", "ix_legal_document_result_task_id"),
+]
+# Indexes added to the models after their tables were first created: (index, table, columns)
+ADDED_INDEXES = [
+    ("ix_legal_document_result_user_created", "legal_document_result", "user_id, created_at, id"),
+]
+
+def app_database_url():
+    url = os.getenv("APP_DATABASE_URL") or os.getenv("DATABASE_URL") or DEFAULT_APP_DATABASE_URL
+    # Heroku/RDS style postgres:// URLs, and no driver named: use psycopg2, like core.database
+    for scheme in ("postgres://", "postgresql://"):
+        if url.startswith(scheme):
+            url = "postgresql+psycopg2://" + url[len(scheme):]
+    return url
+
+def engine_options(url):
+    """SQLAlchemy engine options for url: pool sizing and health checks for a server database."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": APP_DB_POOL_SIZE,
+        "max_overflow": APP_DB_MAX_OVERFLOW,
+        "pool_timeout": APP_DB_POOL_TIMEOUT,
+        "pool_recycle": APP_DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def setup_schema(metadata, engine):
+    """Creates the models' tables, brings older ones up to date (ADDED_COLUMNS, ADDED_INDEXES) and sets up result search."""
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": APP_SCHEMA_LOCK_ID})
+        metadata.create_all(connection)
+        for table, column, column_type, index in ADDED_COLUMNS:
+            if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                if index:
+                    connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({column})"))
+        for index, table, columns in ADDED_INDEXES:
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns})"))
+        setup_search(connection)
+
+def copy_tables(metadata, source_engine, target_engine, batch_size=COPY_BATCH_SIZE):
+    """
+    Copies every row of metadata's tables from source_engine to target_engine (parents before children),
+    creating missing tables first, and returns the rows copied per table. Columns the source does not
+    have yet are left to their defaults. Refuses to copy into a table that already has rows, so it cannot
+    duplicate or clash with data already moved. On Postgres the id sequences continue after the copied ids.
+    """
+    setup_schema(metadata, target_engine)
+    tables = metadata.sorted_tables
+    source_tables = set(inspect(source_engine).get_table_names())
+    with target_engine.connect() as connection:
+        occupied = [table.name for table in tables if connection.execute(select(func.count()).select_from(table)).scalar()]
+    if occupied:
+        raise ValueError(f"Target tables already have rows: {', '.join(occupied)}")
+
+    copied = {}
+    with source_engine.connect() as source, target_engine.begin() as target:
+        for table in tables:
+            if table.name not in source_tables:
+                copied[table.name] = 0
+                continue
+            source_columns = {column["name"] for column in inspect(source_engine).get_columns(table.name)}
+            columns = [column for column in table.columns if column.name in source_columns]
+            rows = source.execute(select(*columns)).mappings()
+            count = 0
+            while batch := rows.fetchmany(batch_size):
+                target.execute(insert(table), [dict(row) for row in batch])
+                count += len(batch)
+            copied[table.name] = count
+            if target_engine.dialect.name == "postgresql":
+                for column in table.primary_key.columns:
+                    if isinstance(column.type, Integer) and column.autoincrement in (True, "auto"):
+                        quoted = target_engine.dialect.identifier_preparer.quote(table.name)
+                        target.execute(text(
+                            f"SELECT setval(pg_get_serial_sequence(:table, :column), COALESCE(MAX({column.name}), 0) + 1, false) "
+                            f"FROM {quoted}"), {"table": quoted, "column": column.name})
+            logger.info(f"Copied {count} rows of {table.name}")
+    return copied
@@ -0,0 +1,79 @@
+# core/chunking.py
+"""Streaming splitter for OCR sidecar text.
+
+iter_chunk_spans reads a text file block by block and yields the (start, end) byte offsets of chunks of
+at most `chunk_size` bytes. Each chunk ends at the last page break (ocrmypdf writes a form feed between
+pages), paragraph break, line break or space in its second half, and consecutive chunks share about
+`overlap` bytes so text cut at a boundary is seen whole by one of them. Only one window of the file is
+held at a time and read_span reads a single chunk back, so memory use does not grow with the document.
+"""
+SEPARATORS = (b"\f", b"\n\n", b"\n", b" ")
+
+def _is_continuation_byte(byte):
+    return byte & 0xC0 == 0x80
+
+def _cut_point(window, limit):
+    for separator in SEPARATORS:
+        position = window.rfind(separator, limit // 2, limit)
+        if position != -1:
+            return position + len(separator)
+    # No separator at all: cut at the limit, backed off to a UTF-8 character boundary.
+    cut = limit
+    while cut > limit // 2 and _is_continuation_byte(window[cut]):
+        cut -= 1
+    return cut
+
+def _overlap_start(window, cut, overlap):
+    """Where the next chunk starts: just after the first space/newline in the last `overlap` bytes of this one."""
+    start = cut - overlap
+    for position in range(start, cut):
+        if window[position] in b" \n\f":
+            return position + 1
+    while start < cut and _is_continuation_byte(window[start]):
+        start += 1
+    return start
+
+def iter_chunk_spans(path, chunk_size=4000, overlap=400, read_size=1 << 14):
+    if chunk_size < 2 or not 0 <= overlap < chunk_size // 2:
+        raise ValueError(f"Invalid chunking: chunk_size={chunk_size}, overlap={overlap}")
+    with open(path, "rb") as f:
+        window = bytearray()
+        window_start = 0
+        eof = False
+        while True:
+            while not eof and len(window) <= chunk_size:
+                block = f.read(read_size)
+                eof = not block
+                window += block
+            if len(window) <= chunk_size:
+                if window.strip():
+                    yield window_start, window_start + len(window)
+                return
+            cut = _cut_point(window, chunk_size)
+            if window[:cut].strip():
+                yield window_start, window_start + cut
+            next_start = _overlap_start(window, cut, overlap)
+            del window[:next_start]
+            window_start += next_start
+
+def read_span(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8", errors="replace")
+
+def combine_partials(partials, combine, max_chars):
+    """
+    Reduces text partials to one with combine(list_of_partials) -> str, combining groups of at most about
+    max_chars characters per call (and at least two partials) in rounds, so no prompt grows with the document.
+    """
+    while len(partials) > 1:
+        groups, group, size = [], [], 0
+        for partial in partials:
+            if len(group) >= 2 and size + len(partial) > max_chars:
+                groups.append(group)
+                group, size = [], 0
+            group.append(partial)
+            size += len(partial)
+        groups.append(group)
+        partials = [combine(group) if len(group) > 1 else group[0] for group in groups]
+    return partials[0]
@@ -1,156 +1,880 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+from psycopg2.extras import RealDictCursor, Json, execute_values
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-def get_db_connection():
-    DB_HOST = os.getenv("POSTGRES_HOST", "db")
-    DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-    DB_NAME = os.getenv("POSTGRES_DB", "secretary_pm")
-    DB_USER = os.getenv("POSTGRES_USER", "secretary")
-    DB_PASS = os.getenv("POSTGRES_PASSWORD", "secretarypass")
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
+def _connection_params():
+    return dict(
+        host=os.getenv("POSTGRES_HOST", "db"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        dbname=os.getenv("POSTGRES_DB", "secretary_pm"),
+        user=os.getenv("POSTGRES_USER", "secretary"),
+        password=os.getenv("POSTGRES_PASSWORD", "secretarypass"),
+        client_encoding="UTF8",
         cursor_factory=RealDictCursor
     )
-    return conn
+
+def get_db_connection():
+    """
+    Opens a new, unpooled connection. Prefer db_connection()/db_cursor(), which
+    borrow from the process-wide pool; this is kept for scripts and tests that
+    manage the connection lifetime themselves.
+    """
+    return psycopg2.connect(**_connection_params())
+
+class PoolTimeout(PoolError):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to maxconn, checked for liveness when they
+    are handed out, and rolled back to a clean state when they are returned.
+    A pool belongs to the process that created it: after a fork the child
+    drops the inherited connections (without closing the parent's sockets)
+    and opens its own.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30.0, pre_ping=True, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self._connect_kwargs = connect_kwargs or _connection_params()
+        self._cond = threading.Condition()
+        self._reset_state()
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _check_pid(self):
+        # Called with the lock held. Connections inherited across fork() share
+        # sockets with the parent, so they are forgotten rather than closed.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        conn = None
+        with self._cond:
+            self._check_pid()
+            waited = False
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No Postgres connection available after {timeout:.1f}s (max={self.maxconn})")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+                with self._cond:
+                    self._reconnects += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                # Borrowed before a fork; the new pool in this process never owned it.
+                return
+            self._in_use -= 1
+            if not close and not conn.closed:
+                try:
+                    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            if close or conn.closed:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                for conn in self._idle:
+                    self._discard(conn)
+                self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "checkout_ms_avg": round(1000 * self._checkout_time_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "checkout_ms_max": round(1000 * self._checkout_time_max, 3),
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide pool, creating it from the POSTGRES_POOL_* settings on first use."""
+    global _pool
+    if _pool is None or _pool._pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool._pid != os.getpid():
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv("POSTGRES_POOL_MIN", "1")),
+                    maxconn=int(os.getenv("POSTGRES_POOL_MAX", "10")),
+                    timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+                    pre_ping=os.getenv("POSTGRES_POOL_PRE_PING", "1").lower() not in ("0", "false", "no"),
+                    **_connection_params()
+                )
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+
+def _reset_pool_after_fork():
+    # The parent's lock may have been held mid-fork; start the child from scratch.
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def get_pool_stats():
+    return _pool.stats() if _pool is not None else {}
+
+@contextmanager
+def db_connection():
+    """
+    Borrows a pooled connection. Commits when the block exits normally and
+    rolls back if it raises; the connection always goes back to the pool.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+@contextmanager
+def db_cursor():
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            yield cursor
+
+SCHEMA_LOCK_ID = 7245110
+
+def _rollup_delta_sql(sources):
+    """plpgsql statements adding each (transition table, sign) to the dashboard rollups; unchanged rows cancel out."""
+    def union(columns):
+        return " UNION ALL ".join(f"SELECT {columns}, {sign} AS n FROM {table}" for table, sign in sources)
+    daily = union("received_at::date AS day, COALESCE(category, 'uncategorized') AS category, replied, draft_saved")
+    issues = union("left(COALESCE(extracted_issue_summary, subject, ''), 500) AS issue, category")
+    return f"""
+        INSERT INTO email_daily_rollups (day, category, replied, draft_saved, count)
+        SELECT day, category, replied, draft_saved, SUM(n) FROM ({daily}) delta
+        GROUP BY 1, 2, 3, 4 HAVING SUM(n) <> 0 ORDER BY 1, 2, 3, 4
+        ON CONFLICT (day, category, replied, draft_saved) DO UPDATE SET count = email_daily_rollups.count + EXCLUDED.count;
+        INSERT INTO email_issue_rollups (issue, count)
+        SELECT issue, SUM(n) FROM ({issues}) delta WHERE category IS DISTINCT FROM 'spam'
+        GROUP BY 1 HAVING SUM(n) <> 0 ORDER BY 1
+        ON CONFLICT (issue) DO UPDATE SET count = email_issue_rollups.count + EXCLUDED.count;"""
 
 def setup_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Properties Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS properties (
-            id SERIAL PRIMARY KEY,
-            address TEXT UNIQUE NOT NULL,
-            units INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Tenants Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tenants (
-            id SERIAL PRIMARY KEY,
-            name TEXT,
-            email TEXT UNIQUE NOT NULL,
-            property_id INTEGER REFERENCES properties(id),
-            unit TEXT,
-            rent REAL,
-            balance REAL DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Maintenance Tickets Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS maintenance_tickets (
-            id SERIAL PRIMARY KEY,
-            tenant_id INTEGER REFERENCES tenants(id),
-            property_id INTEGER REFERENCES properties(id),
-            issue TEXT NOT NULL,
-            status TEXT DEFAULT 'open',
-            priority TEXT DEFAULT 'normal',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Persons of Interest Table (optional)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS persons_of_interest (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE,
-            email TEXT UNIQUE,
-            interest_level INTEGER DEFAULT 1,
-            notes TEXT,
-            trigger_words TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    with db_cursor() as cursor:
+        # Several processes run this at startup; serialize them so DDL never races.
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK_ID,))
+
+        # Properties Table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS properties (
+                id SERIAL PRIMARY KEY,
+                address TEXT UNIQUE NOT NULL,
+                units INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Tenants Table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tenants (
+                id SERIAL PRIMARY KEY,
+                name TEXT,
+                email TEXT UNIQUE NOT NULL,
+                property_id INTEGER REFERENCES properties(id),
+                unit TEXT,
+                rent REAL,
+                balance REAL DEFAULT 0.0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Maintenance Tickets Table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_tickets (
+                id SERIAL PRIMARY KEY,
+                tenant_id INTEGER REFERENCES tenants(id),
+                property_id INTEGER REFERENCES properties(id),
+                issue TEXT NOT NULL,
+                status TEXT DEFAULT 'open',
+                priority TEXT DEFAULT 'normal',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # The email a ticket was opened for: at most one ticket per email, however often it is processed
+        cursor.execute('ALTER TABLE maintenance_tickets ADD COLUMN IF NOT EXISTS email_id TEXT')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS maintenance_tickets_email_idx ON maintenance_tickets (email_id)')
+
+        # Persons of Interest Table (optional)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS persons_of_interest (
+                id SERIAL PRIMARY KEY,
+                name TEXT UNIQUE,
+                email TEXT UNIQUE,
+                interest_level INTEGER DEFAULT 1,
+                notes TEXT,
+                trigger_words TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # IMAP sync state: UIDVALIDITY and the highest UID already fetched, per account and mailbox
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imap_sync_state (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uidvalidity BIGINT NOT NULL,
+                last_uid BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account, mailbox)
+            )
+        ''')
+
+        # Emails shown in the web app, ingested from IMAP or a JSON export
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS emails (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL DEFAULT 'json',
+                sender TEXT,
+                subject TEXT,
+                body TEXT,
+                received_at TIMESTAMP NOT NULL,
+                category TEXT,
+                extracted_issue_summary TEXT,
+                is_legal_communication BOOLEAN NOT NULL DEFAULT FALSE,
+                attachments JSONB NOT NULL DEFAULT '[]',
+                replied BOOLEAN NOT NULL DEFAULT FALSE,
+                draft_saved BOOLEAN NOT NULL DEFAULT FALSE,
+                ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # (received_at, id) is the keyset used for paging, newest first
+        cursor.execute('CREATE INDEX IF NOT EXISTS emails_received_at_idx ON emails (received_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS emails_sender_idx ON emails (sender)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS emails_category_idx ON emails (category, received_at DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS emails_replied_idx ON emails (replied, received_at DESC)')
+
+        # OCR/analysis jobs, one per distinct attachment content, so the same document is processed once
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_jobs (
+                content_hash TEXT PRIMARY KEY,
+                pdf_path TEXT NOT NULL,
+                txt_path TEXT,
+                user_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS document_jobs_status_idx ON document_jobs (status, updated_at)')
+        # How ocr_pdf produced the text: from the PDF's text layer, by OCR, or both (see core/ocr.py)
+        for column in ('route TEXT', 'page_count INTEGER', 'ocr_page_count INTEGER', 'text_seconds REAL', 'saved_seconds REAL'):
+            cursor.execute(f'ALTER TABLE document_jobs ADD COLUMN IF NOT EXISTS {column}')
+        # OCR time per page of a document job (ocr_pdf); pages with a text layer are skipped, not OCR'd
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_ocr_pages (
+                content_hash TEXT NOT NULL REFERENCES document_jobs (content_hash) ON DELETE CASCADE,
+                page INTEGER NOT NULL,
+                shard INTEGER NOT NULL,
+                ocr BOOLEAN NOT NULL,
+                seconds REAL NOT NULL,
+                PRIMARY KEY (content_hash, page)
+            )
+        ''')
+
+        # Legal document analyses (analyze_legal_document) and the dated events extracted from them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS legal_documents (
+                id SERIAL PRIMARY KEY,
+                doc_id TEXT UNIQUE NOT NULL,
+                user_id INTEGER,
+                txt_path TEXT,
+                document_type TEXT,
+                case_number TEXT,
+                court TEXT,
+                parties JSONB NOT NULL DEFAULT '[]',
+                raw_excerpt TEXT,
+                analyzed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_documents_analyzed_idx ON legal_documents (analyzed_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_documents_user_idx ON legal_documents (user_id, analyzed_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_documents_case_idx ON legal_documents (case_number)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS legal_events (
+                id SERIAL PRIMARY KEY,
+                document_id INTEGER NOT NULL REFERENCES legal_documents(id) ON DELETE CASCADE,
+                user_id INTEGER,
+                starts_at TIMESTAMP NOT NULL,
+                raw_date TEXT,
+                ics_filename TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_events_starts_idx ON legal_events (starts_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_events_user_idx ON legal_events (user_id, starts_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS legal_events_document_idx ON legal_events (document_id)')
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # Dashboard rollups, kept current by triggers on emails so the dashboard reads O(buckets) rows.
+        # Rebuild them with rebuild_email_rollups() after a bulk load done with triggers disabled.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_daily_rollups (
+                day DATE NOT NULL,
+                category TEXT NOT NULL,
+                replied BOOLEAN NOT NULL,
+                draft_saved BOOLEAN NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, category, replied, draft_saved)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_issue_rollups (
+                issue TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS email_issue_rollups_count_idx ON email_issue_rollups (count DESC)')
+        # Statement-level triggers apply each batch as one grouped upsert, in key order so concurrent
+        # batches lock rollup rows in the same order. Transition tables need one trigger per event.
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION emails_rollup_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    %s
+                ELSIF TG_OP = 'UPDATE' THEN
+                    %s
+                ELSE
+                    %s
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        ''' % (_rollup_delta_sql([("new_rows", 1)]),
+               _rollup_delta_sql([("new_rows", 1), ("old_rows", -1)]),
+               _rollup_delta_sql([("old_rows", -1)])))
+        for event, tables in (("INSERT", "NEW TABLE AS new_rows"),
+                              ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                              ("DELETE", "OLD TABLE AS old_rows")):
+            cursor.execute(f'''
+                CREATE OR REPLACE TRIGGER emails_rollup_{event.lower()}
+                AFTER {event} ON emails REFERENCING {tables}
+                FOR EACH STATEMENT EXECUTE FUNCTION emails_rollup_trigger()
+            ''')
     logger.info("Postgres database setup complete.")
 
 # --- CRUD Functions ---
 def get_tenant_by_email(email_address):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM tenants WHERE email = %s', (email_address,))
-    tenant = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return tenant
-
-def create_maintenance_ticket_db(tenant_id, property_id, issue, priority='normal'):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO maintenance_tickets (tenant_id, property_id, issue, priority, status)
-        VALUES (%s, %s, %s, %s, 'open')
-        RETURNING id
-    ''', (tenant_id, property_id, issue, priority))
-    ticket_id = cursor.fetchone()["id"]
-    conn.commit()
-    conn.close()
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM tenants WHERE email = %s', (email_address,))
+        return cursor.fetchone()
+
+def create_maintenance_ticket_db(tenant_id, property_id, issue, priority='normal', email_id=None):
+    """
+    Opens a maintenance ticket and returns its id. With email_id, an email that already has a ticket (the
+    workflow re-run on it, e.g. a task retried after an LLM rate limit) gets that ticket's id instead.
+    """
+    with db_cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO maintenance_tickets (tenant_id, property_id, issue, priority, status, email_id)
+            VALUES (%s, %s, %s, %s, 'open', %s)
+            ON CONFLICT (email_id) DO NOTHING
+            RETURNING id
+        ''', (tenant_id, property_id, issue, priority, email_id))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute('SELECT id FROM maintenance_tickets WHERE email_id = %s', (email_id,))
+            ticket_id = cursor.fetchone()["id"]
+            logger.info(f"Email {email_id} already has maintenance ticket ID: {ticket_id}")
+            return ticket_id
+        ticket_id = row["id"]
     logger.info(f"Created maintenance ticket ID: {ticket_id} for tenant {tenant_id}")
     return ticket_id
 
 def get_property_by_id(property_id):
-    conn = get_db_connection()
-    property_row = conn.execute('SELECT * FROM properties WHERE id = %s', (property_id,)).fetchone()
-    conn.close()
-    return property_row
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM properties WHERE id = %s', (property_id,))
+        return cursor.fetchone()
 
 def get_tenant_by_id(tenant_id):
-    conn = get_db_connection()
-    tenant = conn.execute('SELECT * FROM tenants WHERE id = %s', (tenant_id,)).fetchone()
-    conn.close()
-    return tenant
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM tenants WHERE id = %s', (tenant_id,))
+        return cursor.fetchone()
 
 def get_all_tenants():
-    conn = get_db_connection()
-    tenants = conn.execute('SELECT * FROM tenants').fetchall()
-    conn.close()
-    return tenants
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM tenants')
+        return cursor.fetchall()
 
 def get_all_properties():
-    conn = get_db_connection()
-    properties = conn.execute('SELECT * FROM properties').fetchall()
-    conn.close()
-    return properties
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM properties')
+        return cursor.fetchall()
 
 def create_property(address, units):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO properties (address, units) VALUES (%s, %s) RETURNING id''',
-        (address, units)
-    )
-    prop_id = cursor.fetchone()["id"]
-    conn.commit()
-    conn.close()
+    with db_cursor() as cursor:
+        cursor.execute(
+            '''INSERT INTO properties (address, units) VALUES (%s, %s) RETURNING id''',
+            (address, units)
+        )
+        prop_id = cursor.fetchone()["id"]
     logger.info(f"Created property ID: {prop_id} at {address}")
     return prop_id
 
 def create_tenant(name, email, property_id, unit, rent=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO tenants (name, email, property_id, unit, rent) VALUES (%s, %s, %s, %s, %s) RETURNING id''',
-        (name, email, property_id, unit, rent)
-    )
-    tenant_id = cursor.fetchone()["id"]
-    conn.commit()
-    conn.close()
+    with db_cursor() as cursor:
+        cursor.execute(
+            '''INSERT INTO tenants (name, email, property_id, unit, rent) VALUES (%s, %s, %s, %s, %s) RETURNING id''',
+            (name, email, property_id, unit, rent)
+        )
+        tenant_id = cursor.fetchone()["id"]
     logger.info(f"Created tenant ID: {tenant_id} for {name}")
-    return tenant_id 
\ No newline at end of file
+    return tenant_id
+
+def get_imap_sync_state(account, mailbox):
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT uidvalidity, last_uid FROM imap_sync_state WHERE account = %s AND mailbox = %s',
+            (account, mailbox)
+        )
+        return cursor.fetchone()
+
+def save_imap_sync_state(account, mailbox, uidvalidity, last_uid):
+    with db_cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO imap_sync_state (account, mailbox, uidvalidity, last_uid, updated_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (account, mailbox) DO UPDATE
+            SET uidvalidity = EXCLUDED.uidvalidity, last_uid = EXCLUDED.last_uid, updated_at = CURRENT_TIMESTAMP
+        ''', (account, mailbox, uidvalidity, last_uid))
+
+# --- Document jobs ---
+DOCUMENT_JOB_STATUSES = ("queued", "running", "done", "failed")
+
+def claim_document_job(content_hash, pdf_path, user_id=None, retry_failed=False, stale_after=3600):
+    """
+    Registers a job for this document content and returns True if the caller should enqueue it.
+    Only one caller wins per content hash: later claims return False while the job is queued, running
+    or done. A failed job is claimed again only with retry_failed, and a queued/running job whose last
+    update is older than stale_after seconds (a lost message or crashed worker) can be claimed again.
+    """
+    with db_cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO document_jobs (content_hash, pdf_path, user_id, status)
+            VALUES (%s, %s, %s, 'queued')
+            ON CONFLICT (content_hash) DO UPDATE
+            SET status = 'queued', pdf_path = EXCLUDED.pdf_path, error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE (document_jobs.status = 'failed' AND %s)
+               OR (document_jobs.status IN ('queued', 'running')
+                   AND document_jobs.updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            RETURNING content_hash
+        ''', (content_hash, pdf_path, user_id, retry_failed, stale_after))
+        return cursor.fetchone() is not None
+
+def start_document_job(content_hash):
+    """Moves a queued job to running; returns False if it is not queued (already running, done or failed)."""
+    with db_cursor() as cursor:
+        cursor.execute('''
+            UPDATE document_jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE content_hash = %s AND status = 'queued'
+        ''', (content_hash,))
+        return cursor.rowcount == 1
+
+def finish_document_job(content_hash, status, txt_path=None, error=None):
+    if status not in ("done", "failed"):
+        raise ValueError(f"Invalid final document job status: {status}")
+    with db_cursor() as cursor:
+        cursor.execute('''
+            UPDATE document_jobs SET status = %s, txt_path = COALESCE(%s, txt_path), error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE content_hash = %s
+        ''', (status, txt_path, error, content_hash))
+
+def get_document_job(content_hash):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT * FROM document_jobs WHERE content_hash = %s', (content_hash,))
+        return cursor.fetchone()
+
+def get_document_job_counts():
+    with db_cursor() as cursor:
+        cursor.execute('SELECT status, COUNT(*) AS count FROM document_jobs GROUP BY status')
+        counts = {row["status"]: row["count"] for row in cursor.fetchall()}
+    return {status: counts.get(status, 0) for status in DOCUMENT_JOB_STATUSES}
+
+DOCUMENT_ROUTES = ("text_layer", "mixed", "ocr")
+
+def save_document_route(content_hash, route, page_count, ocr_page_count, text_seconds, saved_seconds=None):
+    """
+    Records how a job's text was produced: the route, how many of its pages were OCR'd, the seconds until the
+    text was ready and an estimate of the OCR time the text layer saved (None when there is nothing to base it on).
+    """
+    if route not in DOCUMENT_ROUTES:
+        raise ValueError(f"Invalid document route: {route}")
+    with db_cursor() as cursor:
+        cursor.execute('''
+            UPDATE document_jobs SET route = %s, page_count = %s, ocr_page_count = %s, text_seconds = %s, saved_seconds = %s
+            WHERE content_hash = %s
+        ''', (route, page_count, ocr_page_count, text_seconds, saved_seconds, content_hash))
+
+def get_document_route_stats():
+    """Per route: documents, pages, OCR'd pages and the estimated OCR seconds saved by text layers."""
+    with db_cursor() as cursor:
+        cursor.execute('''
+            SELECT route, COUNT(*) AS documents, COALESCE(SUM(page_count), 0) AS pages,
+                   COALESCE(SUM(ocr_page_count), 0) AS ocr_pages, COALESCE(SUM(saved_seconds), 0) AS saved_seconds
+            FROM document_jobs WHERE route IS NOT NULL GROUP BY route
+        ''')
+        rows = cursor.fetchall()
+    stats = {route: {"documents": 0, "pages": 0, "ocr_pages": 0, "saved_seconds": 0.0} for route in DOCUMENT_ROUTES}
+    for row in rows:
+        stats[row.pop("route")] = dict(row, saved_seconds=round(row["saved_seconds"], 1))
+    return stats
+
+def get_ocr_seconds_per_page():
+    """Average OCR time of the pages recorded in document_ocr_pages, or None before any page was OCR'd."""
+    with db_cursor() as cursor:
+        cursor.execute('SELECT AVG(seconds) AS seconds FROM document_ocr_pages WHERE ocr')
+        return cursor.fetchone()["seconds"]
+
+def save_document_ocr_pages(content_hash, pages):
+    """Replaces the per-page OCR timings of a job; pages are dicts with page (1-based), shard, ocr and seconds."""
+    with db_cursor() as cursor:
+        cursor.execute('DELETE FROM document_ocr_pages WHERE content_hash = %s', (content_hash,))
+        if pages:
+            execute_values(cursor, '''
+                INSERT INTO document_ocr_pages (content_hash, page, shard, ocr, seconds) VALUES %s
+            ''', [(content_hash, p["page"], p["shard"], p["ocr"], p["seconds"]) for p in pages])
+
+def get_document_ocr_pages(content_hash):
+    with db_cursor() as cursor:
+        cursor.execute('''
+            SELECT page, shard, ocr, seconds FROM document_ocr_pages WHERE content_hash = %s ORDER BY page
+        ''', (content_hash,))
+        return cursor.fetchall()
+
+# --- Legal documents ---
+LEGAL_DOCUMENT_COLUMNS = (
+    'id, doc_id, user_id, txt_path, document_type, case_number, court, parties, raw_excerpt, analyzed_at'
+)
+
+def save_legal_document(doc_id, result, user_id=None, txt_path=None, events=()):
+    """
+    Stores (or replaces) the analysis of one document and its events, given as
+    (starts_at, raw_date, ics_filename) tuples. Returns the legal_documents id.
+    """
+    with db_cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO legal_documents (doc_id, user_id, txt_path, document_type, case_number, court, parties, raw_excerpt)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (doc_id) DO UPDATE SET
+                user_id = COALESCE(EXCLUDED.user_id, legal_documents.user_id),
+                txt_path = COALESCE(EXCLUDED.txt_path, legal_documents.txt_path),
+                document_type = EXCLUDED.document_type,
+                case_number = EXCLUDED.case_number,
+                court = EXCLUDED.court,
+                parties = EXCLUDED.parties,
+                raw_excerpt = EXCLUDED.raw_excerpt,
+                analyzed_at = CURRENT_TIMESTAMP
+            RETURNING id, user_id
+        ''', (doc_id, user_id, txt_path, result.get("document_type"), result.get("case_number"), result.get("court"),
+              Json(result.get("parties") or []), result.get("raw_excerpt")))
+        document = cursor.fetchone()
+        cursor.execute('DELETE FROM legal_events WHERE document_id = %s', (document["id"],))
+        if events:
+            execute_values(cursor, '''
+                INSERT INTO legal_events (document_id, user_id, starts_at, raw_date, ics_filename) VALUES %s
+            ''', [(document["id"], document["user_id"], *event) for event in events])
+        return document["id"]
+
+def get_legal_document(doc_id):
+    with db_cursor() as cursor:
+        cursor.execute(f'SELECT {LEGAL_DOCUMENT_COLUMNS} FROM legal_documents WHERE doc_id = %s', (doc_id,))
+        return cursor.fetchone()
+
+def list_legal_documents(limit=10, before=None, user_id=None):
+    """Most recently analyzed documents first; `before` is the (analyzed_at, id) keyset of the previous page's last row."""
+    conditions, params = [], []
+    if before is not None:
+        conditions.append('(analyzed_at, id) < (%s, %s)')
+        params.extend(before)
+    if user_id is not None:
+        conditions.append('user_id = %s')
+        params.append(user_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with db_cursor() as cursor:
+        cursor.execute(
+            f'SELECT {LEGAL_DOCUMENT_COLUMNS} FROM legal_documents {where} ORDER BY analyzed_at DESC, id DESC LIMIT %s',
+            (*params, limit)
+        )
+        return cursor.fetchall()
+
+def list_legal_events(limit=20, after=None, user_id=None, since=None):
+    """
+    Events in date order with their document's case number, type and court. `after` is the (starts_at, id)
+    keyset of the previous page's last row; `since` drops events before that time.
+    """
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('(e.starts_at, e.id) > (%s, %s)')
+        params.extend(after)
+    if since is not None:
+        conditions.append('e.starts_at >= %s')
+        params.append(since)
+    if user_id is not None:
+        conditions.append('e.user_id = %s')
+        params.append(user_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with db_cursor() as cursor:
+        cursor.execute(f'''
+            SELECT e.id, e.starts_at, e.raw_date, e.ics_filename, e.user_id,
+                   d.doc_id, d.case_number, d.document_type, d.court
+            FROM legal_events e JOIN legal_documents d ON d.id = e.document_id
+            {where} ORDER BY e.starts_at, e.id LIMIT %s
+        ''', (*params, limit))
+        return cursor.fetchall()
+
+def count_legal_documents(user_id):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) AS count FROM legal_documents WHERE user_id = %s', (user_id,))
+        return cursor.fetchone()["count"]
+
+def count_legal_events(user_id, since=None):
+    with db_cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) AS count FROM legal_events WHERE user_id = %s AND starts_at >= COALESCE(%s, '-infinity'::timestamp)",
+            (user_id, since)
+        )
+        return cursor.fetchone()["count"]
+
+# --- Emails ---
+# Placeholder categories assigned at ingestion; they never replace a category set by classification.
+UNCLASSIFIED_CATEGORIES = ("legal_document", "general_communication")
+
+EMAIL_COLUMNS = (
+    'id, source, sender AS "from", subject, body, received_at, category, extracted_issue_summary, '
+    'is_legal_communication, attachments, replied, draft_saved'
+)
+
+def upsert_emails(emails):
+    """
+    Inserts or refreshes emails (dicts with id, from, subject, body, received_at, ...), one statement per call.
+    Reply and draft status are never overwritten by re-ingestion. Returns the number of rows written.
+    """
+    if not emails:
+        return 0
+    rows = [
+        (e["id"], e.get("source", "json"), e.get("from"), e.get("subject"), e.get("body"), e["received_at"],
+         e.get("category"), e.get("extracted_issue_summary"), bool(e.get("is_legal_communication")),
+         Json(e.get("attachments") or []), bool(e.get("replied")), bool(e.get("draft_saved")))
+        for e in emails
+    ]
+    with db_cursor() as cursor:
+        execute_values(cursor, f'''
+            INSERT INTO emails (id, source, sender, subject, body, received_at, category, extracted_issue_summary,
+                                is_legal_communication, attachments, replied, draft_saved)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE SET
+                sender = EXCLUDED.sender,
+                subject = EXCLUDED.subject,
+                body = EXCLUDED.body,
+                received_at = EXCLUDED.received_at,
+                category = CASE WHEN EXCLUDED.category IN ({', '.join(repr(c) for c in UNCLASSIFIED_CATEGORIES)})
+                                THEN COALESCE(emails.category, EXCLUDED.category) ELSE EXCLUDED.category END,
+                extracted_issue_summary = COALESCE(EXCLUDED.extracted_issue_summary, emails.extracted_issue_summary),
+                is_legal_communication = EXCLUDED.is_legal_communication,
+                attachments = EXCLUDED.attachments
+        ''', rows, page_size=500)
+    return len(rows)
+
+def get_email(email_id):
+    with db_cursor() as cursor:
+        cursor.execute(f'SELECT {EMAIL_COLUMNS} FROM emails WHERE id = %s', (email_id,))
+        return cursor.fetchone()
+
+def list_emails(limit=50, before=None, replied=None, category=None, sender=None):
+    """
+    Newest-first page of emails. `before` is the (received_at, id) of the last row of the previous page;
+    paging by keyset instead of OFFSET keeps every page an index range scan.
+    """
+    conditions, params = [], []
+    if before is not None:
+        conditions.append('(received_at, id) < (%s, %s)')
+        params.extend(before)
+    if replied is not None:
+        conditions.append('replied = %s')
+        params.append(replied)
+    if category is not None:
+        conditions.append('category = %s')
+        params.append(category)
+    if sender is not None:
+        conditions.append('sender = %s')
+        params.append(sender)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with db_cursor() as cursor:
+        cursor.execute(
+            f'SELECT {EMAIL_COLUMNS} FROM emails {where} ORDER BY received_at DESC, id DESC LIMIT %s',
+            (*params, limit)
+        )
+        return cursor.fetchall()
+
+def update_email_status(email_id, replied=None, draft_saved=None):
+    with db_cursor() as cursor:
+        cursor.execute(
+            'UPDATE emails SET replied = COALESCE(%s, replied), draft_saved = COALESCE(%s, draft_saved) WHERE id = %s',
+            (replied, draft_saved, email_id)
+        )
+        return cursor.rowcount
+
+def rebuild_email_rollups():
+    """Recomputes the dashboard rollups from the emails table (for backfills and repairs)."""
+    with db_cursor() as cursor:
+        # Block writers for the duration so no trigger update lands between the wipe and the recount.
+        cursor.execute('LOCK TABLE emails IN SHARE MODE')
+        cursor.execute('DELETE FROM email_daily_rollups')
+        cursor.execute('DELETE FROM email_issue_rollups')
+        cursor.execute('''
+            INSERT INTO email_daily_rollups (day, category, replied, draft_saved, count)
+            SELECT received_at::date, COALESCE(category, 'uncategorized'), replied, draft_saved, COUNT(*)
+            FROM emails GROUP BY 1, 2, 3, 4
+        ''')
+        cursor.execute('''
+            INSERT INTO email_issue_rollups (issue, count)
+            SELECT left(COALESCE(extracted_issue_summary, subject, ''), 500), COUNT(*)
+            FROM emails WHERE category IS DISTINCT FROM 'spam' GROUP BY 1
+        ''')
+        cursor.execute('SELECT COUNT(*) AS count FROM emails')
+        return cursor.fetchone()["count"]
+
+def get_email_dashboard_stats(top_issue_limit=5):
+    """Aggregates for the dashboard, read from the rollup tables: totals, per-category counts, per-day replied/unreplied counts and top issues."""
+    with db_cursor() as cursor:
+        cursor.execute('''
+            SELECT day, category, replied, draft_saved, count FROM email_daily_rollups
+            WHERE count > 0 ORDER BY day
+        ''')
+        buckets = cursor.fetchall()
+        cursor.execute('''
+            SELECT issue, count FROM email_issue_rollups
+            WHERE count > 0 ORDER BY count DESC, issue LIMIT %s
+        ''', (top_issue_limit,))
+        top_issues = [(row["issue"], row["count"]) for row in cursor.fetchall()]
+
+    category_counts, daily = {}, {}
+    for row in buckets:
+        category_counts[row["category"]] = category_counts.get(row["category"], 0) + row["count"]
+        key = (row["day"], row["replied"])
+        daily[key] = daily.get(key, 0) + row["count"]
+    return {
+        "total": sum(row["count"] for row in buckets),
+        "replied": sum(row["count"] for row in buckets if row["replied"]),
+        "drafts": sum(row["count"] for row in buckets if row["draft_saved"]),
+        "category_counts": dict(sorted(category_counts.items(), key=lambda item: -item[1])),
+        "daily": [(day, replied, count) for (day, replied), count in daily.items()],
+        "top_issues": top_issues,
+    }
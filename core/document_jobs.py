@@ -0,0 +1,55 @@
+# core/document_jobs.py
+"""Idempotent OCR/analysis enqueueing for legal attachments.
+
+Each attachment is identified by the SHA-256 of its bytes. The document_jobs table records one job per
+hash (queued -> running -> done | failed), and only the caller whose claim creates the job sends the
+ocr_pdf task, so re-ingesting an email, the same file attached to several emails, or concurrent
+ingesters never run ocrmypdf twice for the same content. Jobs are enqueued once, at ingestion.
+"""
+import hashlib
+import os
+from core.database import claim_document_job, finish_document_job
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "/app/attachments")
+
+def file_content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def enqueue_document(pdf_path, user_id=None, retry_failed=False):
+    """Queues OCR for a PDF unless its content already has a job; returns the content hash if queued, else None."""
+    try:
+        content_hash = file_content_hash(pdf_path)
+    except OSError as e:
+        logger.debug(f"Not queueing OCR for {pdf_path}: {e}")
+        return None
+    if not claim_document_job(content_hash, pdf_path, user_id, retry_failed=retry_failed):
+        logger.debug(f"OCR for {pdf_path} already registered as {content_hash[:12]}")
+        return None
+    from celery_worker import ocr_pdf
+    try:
+        ocr_pdf.delay(pdf_path, user_id, content_hash=content_hash)
+    except Exception as e:
+        # Leave the job retryable instead of stuck in 'queued' when the broker is unavailable.
+        finish_document_job(content_hash, "failed", error=f"enqueue failed: {e}")
+        logger.error(f"Queueing OCR for {pdf_path} failed: {e}")
+        return None
+    logger.info(f"Queued OCR for {pdf_path} ({content_hash[:12]})")
+    return content_hash
+
+def enqueue_email_attachments(emails, user_id=None):
+    """Queues OCR for the attachments of legal communications (annotated email rows); returns how many were queued."""
+    queued = 0
+    for email in emails:
+        if not email.get("is_legal_communication"):
+            continue
+        for filename in email.get("attachments") or []:
+            if enqueue_document(os.path.join(ATTACHMENTS_DIR, filename), user_id):
+                queued += 1
+    return queued
@@ -1,7 +1,14 @@
 # core/email_imap.py
 import imaplib
 import email
-from email.header import decode_header
+import os
+import re
+import time
+from email.header import decode_header, make_header
+from core.database import get_imap_sync_state, save_imap_sync_state
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 def fetch_imap_emails(username, password, imap_server="imap.gmail.com"):
     mail = imaplib.IMAP4_SSL(imap_server)
@@ -37,3 +44,184 @@ def extract_email_body(msg):
     else:
         charset = msg.get_content_charset() or "utf-8"
         return msg.get_payload(decode=True).decode(charset, errors="replace")
+
+# --- Incremental sync ---
+#
+# iter_new_imap_emails only downloads messages with a UID above the one recorded for the mailbox in
+# imap_sync_state. If the server's UIDVALIDITY changes, the old UIDs are meaningless, so the mailbox
+# is treated as never synced. Each message costs its header and first body part; the full message is
+# downloaded only when that part is not plain text.
+
+SECTION_KEY = re.compile(rb"(BODY\[[^\]]*\])(?:<\d+>)? \{\d+\}$")
+MESSAGE_START = re.compile(rb"^\d+ \(")
+UID_ITEM = re.compile(rb"UID (\d+)")
+INTERNALDATE_ITEM = re.compile(rb'INTERNALDATE "[^"]+"')
+
+def decode_subject(raw_subject):
+    if not raw_subject:
+        return ""
+    try:
+        return str(make_header(decode_header(raw_subject)))
+    except Exception:
+        return raw_subject
+
+def _uid_ranges(uids, batch_size):
+    """Splits sorted UIDs into (first, last) ranges of at most batch_size messages each."""
+    for i in range(0, len(uids), batch_size):
+        chunk = uids[i:i + batch_size]
+        yield chunk[0], chunk[-1]
+
+def parse_fetch_response(data):
+    """
+    Turns imaplib FETCH response data into {uid: {"BODY[HEADER]": bytes, ..., "INTERNALDATE": epoch seconds}}.
+    Each literal arrives as a (prefix, payload) tuple; the UID can appear before or after the literals.
+    """
+    messages = {}
+    current = None
+    for item in data:
+        prefix, payload = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        if not isinstance(prefix, bytes):
+            continue
+        if MESSAGE_START.match(prefix):
+            current = {}
+        if current is None:
+            continue
+        uid_match = UID_ITEM.search(prefix)
+        if uid_match:
+            messages[int(uid_match.group(1))] = current
+        date_match = INTERNALDATE_ITEM.search(prefix)
+        if date_match:
+            parsed = imaplib.Internaldate2tuple(date_match.group(0))
+            current["INTERNALDATE"] = time.mktime(parsed) if parsed else None
+        section = SECTION_KEY.search(prefix)
+        if section and payload is not None:
+            current[section.group(1).decode()] = payload
+    return messages
+
+def _text_from_parts(header_bytes, part_mime_bytes, part_bytes):
+    """
+    Decodes the first body part if it is text/plain; returns None when the full message is needed.
+    For a multipart message the part's own headers come from BODY[1.MIME], otherwise from the message header.
+    """
+    header = email.message_from_bytes(header_bytes or b"")
+    if header.get_content_maintype() == "multipart":
+        part_header = email.message_from_bytes(part_mime_bytes or b"")
+    else:
+        part_header = header
+    if part_bytes is None or part_header.get_content_type() != "text/plain":
+        return None
+    if "attachment" in str(part_header.get("Content-Disposition")):
+        return None
+    part = email.message_from_bytes(
+        b"Content-Type: " + part_header.get("Content-Type", "text/plain").encode() + b"\r\n"
+        + b"Content-Transfer-Encoding: " + part_header.get("Content-Transfer-Encoding", "7bit").encode() + b"\r\n\r\n"
+        + part_bytes
+    )
+    charset = part.get_content_charset() or "utf-8"
+    return part.get_payload(decode=True).decode(charset, errors="replace")
+
+def _fetch_full_body(mail, uid):
+    status, data = mail.uid("FETCH", str(uid), "(BODY.PEEK[])")
+    sections = parse_fetch_response(data).get(uid, {})
+    raw = sections.get("BODY[]")
+    return extract_email_body(email.message_from_bytes(raw)) if raw else None
+
+def _select_mailbox(mail, mailbox):
+    status, _ = mail.select(mailbox, readonly=True)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"Cannot select mailbox {mailbox}")
+    _, values = mail.response("UIDVALIDITY")
+    if not values or values[0] is None:
+        _, status_data = mail.status(mailbox, "(UIDVALIDITY)")
+        values = re.findall(rb"UIDVALIDITY (\d+)", status_data[0])
+    return int(values[0])
+
+def sync_new_messages(mail, account, mailbox="inbox", batch_size=None, initial_window=None, limit=None):
+    """
+    Yields the messages that arrived in `mailbox` since the last sync recorded for `account`, oldest
+    first, over an already logged-in connection. `account` keys the sync state, so each consumer of a
+    mailbox (the ingester, the IDLE listener, the CLI) needs its own or they advance each other's cursor.
+    Message dicts have the same keys as fetch_imap_emails plus "uid", "mailbox", "uidvalidity" and
+    "received_at" (the server's arrival time, epoch seconds); "id" is the UID, which unlike a sequence
+    number is stable. Stored messages are keyed by message_key instead, as the same UID names another
+    message in another mailbox or after a UIDVALIDITY change.
+
+    UIDs are fetched in ranges of `batch_size` (IMAP_FETCH_BATCH_SIZE, default 500). On the first sync,
+    or after a UIDVALIDITY change, only the newest `initial_window` messages (IMAP_INITIAL_SYNC_WINDOW,
+    default 100) are fetched and older ones are skipped for good. With `limit`, only the oldest `limit`
+    of the new messages are fetched and the rest wait for the next sync. The stored last UID advances
+    after each range has been consumed, so a consumer that stops early sees the rest of that range again.
+    """
+    batch_size = batch_size or int(os.getenv("IMAP_FETCH_BATCH_SIZE", "500"))
+    if initial_window is None:
+        initial_window = int(os.getenv("IMAP_INITIAL_SYNC_WINDOW", "100"))
+
+    uidvalidity = _select_mailbox(mail, mailbox)
+    sync_state = get_imap_sync_state(account, mailbox)
+    resync = not sync_state or sync_state["uidvalidity"] != uidvalidity
+
+    if not resync:
+        last_uid = sync_state["last_uid"]
+        # "n:*" always matches the newest message, even when its UID is below n.
+        status, data = mail.uid("SEARCH", None, f"UID {last_uid + 1}:*")
+        uids = sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+    else:
+        if sync_state:
+            logger.info(f"UIDVALIDITY changed for {mailbox}; resyncing the newest {initial_window} messages")
+        status, data = mail.uid("SEARCH", None, "ALL")
+        all_uids = sorted(map(int, data[0].split()))
+        uids = all_uids[-initial_window:] if initial_window > 0 else []
+        skipped = all_uids[:len(all_uids) - len(uids)]
+        last_uid = skipped[-1] if skipped else 0
+    logger.debug(f"{len(uids)} new messages in {mailbox} since UID {last_uid}")
+    if limit is not None:
+        uids = uids[:limit]
+
+    for first, last in _uid_ranges(uids, batch_size):
+        status, data = mail.uid("FETCH", f"{first}:{last}",
+                                "(UID INTERNALDATE BODY.PEEK[HEADER] BODY.PEEK[1.MIME] BODY.PEEK[1])")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH {first}:{last} failed: {status}")
+        fetched = parse_fetch_response(data)
+        for uid in sorted(fetched):
+            sections = fetched[uid]
+            header = email.message_from_bytes(sections.get("BODY[HEADER]", b""))
+            body = _text_from_parts(sections.get("BODY[HEADER]"), sections.get("BODY[1.MIME]"), sections.get("BODY[1]"))
+            if body is None:
+                body = _fetch_full_body(mail, uid)
+            yield {
+                "id": str(uid),
+                "uid": uid,
+                "mailbox": mailbox,
+                "uidvalidity": uidvalidity,
+                "from": header.get("From"),
+                "subject": decode_subject(header.get("Subject")),
+                "body": body,
+                "received_at": sections.get("INTERNALDATE"),
+            }
+        last_uid = max(last_uid, last)
+        save_imap_sync_state(account, mailbox, uidvalidity, last_uid)
+
+    if resync:
+        save_imap_sync_state(account, mailbox, uidvalidity, last_uid)
+
+def message_key(account, message):
+    """The emails-table id of a message from sync_new_messages: "account:mailbox:uidvalidity:uid"."""
+    return f"{account}:{message['mailbox']}:{message['uidvalidity']}:{message['uid']}"
+
+def iter_new_imap_emails(username, password, imap_server="imap.gmail.com", mailbox="inbox",
+                         batch_size=None, initial_window=None, account=None, limit=None):
+    """
+    Connects, yields sync_new_messages for `username`'s mailbox, and logs out. The sync state is kept
+    under `account`, by default "username@imap_server" (as for ImapProfile.account).
+    """
+    account = account or f"{username}@{imap_server}"
+    mail = imaplib.IMAP4_SSL(imap_server)
+    try:
+        mail.login(username, password)
+        yield from sync_new_messages(mail, account, mailbox, batch_size, initial_window, limit)
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
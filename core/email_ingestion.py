@@ -1,6 +1,10 @@
 # core/email_ingestion.py
 import json
+from datetime import datetime, timezone
 from pathlib import Path
+from core.database import upsert_emails
+from core.email_imap import iter_new_imap_emails, message_key
+from core.document_jobs import enqueue_email_attachments
 
 def fetch_email(simulate: bool = True):
     """
@@ -26,4 +30,81 @@ def fetch_email(simulate: bool = True):
 
 
 # addede implementation that reads the email from a JSON file
-# added als the part wherre it reads the port number to make sure if runing locally
\ No newline at end of file
+# added als the part wherre it reads the port number to make sure if runing locally
+
+# --- Ingestion into the emails table ---
+
+LEGAL_KEYWORDS = ["law", "court", "attorney", "judge", "legal", "firm", "clerk"]
+ATTACHMENT_KEYWORDS = ["document", "attachment", "pdf", "serve", "motion", "order"]
+
+def annotate_email(email: dict, source: str = "json") -> dict:
+    """
+    Returns the emails-table row for a fetched message: normalizes the timestamp and flags legal
+    communications and (simulated) legal PDF attachments once, at ingestion, rather than per page view.
+    """
+    subject = (email.get("subject") or "").lower()
+    sender = (email.get("from") or "").lower()
+    is_legal = any(k in subject or k in sender for k in LEGAL_KEYWORDS)
+    attachments = list(email.get("attachments") or [])
+    if not attachments and any(word in subject for word in ATTACHMENT_KEYWORDS):
+        attachments = [f"{email['id']}_document.pdf"]
+
+    received_at = email.get("received_at")
+    if received_at is None:
+        received_at = email.get("timestamp")
+    if isinstance(received_at, (int, float)):
+        received_at = datetime.fromtimestamp(received_at, timezone.utc).replace(tzinfo=None)
+    elif isinstance(received_at, str):
+        received_at = datetime.fromisoformat(received_at)
+    elif received_at is None:
+        received_at = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    return {
+        "id": str(email["id"]),
+        "source": source,
+        "from": email.get("from"),
+        "subject": email.get("subject"),
+        "body": email.get("body"),
+        "received_at": received_at,
+        "category": email.get("category") or ("legal_document" if is_legal else "general_communication"),
+        "extracted_issue_summary": (email.get("classification_details") or {}).get("extracted_issue_summary")
+                                   or email.get("extracted_issue_summary"),
+        "is_legal_communication": is_legal,
+        "attachments": attachments,
+        "replied": bool(email.get("replied")),
+        "draft_saved": bool(email.get("draft_saved")),
+    }
+
+def ingest_emails(emails, source: str = "json", batch_size: int = 1000, enqueue_documents: bool = True,
+                  user_id=None) -> int:
+    """
+    Upserts any iterable of emails into the emails table in batches; returns how many were written.
+    With enqueue_documents, OCR is queued for legal attachments whose content has no document job yet;
+    their analyses belong to user_id, the user whose mailbox the emails come from.
+    """
+    written, batch = 0, []
+    def flush(rows):
+        count = upsert_emails(rows)
+        if enqueue_documents:
+            enqueue_email_attachments(rows, user_id)
+        return count
+    for email in emails:
+        batch.append(annotate_email(email, source))
+        if len(batch) >= batch_size:
+            written += flush(batch)
+            batch = []
+    return written + flush(batch)
+
+def ingest_json_file(path, user_id=None) -> int:
+    with open(path) as f:
+        return ingest_emails(json.load(f), source="json", user_id=user_id)
+
+def ingest_imap(username, password, imap_server="imap.gmail.com", mailbox="inbox", user_id=None) -> int:
+    """
+    Ingests new messages via incremental IMAP sync, keeping its sync state under "username@imap_server".
+    Ids are message_key's, since a UID is only unique within one mailbox and UIDVALIDITY.
+    """
+    account = f"{username}@{imap_server}"
+    messages = (dict(message, id=message_key(account, message))
+                for message in iter_new_imap_emails(username, password, imap_server, mailbox, account=account))
+    return ingest_emails(messages, source="imap", user_id=user_id)
@@ -0,0 +1,52 @@
+# core/gevent_io.py
+"""Cooperative I/O for the processes that run on gevent: the LLM Celery workers (-P gevent) and the web
+tier's gevent gunicorn workers (gunicorn.conf.py).
+
+Both monkey-patch the standard library before the app is imported, which makes sockets (Redis, HTTP
+clients), locks and sleeps yield to other greenlets. psycopg2 and gRPC (Gemini) do their own I/O in C and
+need their gevent hooks too, or one query or LLM call would block every other request or task in the
+process. run_concurrently lets a request run independent queries side by side on such a process; each
+of them holds a pooled Postgres connection meanwhile, so a request should only fan out a few at a time.
+"""
+
+_enabled = False
+
+def gevent_active():
+    """True when this process has been monkey-patched by gevent."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+def enable_gevent_io():
+    """Installs the psycopg2 and gRPC gevent hooks (once) if the process is monkey-patched; True if it is."""
+    global _enabled
+    if not gevent_active():
+        return False
+    if not _enabled:
+        from psycogreen.gevent import patch_psycopg
+        import grpc.experimental.gevent as grpc_gevent
+        patch_psycopg()
+        grpc_gevent.init_gevent()
+        _enabled = True
+    return True
+
+def run_concurrently(*calls, limit=None):
+    """
+    Calls each function (no arguments) and returns their results in order: at most `limit` at a time (all
+    at once by default) on greenlets in a gevent process, one after another otherwise. The first exception
+    raised by a call is re-raised. The calls run outside the request's context, so they must not use
+    Flask's request, g or current_user.
+    """
+    if not gevent_active():
+        return [call() for call in calls]
+    import gevent
+    from gevent.pool import Pool
+    spawn = Pool(limit).spawn if limit else gevent.spawn
+    greenlets = [spawn(call) for call in calls]
+    gevent.joinall(greenlets)
+    for greenlet in greenlets:
+        if not greenlet.successful():
+            raise greenlet.exception
+    return [greenlet.value for greenlet in greenlets]
@@ -0,0 +1,216 @@
+# core/imap_idle.py
+"""Continuous ingestion: one IMAP IDLE connection per 'imap' SMTPIMAPProfile.
+
+Each listener syncs new messages (see email_imap.sync_new_messages), then IDLEs until the server
+announces EXISTS or the IDLE times out, and repeats. Every new message is handed to `on_message`;
+by default it is enqueued as a process_incoming_email Celery task. Connection failures are retried
+with capped exponential backoff. A listener process runs at most IMAP_IDLE_MAX_CONNECTIONS listeners
+and does not start any for the profiles beyond that (it logs them); to listen to more profiles, run
+IMAP_IDLE_SHARDS processes, each with its own IMAP_IDLE_SHARD (0, 1, ...) taking the profiles whose
+id modulo IMAP_IDLE_SHARDS equals it.
+
+    IMAP_IDLE_SHARDS=2 IMAP_IDLE_SHARD=0 python -m core.imap_idle
+"""
+import imaplib
+import os
+import random
+import select
+import ssl
+import threading
+import time
+from dataclasses import dataclass
+from core.email_imap import sync_new_messages, message_key
+from utils.logger import get_logger
+from utils.metrics import SharedLatencies
+
+logger = get_logger(__name__)
+
+# Recorded here, in process_incoming_email and in the listener process; /admin/metrics reports them from Redis
+imap_latencies = SharedLatencies(("imap_arrival_to_fetched", "imap_queue_wait", "imap_arrival_to_classified"),
+                                 os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+                                 max_samples=int(os.getenv("IMAP_LATENCY_SAMPLES", "500")))
+
+@dataclass
+class ImapProfile:
+    id: int
+    host: str
+    port: int
+    username: str
+    password: str
+    use_ssl: bool = True
+    user_id: int = None
+    ai_user_id: int = None
+    mailbox: str = "inbox"
+
+    @property
+    def account(self):
+        return f"{self.username}@{self.host}"
+
+def load_imap_profiles():
+    """Reads every SMTPIMAPProfile of type 'imap' from the web app's database."""
+    from app import app, SMTPIMAPProfile
+    with app.app_context():
+        return [
+            ImapProfile(id=p.id, host=p.host, port=p.port, username=p.username, password=p.password,
+                        use_ssl=bool(p.use_ssl), user_id=p.user_id, ai_user_id=p.ai_user_id)
+            for p in SMTPIMAPProfile.query.filter_by(type="imap").all()
+        ]
+
+def enqueue_incoming_email(profile, message):
+    from celery_worker import process_incoming_email
+    process_incoming_email.delay(message, profile.id, time.time(), user_id=profile.user_id)
+
+class ImapIdleListener:
+    def __init__(self, profile, on_message=enqueue_incoming_email, stop_event=None,
+                 idle_timeout=None, poll_interval=1.0, min_backoff=1.0, max_backoff=None, initial_window=None):
+        self.profile = profile
+        self.on_message = on_message
+        self.stop_event = stop_event or threading.Event()
+        # Servers may drop an IDLE after 30 minutes, so it is renewed well before that.
+        self.idle_timeout = idle_timeout or float(os.getenv("IMAP_IDLE_TIMEOUT", "600"))
+        self.poll_interval = poll_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff or float(os.getenv("IMAP_IDLE_MAX_BACKOFF", "300"))
+        # By default a listener only picks up mail that arrives after its first start.
+        self.initial_window = initial_window if initial_window is not None else int(os.getenv("IMAP_IDLE_INITIAL_WINDOW", "0"))
+        self.reconnects = 0
+
+    def _connect(self):
+        cls = imaplib.IMAP4_SSL if self.profile.use_ssl else imaplib.IMAP4
+        mail = cls(self.profile.host, self.profile.port)
+        mail.login(self.profile.username, self.profile.password)
+        return mail
+
+    def _sync(self, mail):
+        for message in sync_new_messages(mail, self.profile.account, self.profile.mailbox, initial_window=self.initial_window):
+            # UIDs are only unique per mailbox and UIDVALIDITY; qualify them so ids are unique in the emails table.
+            message["id"] = message_key(self.profile.account, message)
+            if message.get("received_at"):
+                imap_latencies.record("imap_arrival_to_fetched", max(0.0, time.time() - message["received_at"]))
+            try:
+                self.on_message(self.profile, message)
+            except Exception as e:
+                logger.error(f"Handling message {message['uid']} from profile {self.profile.id} failed: {e}")
+
+    @staticmethod
+    def _received(mail):
+        """
+        Whether data has arrived that select on the socket would not report: read ahead into imaplib's
+        buffered file (say an EXISTS in the same segment as the IDLE continuation) or decrypted by TLS.
+        """
+        timeout = mail.sock.gettimeout()
+        mail.sock.settimeout(0)
+        try:
+            # Returns what is buffered without reading; with nothing buffered, reads only what is there already
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            mail.sock.settimeout(timeout)
+
+    def _idle(self, mail):
+        """IDLEs until the server reports new mail, the IDLE times out, or the listener is stopped."""
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+        deadline = time.monotonic() + self.idle_timeout
+        new_mail = False
+        while not new_mail and not self.stop_event.is_set() and time.monotonic() < deadline:
+            if not self._received(mail):
+                ready, _, _ = select.select([mail.sock], [], [], min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+                if not ready:
+                    continue
+            line = mail.readline()
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort("server closed the connection during IDLE")
+            new_mail = line.rstrip().endswith(b"EXISTS")
+
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("server closed the connection while ending IDLE")
+            if line.startswith(tag):
+                if not line[len(tag):].lstrip().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+                return
+
+    def run(self):
+        backoff = self.min_backoff
+        while not self.stop_event.is_set():
+            mail = None
+            try:
+                mail = self._connect()
+                logger.info(f"IMAP listener connected for profile {self.profile.id} ({self.profile.account})")
+                backoff = self.min_backoff
+                while not self.stop_event.is_set():
+                    self._sync(mail)
+                    self._idle(mail)
+            except (OSError, imaplib.IMAP4.error) as e:
+                self.reconnects += 1
+                logger.warning(f"IMAP listener for profile {self.profile.id} disconnected: {e}; retrying in {backoff:.1f}s")
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+            if self.stop_event.wait(backoff * random.uniform(0.8, 1.2)):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+def shard_profiles(profiles, shard=None, shards=None):
+    """The profiles this listener process serves: those whose id modulo shards is shard (IMAP_IDLE_SHARD(S))."""
+    shards = shards or int(os.getenv("IMAP_IDLE_SHARDS", "1"))
+    shard = int(os.getenv("IMAP_IDLE_SHARD", "0")) if shard is None else shard
+    return [profile for profile in profiles if profile.id % shards == shard]
+
+class ImapIdleSupervisor:
+    """
+    Runs one listener thread per profile, for at most `max_connections` profiles. Each listener keeps its
+    connection for as long as it runs, so profiles beyond the cap are not served by this process at all.
+    """
+    def __init__(self, profiles, on_message=enqueue_incoming_email, max_connections=None, **listener_kwargs):
+        self.max_connections = max_connections or int(os.getenv("IMAP_IDLE_MAX_CONNECTIONS", "10"))
+        self.stop_event = threading.Event()
+        self.skipped = profiles[self.max_connections:]
+        self.listeners = [
+            ImapIdleListener(profile, on_message, stop_event=self.stop_event, **listener_kwargs)
+            for profile in profiles[:self.max_connections]
+        ]
+        self.threads = []
+
+    def start(self):
+        if self.skipped:
+            logger.error(f"{len(self.listeners) + len(self.skipped)} IMAP profiles but only {self.max_connections} "
+                         f"connections allowed; not listening to profiles {[p.id for p in self.skipped]}. Raise "
+                         "IMAP_IDLE_MAX_CONNECTIONS or split the profiles over more IMAP_IDLE_SHARDS")
+        for listener in self.listeners:
+            thread = threading.Thread(target=listener.run, name=f"imap-idle-{listener.profile.id}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+def main():
+    profiles = shard_profiles(load_imap_profiles())
+    if not profiles:
+        logger.info("No IMAP profiles configured; nothing to listen to.")
+        return
+    supervisor = ImapIdleSupervisor(profiles)
+    supervisor.start()
+    logger.info(f"Listening to {len(supervisor.listeners)} IMAP profile(s).")
+    try:
+        while any(thread.is_alive() for thread in supervisor.threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# core/legal_results.py
+"""Legal document analyses: the indexed store behind the dashboard's documents and events.
+
+analyze_legal_document stores each result in legal_documents/legal_events (see core/database.py);
+the JSON files under LLM_RESULTS_DIR are kept as an export and can be loaded into the tables with
+`flask --app app import-legal-results`.
+"""
+import glob
+import json
+import os
+from datetime import datetime, timezone
+from core.database import save_legal_document
+from core.document_jobs import ATTACHMENTS_DIR
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LLM_RESULTS_DIR = "/app/llm_results"
+
+def ics_filename(case_number, document_type, date, user_id=None):
+    safe_case = (case_number or "unknown").replace('/', '_').replace(' ', '_')
+    safe_doc = (document_type or "event").replace(' ', '_')
+    safe_dt = date.replace(':', '').replace('-', '').replace('T', '_')
+    filename = f"{safe_case}_{safe_doc}_{safe_dt}"
+    if user_id:
+        filename += f"_user{user_id}"
+    return filename + ".ics"
+
+def parse_event_date(value):
+    """Parses an ISO 8601 date from the model into a naive UTC datetime, or None if it is not one."""
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def event_rows(result, user_id=None):
+    """(starts_at, raw_date, ics_filename) for each parseable event date in an analysis result."""
+    rows = []
+    for date in result.get("event_dates") or []:
+        starts_at = parse_event_date(date)
+        if starts_at is None:
+            logger.warning(f"Skipping unparseable event date {date!r} for case {result.get('case_number')}")
+            continue
+        rows.append((starts_at, date, ics_filename(result.get("case_number"), result.get("document_type"), date, user_id)))
+    return rows
+
+def merge_legal_fields(partials):
+    """
+    Reduces per-chunk analyses (in document order) into one: the first value found for document_type,
+    case_number, court and raw_excerpt, parties deduplicated case-insensitively, and the union of event dates.
+    """
+    merged = {"document_type": None, "case_number": None, "court": None, "parties": [], "event_dates": [], "raw_excerpt": None}
+    seen_parties, seen_dates = set(), set()
+    for partial in partials:
+        if not partial:
+            continue
+        for key in ("document_type", "case_number", "court", "raw_excerpt"):
+            if not merged[key] and partial.get(key):
+                merged[key] = partial[key]
+        for party in partial.get("parties") or []:
+            normalized = " ".join(str(party).split()).casefold()
+            if normalized and normalized not in seen_parties:
+                seen_parties.add(normalized)
+                merged["parties"].append(" ".join(str(party).split()))
+        for date in partial.get("event_dates") or []:
+            if date and date not in seen_dates:
+                seen_dates.add(date)
+                merged["event_dates"].append(date)
+    merged["event_dates"].sort(key=lambda date: (parse_event_date(date) is None, parse_event_date(date) or datetime.min, date))
+    return merged
+
+def _user_id(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def store_analysis(doc_id, result, user_id=None, txt_path=None):
+    user_id = _user_id(user_id)
+    return save_legal_document(doc_id, result, user_id=user_id, txt_path=txt_path, events=event_rows(result, user_id))
+
+def import_result_files(results_dir=LLM_RESULTS_DIR):
+    """Loads analysis JSON files written before results were stored in Postgres; returns how many were imported."""
+    imported = 0
+    for path in glob.glob(os.path.join(results_dir, '*.json')):
+        doc_id = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Skipping unreadable result {path}: {e}")
+            continue
+        txt_path = next((candidate for candidate in (os.path.join(results_dir, f'{doc_id}.txt'),
+                                                     os.path.join(ATTACHMENTS_DIR, f'{doc_id}.txt'))
+                         if os.path.exists(candidate)), None)
+        store_analysis(doc_id, result, result.get("user_id"), txt_path)
+        imported += 1
+    return imported
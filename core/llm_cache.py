@@ -0,0 +1,175 @@
+# core/llm_cache.py
+"""Content-addressed cache for LLM responses.
+
+Entries are keyed by a SHA-256 of (namespace, prompt template version, model, temperature, input text),
+so the same classification/summary/analysis request is only paid for once. Bump a template version
+whenever its prompt changes to invalidate old entries.
+
+Backends (LLM_CACHE_BACKEND):
+  memory - per-process LRU with TTL, bounded by LLM_CACHE_MAX_ENTRIES (default)
+  redis  - shared across processes; entries expire after LLM_CACHE_TTL and size is bounded by the
+           Redis maxmemory/eviction policy of LLM_CACHE_REDIS_URL
+  none   - caching disabled
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class InMemoryCacheBackend:
+    # Values are stored serialized so callers never share (and mutate) a cached object.
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, json.dumps(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+class RedisCacheBackend:
+    def __init__(self, url, prefix="llmcache:"):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + "*"):
+            self._redis.delete(key)
+
+    def size(self):
+        return None
+
+class LLMResponseCache:
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(namespace, template_version, model, temperature, text):
+        payload = json.dumps([namespace, template_version, model, temperature, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def lookup(self, namespace, template_version, model, temperature, text):
+        """Returns the cached value or None. Backend failures are logged and treated as misses."""
+        if self.backend is None:
+            return None
+        key = self.make_key(namespace, template_version, model, temperature, text)
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"LLM cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            self._count("hits")
+            logger.debug(f"LLM cache hit for {namespace} ({key[:12]})")
+        else:
+            self._count("misses")
+        return cached
+
+    def store(self, namespace, template_version, model, temperature, text, value):
+        if self.backend is None or value is None:
+            return
+        key = self.make_key(namespace, template_version, model, temperature, text)
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"LLM cache store failed: {e}")
+
+    def get_or_compute(self, namespace, template_version, model, temperature, text, compute, cacheable=None):
+        """
+        Returns the cached value for these inputs, or calls compute() and stores its result.
+        cacheable(value) can veto storing a result (e.g. an unparseable model reply).
+        """
+        if self.backend is None:
+            return compute()
+        cached = self.lookup(namespace, template_version, model, temperature, text)
+        if cached is not None:
+            return cached
+        value = compute()
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.store(namespace, template_version, model, temperature, text, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+        if isinstance(self.backend, InMemoryCacheBackend):
+            stats["size"] = self.backend.size()
+            stats["evictions"] = self.backend.evictions
+        return stats
+
+def model_identity(model):
+    """A stable description of a chat client for cache keys, e.g. 'ChatGoogleGenerativeAI:gemini-2.0-flash'."""
+    name = getattr(model, "model", None) or getattr(model, "model_name", None) or ""
+    return f"{type(model).__name__}:{name}"
+
+def _build_default_cache():
+    backend_name = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("LLM_CACHE_TTL", "86400"))
+    if backend_name == "none":
+        return LLMResponseCache(None)
+    if backend_name == "redis":
+        try:
+            backend = RedisCacheBackend(os.getenv("LLM_CACHE_REDIS_URL", "redis://redis:6379/1"))
+            return LLMResponseCache(backend, ttl=ttl)
+        except ImportError:
+            logger.warning("redis package not installed; falling back to in-memory LLM cache")
+    return LLMResponseCache(InMemoryCacheBackend(int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))), ttl=ttl)
+
+llm_cache = _build_default_cache()
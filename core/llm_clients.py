@@ -0,0 +1,101 @@
+# core/llm_clients.py
+"""Chat model clients hold their own HTTP/gRPC connection pools, so building one per call throws away
+keep-alive connections and TLS sessions. The registry hands out one shared client per
+(client class, model, temperature, api key, ...) and evicts the least recently used ones."""
+
+import os
+import threading
+from collections import OrderedDict
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# service_type (as stored on LLMService) -> (client class, default model, api key kwarg, extra kwargs)
+SERVICE_CLIENTS = {
+    "gemini": (ChatGoogleGenerativeAI, "gemini-2.0-flash", "google_api_key", {}),
+    "openai": (ChatOpenAI, "gpt-4o-mini", "openai_api_key", {}),
+    "deepseek": (ChatOpenAI, "deepseek-chat", "openai_api_key", {"base_url": "https://api.deepseek.com/v1"}),
+}
+
+API_KEY_KWARGS = ("google_api_key", "openai_api_key", "api_key", "anthropic_api_key")
+
+class LLMClientRegistry:
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, client_cls, **kwargs):
+        key = (client_cls, tuple(sorted(kwargs.items())))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+        # Construct outside the lock; if two threads race, the first one stored wins.
+        client = client_cls(**kwargs)
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return existing
+            self.misses += 1
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return client
+
+    def evict(self, api_key):
+        """Drops every client built with api_key (e.g. after the key was changed or deleted)."""
+        with self._lock:
+            stale = [key for key in self._clients
+                     if any(name in API_KEY_KWARGS and value == api_key for name, value in key[1])]
+            for key in stale:
+                del self._clients[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._clients), "max": self.max_size, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+registry = LLMClientRegistry(max_size=int(os.getenv("LLM_CLIENT_CACHE_SIZE", "32")))
+
+def get_llm_client(client_cls, **kwargs):
+    """
+    Returns a shared chat model client, e.g.
+    get_llm_client(ChatGoogleGenerativeAI, model="gemini-2.0-flash", temperature=0.2, google_api_key=key).
+    All keyword arguments must be hashable.
+    """
+    return registry.get(client_cls, **kwargs)
+
+def get_llm_client_for_service(service_type, api_key, temperature, model=None):
+    """Returns a shared client for an LLMService row (service_type/api_key)."""
+    if service_type == "anthropic":
+        try:
+            from langchain_anthropic import ChatAnthropic
+        except ImportError:
+            raise ValueError("LLM service type 'anthropic' requires the langchain-anthropic package.")
+        return registry.get(ChatAnthropic, model=model or "claude-3-5-haiku-latest", temperature=temperature, anthropic_api_key=api_key)
+    if service_type not in SERVICE_CLIENTS:
+        raise ValueError(f"Unsupported LLM service type: {service_type}")
+    client_cls, default_model, key_kwarg, extra = SERVICE_CLIENTS[service_type]
+    return registry.get(client_cls, model=model or default_model, temperature=temperature, **{key_kwarg: api_key}, **extra)
+
+def evict_llm_clients(api_key):
+    if api_key:
+        evicted = registry.evict(api_key)
+        if evicted:
+            logger.info(f"Evicted {evicted} cached LLM client(s) for a changed API key")
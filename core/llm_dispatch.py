@@ -0,0 +1,254 @@
+# core/llm_dispatch.py
+"""Every LLM call goes through invoke_llm (or stream_llm), which keeps each API key within its request and token budgets.
+
+Each key has two token buckets: LLM_REQUESTS_PER_MINUTE requests and LLM_TOKENS_PER_MINUTE tokens, each
+refilling continuously at its per-minute rate (0 turns a budget off). A call takes one request and its
+prompt's estimated tokens, waiting while either bucket is short, and afterwards is charged the difference
+to the tokens the provider reports, so long answers slow down the next calls. The buckets are kept in
+Redis under a hash of the key, so every web and worker process shares them for GEMINI_API_KEY as for a
+user's or an LLMService's key; while Redis cannot be reached each process keeps its own.
+
+A call the provider still rejects for its rate limit (HTTP 429 / ResourceExhausted) is retried after an
+exponential backoff with full jitter, up to LLM_RATE_LIMIT_RETRIES times. If the budget does not free up
+within LLM_RATE_LIMIT_MAX_WAIT seconds or the retries run out, LLMRateLimited is raised; the Celery tasks
+retry on it later (celery_worker.RATE_LIMIT_RETRY) instead of dropping the work.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "120"))
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "5"))
+LLM_RATE_LIMIT_BACKOFF = float(os.getenv("LLM_RATE_LIMIT_BACKOFF", "2"))
+LLM_RATE_LIMIT_BACKOFF_MAX = float(os.getenv("LLM_RATE_LIMIT_BACKOFF_MAX", "60"))
+LLM_RATE_LIMIT_REDIS_URL = os.getenv("LLM_RATE_LIMIT_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"))
+
+API_KEY_ATTRIBUTES = ("google_api_key", "openai_api_key", "anthropic_api_key")
+KEY_PREFIX = "llm_budget:"
+# Buckets are full again after a minute, so an idle key's state can expire after two
+BUCKET_TTL = 120
+# After a Redis error, use this process's buckets for this long before trying Redis again
+REDIS_RETRY_AFTER = 30
+
+class LLMRateLimited(Exception):
+    """An LLM call could not be made within its key's budget, or the provider kept refusing it."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# KEYS: one hash per bucket. ARGV: force (1: debit even if short), ttl, then capacity, refill per second and
+# amount for each bucket. Returns the seconds until every bucket holds its amount, "0" once they were debited.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local force = ARGV[1] == '1'
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+  local capacity, rate, amount = tonumber(ARGV[i * 3]), tonumber(ARGV[i * 3 + 1]), tonumber(ARGV[i * 3 + 2])
+  local state = redis.call('HMGET', key, 'level', 'updated')
+  local level = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  level = math.min(capacity, level + math.max(0, now - updated) * rate)
+  levels[i] = level
+  if not force and level < amount then wait = math.max(wait, (amount - level) / rate) end
+end
+for i, key in ipairs(KEYS) do
+  local level = levels[i]
+  if wait == 0 then level = level - tonumber(ARGV[i * 3 + 2]) end
+  redis.call('HSET', key, 'level', tostring(level), 'updated', tostring(now))
+  redis.call('EXPIRE', key, tonumber(ARGV[2]))
+end
+return tostring(wait)
+"""
+
+def refill(level, updated, now, capacity, rate):
+    return min(capacity, level + max(0.0, now - updated) * rate)
+
+class TokenBuckets:
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 redis_url=LLM_RATE_LIMIT_REDIS_URL):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.redis_url = redis_url or ""
+        self._redis = None
+        self._script = None
+        self._redis_down_until = 0.0
+        self._local = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self.refused = 0
+        self.errors = 0
+
+    def _client(self):
+        if self._redis is None and self.redis_url.startswith(("redis://", "rediss://")):
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+            self._script = self._redis.register_script(TAKE_SCRIPT)
+        return self._redis
+
+    def _count(self, attr, amount=1):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + amount)
+
+    def _buckets(self, key, requests, tokens):
+        """(name, capacity, refill per second, amount) of each budget in force for this key."""
+        budgets = (("requests", self.requests_per_minute, requests), ("tokens", self.tokens_per_minute, tokens))
+        return [(f"{KEY_PREFIX}{key}:{name}", capacity, capacity / 60.0, min(amount, capacity))
+                for name, capacity, amount in budgets if capacity > 0]
+
+    def take(self, key, requests, tokens, force=False):
+        """
+        Takes requests and tokens from the key's buckets if both hold enough and returns 0; otherwise takes
+        nothing and returns the seconds until they will. With force, takes them regardless (buckets may go
+        below zero), e.g. to charge tokens a call used beyond its estimate.
+        """
+        buckets = self._buckets(key, requests, tokens)
+        if not buckets:
+            return 0.0
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                if self._client() is not None:
+                    args = [1 if force else 0, BUCKET_TTL]
+                    for _, capacity, rate, amount in buckets:
+                        args.extend([capacity, rate, amount])
+                    return float(self._script(keys=[bucket[0] for bucket in buckets], args=args))
+            except Exception as e:
+                self._count("errors")
+                self._redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+                logger.warning(f"LLM budgets in Redis unavailable, using this process's for {REDIS_RETRY_AFTER}s: {e}")
+        return self._take_local(buckets, force)
+
+    def _take_local(self, buckets, force):
+        now = time.monotonic()
+        with self._lock:
+            levels = [refill(*self._local.get(name, (capacity, now)), now, capacity, rate)
+                      for name, capacity, rate, _ in buckets]
+            wait = 0.0
+            if not force:
+                wait = max([(amount - level) / rate for level, (_, _, rate, amount) in zip(levels, buckets)
+                            if level < amount], default=0.0)
+            for level, (name, _, _, amount) in zip(levels, buckets):
+                self._local[name] = (level - amount if wait == 0 else level, now)
+            return wait
+
+    def acquire(self, key, tokens, deadline):
+        """Waits until the key's buckets give one request and tokens; raises LLMRateLimited past deadline."""
+        self._count("calls")
+        while True:
+            wait = self.take(key, 1, tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                self._count("refused")
+                raise LLMRateLimited(f"LLM budget for key {key} is exhausted for another {wait:.1f}s", retry_after=wait)
+            # A little jitter so processes waiting on the same key do not all come back at once
+            wait += random.uniform(0, min(1.0, wait) * 0.1)
+            self._count("waits")
+            self._count("waited_seconds", wait)
+            time.sleep(wait)
+
+    def charge(self, key, tokens):
+        if tokens:
+            self.take(key, 0, tokens, force=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests_per_minute": self.requests_per_minute, "tokens_per_minute": self.tokens_per_minute,
+                "calls": self.calls, "waits": self.waits, "waited_seconds": round(self.waited_seconds, 3),
+                "refused": self.refused, "errors": self.errors,
+            }
+
+buckets = TokenBuckets()
+
+def api_key_id(model):
+    """A short hash of the API key a chat client was built with, never the key itself."""
+    for attribute in API_KEY_ATTRIBUTES:
+        value = getattr(model, attribute, None)
+        if value:
+            secret = value.get_secret_value() if hasattr(value, "get_secret_value") else value
+            return hashlib.sha256(str(secret).encode("utf-8")).hexdigest()[:16]
+    return f"nokey-{type(model).__name__}"
+
+def estimate_tokens(prompt):
+    """About four characters per token; corrected after the call from the provider's usage report."""
+    return len(str(prompt)) // 4 + 1
+
+def is_rate_limit_error(error):
+    """True for a provider's rate limit rejection (HTTP 429, Google's ResourceExhausted), also when wrapped."""
+    while error is not None:
+        if type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+            return True
+        if 429 in (getattr(error, "status_code", None), getattr(error, "code", None)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def used_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    total = usage.get("total_tokens") if isinstance(usage, dict) else None
+    return total if isinstance(total, int) else None
+
+def _back_off(key, attempt, deadline, error):
+    """Sleeps before retrying a call the provider refused for its rate limit, or raises LLMRateLimited."""
+    delay = random.uniform(0, min(LLM_RATE_LIMIT_BACKOFF_MAX, LLM_RATE_LIMIT_BACKOFF * 2 ** attempt))
+    if attempt == LLM_RATE_LIMIT_RETRIES or time.monotonic() + delay > deadline:
+        raise LLMRateLimited(f"Provider kept rate limiting key {key}: {error}", retry_after=delay) from error
+    logger.warning(f"Provider rate limited key {key} (attempt {attempt + 1}), retrying in {delay:.1f}s")
+    time.sleep(delay)
+
+def invoke_llm(model, prompt, **kwargs):
+    """model.invoke(prompt) within the budgets of the model's API key (see the module docstring)."""
+    key = api_key_id(model)
+    estimate = estimate_tokens(prompt)
+    deadline = time.monotonic() + LLM_RATE_LIMIT_MAX_WAIT
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        buckets.acquire(key, estimate, deadline)
+        try:
+            response = model.invoke(prompt, **kwargs)
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                raise
+            _back_off(key, attempt, deadline, e)
+            continue
+        used = used_tokens(response)
+        if used is not None:
+            buckets.charge(key, used - estimate)
+        return response
+
+def stream_llm(model, prompt, **kwargs):
+    """
+    model.stream(prompt) within the same budgets: yields the reply's chunks as they arrive. A rate limit
+    refusal is retried like invoke_llm's only until the first chunk; after that the error is raised.
+    """
+    key = api_key_id(model)
+    estimate = estimate_tokens(prompt)
+    deadline = time.monotonic() + LLM_RATE_LIMIT_MAX_WAIT
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        buckets.acquire(key, estimate, deadline)
+        streamed, used = False, None
+        try:
+            for chunk in model.stream(prompt, **kwargs):
+                streamed = True
+                # Chunks report usage in parts, which add up
+                chunk_used = used_tokens(chunk)
+                if chunk_used is not None:
+                    used = (used or 0) + chunk_used
+                yield chunk
+        except Exception as e:
+            if streamed or not is_rate_limit_error(e):
+                raise
+            _back_off(key, attempt, deadline, e)
+            continue
+        if used is not None:
+            buckets.charge(key, used - estimate)
+        return
@@ -0,0 +1,138 @@
+# core/ocr.py
+"""Text extraction for PDFs: the embedded text layer first, page-sharded OCR with ocrmypdf for the rest.
+
+text_layer reads every page's embedded text. A page with at least OCR_TEXT_LAYER_MIN_CHARS non-space
+characters is taken as it is; only the pages below that (scans, or a scan with a stamped header) are OCR'd,
+so a born-digital filing never reaches tesseract. ocr_pdf copies the pages to OCR into shards of
+OCR_SHARD_PAGES pages (split_pdf), a single shard unless there are more than OCR_SHARD_MIN_PAGES of them,
+and OCRs the shards in parallel Celery tasks with OCR_JOBS ocrmypdf workers each. assemble then writes the
+text, pages separated by form feeds, and a searchable copy of the PDF with the OCR'd pages swapped in
+(<name>.ocr.pdf), leaving the input as it was so a retried job starts from the original.
+
+ocrmypdf does not report time per page, so page_timings gives each OCR'd page an equal share of its
+shard's run; lower OCR_SHARD_PAGES for finer timings.
+"""
+import os
+import re
+import subprocess
+import time
+import pikepdf
+import pypdfium2
+
+OCR_JOBS = int(os.getenv("OCR_JOBS", "1"))
+OCR_SHARD_PAGES = int(os.getenv("OCR_SHARD_PAGES", "10"))
+OCR_SHARD_MIN_PAGES = int(os.getenv("OCR_SHARD_MIN_PAGES", "20"))
+OCR_TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_TEXT_LAYER_MIN_CHARS", "100"))
+
+SKIPPED_RE = re.compile(r"\[OCR skipped on page\(s\) (\d+)(?:-(\d+))?\]")
+
+def text_layer(pdf_path):
+    """The embedded text of every page, in order ("" for a page without any)."""
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return [document[page].get_textpage().get_text_range() for page in range(len(document))]
+    finally:
+        document.close()
+
+def needs_ocr(text):
+    return len("".join(text.split())) < OCR_TEXT_LAYER_MIN_CHARS
+
+def ocr_shards(pages, shard_pages=None):
+    """Splits the zero-based page numbers to OCR into groups of at most shard_pages."""
+    shard_pages = shard_pages or OCR_SHARD_PAGES
+    return [pages[start:start + shard_pages] for start in range(0, len(pages), shard_pages)]
+
+def ocr_output_path(pdf_path):
+    return os.path.splitext(pdf_path)[0] + ".ocr.pdf"
+
+def work_dir(pdf_path):
+    return os.path.splitext(pdf_path)[0] + ".ocr"
+
+def split_pdf(pdf_path, shards, directory):
+    """Writes one PDF per shard (a list of zero-based page numbers) into directory and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with pikepdf.open(pdf_path) as source:
+        for index, pages in enumerate(shards):
+            shard = pikepdf.new()
+            shard.pages.extend(source.pages[page] for page in pages)
+            path = os.path.join(directory, f"shard-{index:04d}.pdf")
+            shard.save(path)
+            paths.append(path)
+    return paths
+
+def sidecar_pages(text):
+    """Splits an ocrmypdf sidecar into one entry per page: its text, or None if OCR was skipped."""
+    pages = []
+    for section in text.removesuffix("\f").split("\f"):
+        match = SKIPPED_RE.fullmatch(section.strip())
+        if match:
+            first = int(match.group(1))
+            pages.extend([None] * (int(match.group(2) or first) - first + 1))
+        else:
+            pages.append(section)
+    return pages
+
+def write_text(path, text):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+def ocr_range(input_pdf, output_pdf, sidecar_path, jobs=None, force=False):
+    """
+    OCRs input_pdf into output_pdf and writes its text to sidecar_path, pages separated by form feeds.
+    Without force, pages that have a text layer are skipped (--skip-text) and keep their text; with it,
+    every page is OCR'd (--force-ocr), for pages already chosen by their text density.
+    Returns the run's wall time in seconds and, per page, whether it was OCR'd.
+    """
+    started = time.perf_counter()
+    subprocess.run([
+        'ocrmypdf', '--force-ocr' if force else '--skip-text', '--jobs', str(jobs or OCR_JOBS),
+        '--sidecar', sidecar_path, input_pdf, output_pdf
+    ], check=True)
+    seconds = time.perf_counter() - started
+    with open(sidecar_path, encoding="utf-8") as f:
+        pages = sidecar_pages(f.read())
+    if None in pages:
+        existing = text_layer(output_pdf)
+        write_text(sidecar_path, "\f".join(existing[page] if text is None else text
+                                           for page, text in enumerate(pages)))
+    return {"seconds": seconds, "ocr": [text is not None for text in pages]}
+
+def assemble(pdf_path, shards, txt_path, output_pdf):
+    """
+    Writes the document's text and searchable PDF from its text layer and OCR'd shards, given as dicts
+    with the shard's pages (zero-based, in the original), pdf_path and txt_path. Returns the page count.
+    """
+    texts = text_layer(pdf_path)
+    opened = []
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            for shard in shards:
+                shard_pdf = pikepdf.open(shard["pdf_path"])
+                opened.append(shard_pdf)
+                with open(shard["txt_path"], encoding="utf-8") as f:
+                    shard_texts = sidecar_pages(f.read())
+                for offset, page in enumerate(shard["pages"]):
+                    if offset < len(shard_texts) and shard_texts[offset] is not None:
+                        texts[page] = shard_texts[offset]
+                    pdf.pages[page] = shard_pdf.pages[offset]
+            pdf.save(output_pdf + ".tmp")
+    finally:
+        for shard_pdf in opened:
+            shard_pdf.close()
+    os.replace(output_pdf + ".tmp", output_pdf)
+    write_text(txt_path, "\f".join(texts))
+    return len(texts)
+
+def page_timings(result, pages, shard=0):
+    """
+    Per-page rows for one ocr_range result over the given zero-based pages: page (1-based), shard, ocr and
+    seconds. The run's time is split evenly over the pages it OCR'd, or over all its pages if it OCR'd none.
+    """
+    ocr_count = sum(result["ocr"])
+    share = result["seconds"] / (ocr_count or len(result["ocr"]) or 1)
+    return [
+        {"page": page + 1, "shard": shard, "ocr": ocr, "seconds": share if ocr or not ocr_count else 0.0}
+        for page, ocr in zip(pages, result["ocr"])
+    ]
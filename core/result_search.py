@@ -0,0 +1,146 @@
+# core/result_search.py
+"""Full-text search over a user's document results (summaries, answers, analyses) for /results.
+
+On Postgres, legal_document_result has a stored tsvector column generated from the question and content,
+with a GIN index; on SQLite, an FTS5 table over the same columns is kept in sync by triggers. Either way a
+row is indexed as it is inserted and a search reads only the index entries of its terms instead of scanning
+every result with LIKE. Matches come best first (ts_rank_cd / bm25) with a highlighted snippet of the
+content, RESULTS_PAGE_SIZE per page; the next page starts after the last row's (rank, id) rather than at an
+offset. Ranking still reads every match of the terms, so a term found in a large share of the results
+costs more per page than a selective one (benchmarks/bench_results_search.py).
+"""
+import os
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, text
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RESULTS_PAGE_SIZE = int(os.getenv("RESULTS_PAGE_SIZE", "50"))
+# Text search configuration of the Postgres index; queries must use the same one
+SEARCH_CONFIG = "english"
+# Snippets are marked with control characters, then escaped, then the marks turned into <mark> tags
+MARK_START, MARK_END = "\x02", "\x03"
+FILTER_COLUMNS = ("result_type", "party", "doc_id")
+
+POSTGRES_SETUP = [
+    f"""ALTER TABLE legal_document_result ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(question, '') || ' ' || content)) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_legal_document_result_search ON legal_document_result USING GIN (search_vector)",
+]
+
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS legal_document_result_fts_insert AFTER INSERT ON legal_document_result BEGIN
+        INSERT INTO legal_document_result_fts (rowid, content, question) VALUES (new.id, new.content, new.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS legal_document_result_fts_delete AFTER DELETE ON legal_document_result BEGIN
+        INSERT INTO legal_document_result_fts (legal_document_result_fts, rowid, content, question)
+        VALUES ('delete', old.id, old.content, old.question);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS legal_document_result_fts_update AFTER UPDATE OF content, question ON legal_document_result BEGIN
+        INSERT INTO legal_document_result_fts (legal_document_result_fts, rowid, content, question)
+        VALUES ('delete', old.id, old.content, old.question);
+        INSERT INTO legal_document_result_fts (rowid, content, question) VALUES (new.id, new.content, new.question);
+    END""",
+]
+
+def setup_search(connection):
+    """Creates the search index of legal_document_result (and fills it from existing rows) if missing."""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        for statement in POSTGRES_SETUP:
+            connection.execute(text(statement))
+    elif dialect == "sqlite":
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legal_document_result_fts'")).first()
+        if not exists:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE legal_document_result_fts USING fts5(content, question, "
+                "content='legal_document_result', content_rowid='id', tokenize='porter unicode61')"))
+            connection.execute(text("INSERT INTO legal_document_result_fts (legal_document_result_fts) VALUES ('rebuild')"))
+        for statement in SQLITE_TRIGGERS:
+            connection.execute(text(statement))
+    else:
+        logger.warning(f"No full-text index for results on {dialect}")
+
+def highlight(snippet):
+    """The snippet as HTML: its text escaped, the matched terms in <mark>."""
+    if not snippet:
+        return Markup("")
+    return Markup(str(escape(snippet)).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>"))
+
+def encode_search_cursor(row):
+    return f"{row['rank']!r}~{row['id']}"
+
+def decode_search_cursor(cursor):
+    """The (rank, id) a search page starts after, or None for a missing or malformed cursor."""
+    if not cursor or "~" not in cursor:
+        return None
+    rank, row_id = cursor.split("~", 1)
+    try:
+        return float(rank), int(row_id)
+    except ValueError:
+        return None
+
+def fts5_query(query):
+    """An FTS5 MATCH expression requiring every word of query, each quoted so no word is read as syntax."""
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+def _filters(filters, params, prefix=""):
+    conditions = []
+    for column in FILTER_COLUMNS:
+        if filters.get(column):
+            conditions.append(f"AND {prefix}{column} = :{column}")
+            params[column] = filters[column]
+    return " ".join(conditions)
+
+def search_results(session, user_id, query, filters=None, after=None, limit=RESULTS_PAGE_SIZE):
+    """
+    The user's results matching query, best first: dicts of id, result_type, doc_id, party, question,
+    created_at, rank and snippet (HTML). filters narrows by exact result_type, party and doc_id; after is the
+    (rank, id) of the previous page's last row.
+    """
+    params = {"user_id": user_id, "limit": limit}
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        rank = "ts_rank_cd(search_vector, query)"
+        keyset = ""
+        if after:
+            keyset = f"AND ({rank} < CAST(:after_rank AS real) OR ({rank} = CAST(:after_rank AS real) AND id < :after_id))"
+        sql = f"""
+            SELECT r.id, r.result_type, r.doc_id, r.party, r.question, r.created_at, r.rank,
+                   ts_headline('{SEARCH_CONFIG}', r.content, r.query, :headline) AS snippet
+            FROM (
+                SELECT id, result_type, doc_id, party, question, created_at, content, query, {rank} AS rank
+                FROM legal_document_result, websearch_to_tsquery('{SEARCH_CONFIG}', :query) AS query
+                WHERE user_id = :user_id AND search_vector @@ query {_filters(filters or {}, params)} {keyset}
+                ORDER BY rank DESC, id DESC
+                LIMIT :limit
+            ) r
+            ORDER BY r.rank DESC, r.id DESC"""
+        params.update(query=query, headline=f'StartSel="{MARK_START}", StopSel="{MARK_END}", MaxFragments=2, '
+                                            'MaxWords=30, MinWords=10, FragmentDelimiter=" ... "')
+    elif dialect == "sqlite":
+        match = fts5_query(query)
+        if not match:
+            return []
+        rank = "-bm25(legal_document_result_fts)"
+        keyset = ""
+        if after:
+            keyset = f"AND ({rank} < :after_rank OR ({rank} = :after_rank AND r.id < :after_id))"
+        sql = f"""
+            SELECT r.id, r.result_type, r.doc_id, r.party, r.question, r.created_at, {rank} AS rank,
+                   snippet(legal_document_result_fts, 0, :mark_start, :mark_end, ' ... ', 24) AS snippet
+            FROM legal_document_result_fts JOIN legal_document_result r ON r.id = legal_document_result_fts.rowid
+            WHERE legal_document_result_fts MATCH :match AND r.user_id = :user_id
+                  {_filters(filters or {}, params, prefix='r.')} {keyset}
+            ORDER BY rank DESC, r.id DESC
+            LIMIT :limit"""
+        params.update(match=match, mark_start=MARK_START, mark_end=MARK_END)
+    else:
+        raise NotImplementedError(f"Result search is not available on {dialect}")
+    if after:
+        params.update(after_rank=after[0], after_id=after[1])
+    rows = session.execute(text(sql).columns(created_at=DateTime), params).mappings()
+    return [dict(row, snippet=highlight(row["snippet"])) for row in rows]
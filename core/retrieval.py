@@ -0,0 +1,231 @@
+# core/retrieval.py
+"""Per-document passage retrieval for questions about legal documents.
+
+build_passage_index splits an OCR text file into passages (core/chunking.py) and writes a BM25 index
+next to it, in `<txt_path>.index/`: passage byte offsets, per-term postings in CSR layout and term IDFs
+as .npy files, plus the vocabulary and parameters as JSON. With RETRIEVAL_EMBEDDING_MODEL set (needs
+sentence-transformers) it also stores normalized passage embeddings and blends cosine similarity into
+the ranking. load_passage_index memory-maps the arrays, so answering a question reads only the postings
+of its terms and the passages it returns, not the document.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from core.chunking import iter_chunk_spans, read_span
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_VERSION = 1
+PASSAGE_SIZE = int(os.getenv("RETRIEVAL_PASSAGE_SIZE", "1200"))
+PASSAGE_OVERLAP = int(os.getenv("RETRIEVAL_PASSAGE_OVERLAP", "150"))
+EMBEDDING_MODEL = os.getenv("RETRIEVAL_EMBEDDING_MODEL", "")
+EMBEDDING_WEIGHT = float(os.getenv("RETRIEVAL_EMBEDDING_WEIGHT", "0.5"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or that the this to "
+    "was were what when where which who will with".split()
+)
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def index_dir(txt_path):
+    return txt_path + ".index"
+
+def _source_stamp(txt_path):
+    stat = os.stat(txt_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+_encoders = {}
+
+def get_embedding_encoder():
+    """Returns encode(texts) -> normalized float32 array for RETRIEVAL_EMBEDDING_MODEL, or None if unset or unavailable."""
+    if not EMBEDDING_MODEL:
+        return None
+    if EMBEDDING_MODEL not in _encoders:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logger.warning("sentence-transformers not installed; passage retrieval uses BM25 only")
+            _encoders[EMBEDDING_MODEL] = None
+        else:
+            model = SentenceTransformer(EMBEDDING_MODEL)
+            _encoders[EMBEDDING_MODEL] = lambda texts: np.asarray(
+                model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+    return _encoders[EMBEDDING_MODEL]
+
+def build_passage_index(txt_path, encoder=None, embedding_model=None, batch_size=64):
+    """
+    Writes the passage index for txt_path and returns its directory. encoder defaults to the configured
+    embedding encoder; pass one explicitly (with a name in embedding_model) to embed with another model.
+    """
+    if encoder is None:
+        encoder, embedding_model = get_embedding_encoder(), EMBEDDING_MODEL
+    stamp = _source_stamp(txt_path)
+    spans, lengths, postings = [], [], {}
+    embeddings, pending = [], []
+
+    def flush_embeddings():
+        if pending:
+            embeddings.append(encoder(pending))
+            pending.clear()
+
+    for passage, (start, end) in enumerate(iter_chunk_spans(txt_path, PASSAGE_SIZE, PASSAGE_OVERLAP)):
+        text = read_span(txt_path, start, end)
+        tokens = tokenize(text)
+        spans.append((start, end))
+        lengths.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            postings.setdefault(term, []).append((passage, count))
+        if encoder is not None:
+            pending.append(text)
+            if len(pending) >= batch_size:
+                flush_embeddings()
+    if encoder is not None:
+        flush_embeddings()
+
+    vocabulary = sorted(postings)
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[term]) for term in vocabulary])
+    passages = np.empty(offsets[-1], dtype=np.int32)
+    counts = np.empty(offsets[-1], dtype=np.float32)
+    for term_id, term in enumerate(vocabulary):
+        entries = np.asarray(postings.pop(term), dtype=np.int64).reshape(-1, 2)
+        passages[offsets[term_id]:offsets[term_id + 1]] = entries[:, 0]
+        counts[offsets[term_id]:offsets[term_id + 1]] = entries[:, 1]
+    passage_count = len(spans)
+    document_frequency = np.diff(offsets)
+    idf = np.log1p((passage_count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+    meta = {
+        "version": INDEX_VERSION, "source": stamp, "passages": passage_count,
+        "avg_length": float(np.mean(lengths)) if lengths else 0.0, "k1": BM25_K1, "b": BM25_B,
+        "embedding_model": embedding_model if embeddings else None,
+    }
+
+    final_dir = index_dir(txt_path)
+    tmp_dir = f"{final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "spans.npy"), np.asarray(spans, dtype=np.int64).reshape(-1, 2))
+    np.save(os.path.join(tmp_dir, "lengths.npy"), np.asarray(lengths, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "postings.npy"), passages)
+    np.save(os.path.join(tmp_dir, "counts.npy"), counts)
+    np.save(os.path.join(tmp_dir, "idf.npy"), idf)
+    if embeddings:
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), np.concatenate(embeddings).astype(np.float32))
+    with open(os.path.join(tmp_dir, "vocabulary.json"), "w") as f:
+        json.dump(vocabulary, f)
+    # meta.json is written last: an index directory without it is incomplete.
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError:
+        # Another process finished the same index first; keep theirs.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Indexed {passage_count} passages of {txt_path}")
+    return final_dir
+
+@dataclass
+class Passage:
+    position: int
+    score: float
+    start: int
+    end: int
+    text: str
+
+class PassageIndex:
+    def __init__(self, txt_path, directory):
+        self.txt_path = txt_path
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "vocabulary.json")) as f:
+            self.term_ids = {term: term_id for term_id, term in enumerate(json.load(f))}
+
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+        self.spans = load("spans.npy")
+        self.lengths = load("lengths.npy")
+        self.offsets = load("offsets.npy")
+        self.postings = load("postings.npy")
+        self.counts = load("counts.npy")
+        self.idf = load("idf.npy")
+        embeddings_path = os.path.join(directory, "embeddings.npy")
+        self.embeddings = load("embeddings.npy") if os.path.exists(embeddings_path) else None
+
+    def __len__(self):
+        return self.meta["passages"]
+
+    def scores(self, question, encoder=None):
+        """BM25 score of every passage for the question, blended with cosine similarity if the index has embeddings."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        k1, b, avg_length = self.meta["k1"], self.meta["b"], self.meta["avg_length"] or 1.0
+        for term in set(tokenize(question)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            lo, hi = self.offsets[term_id], self.offsets[term_id + 1]
+            passages, counts = self.postings[lo:hi], self.counts[lo:hi]
+            norm = k1 * (1 - b + b * self.lengths[passages] / avg_length)
+            scores[passages] += self.idf[term_id] * counts * (k1 + 1) / (counts + norm)
+        if self.embeddings is not None:
+            if encoder is None and self.meta.get("embedding_model") == EMBEDDING_MODEL:
+                encoder = get_embedding_encoder()
+            if encoder is not None:
+                top = scores.max() if len(scores) else 0.0
+                lexical = scores / top if top > 0 else scores
+                semantic = self.embeddings @ encoder([question])[0]
+                scores = (1 - EMBEDDING_WEIGHT) * lexical + EMBEDDING_WEIGHT * semantic
+        return scores
+
+    def search(self, question, k=5, encoder=None):
+        """The k best passages for the question, best first. With no matching terms the first passages are returned."""
+        if not len(self):
+            return []
+        scores = self.scores(question, encoder)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [Passage(int(i), float(scores[i]), int(self.spans[i][0]), int(self.spans[i][1]),
+                        read_span(self.txt_path, int(self.spans[i][0]), int(self.spans[i][1])))
+                for i in best]
+
+# Recently used indexes per process; each holds its vocabulary in memory and its arrays memory-mapped.
+MAX_LOADED_INDEXES = 32
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+def load_passage_index(txt_path, build=True):
+    """Returns the memory-mapped index for txt_path, building it first if it is missing or older than the text."""
+    directory = index_dir(txt_path)
+    meta_path = os.path.join(directory, "meta.json")
+    stamp = _source_stamp(txt_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        current = meta.get("version") == INDEX_VERSION and meta.get("source") == stamp
+    except (OSError, ValueError):
+        current = False
+    if not current:
+        if not build:
+            return None
+        build_passage_index(txt_path)
+    key = (directory, os.stat(meta_path).st_mtime_ns)
+    with _loaded_lock:
+        index = _loaded.get(directory)
+        if index is None or index[0] != key:
+            index = _loaded[directory] = (key, PassageIndex(txt_path, directory))
+        _loaded.move_to_end(directory)
+        while len(_loaded) > MAX_LOADED_INDEXES:
+            _loaded.popitem(last=False)
+    return index[1]
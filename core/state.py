@@ -8,4 +8,6 @@ class EmailState:
     history: List[Dict[str, Any]] = field(default_factory=list)
     metadata: Dict[str, Any] = field(default_factory=dict)
     current_email: Dict[str, Any] = field(default_factory=dict)
+    user_name: str = ""
+    recipient_name: str = ""
 
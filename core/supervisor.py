@@ -1,106 +1,126 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from core.state import EmailState
 from agents import filtering_agent, summarization_agent, response_agent, human_review_agent
 from langgraph.graph import START, END, StateGraph
 from core.database import get_tenant_by_email, get_property_by_id, create_maintenance_ticket_db
+from utils.logger import get_logger
+from utils.metrics import record_latency
+
+logger = get_logger(__name__)
 
 """Originally, each node function was written to expect two parameters—an email and a state.
-However, the LangGraph framework is designed to pass only one argument (the state) to each node."""
+However, the LangGraph framework is designed to pass only one argument (the state) to each node,
+so per-email inputs (signature and recipient names) travel on EmailState rather than in closures.
+That lets the graph be compiled once and reused for every email."""
 
-# Bringing all the states together with a supervisor helps to manage the flow of the email processing.
-def supervisor_langgraph(email: dict, state: EmailState,user_name : str,recipient_name:str) -> EmailState:
-    """
-    Processes an individual email using a LangGraph workflow.
-    Each step (filtering, summarization, response generation) is a node.
-    Conditional edges are used to exit early for spam or to continue processing.
-    """
-    
-    state.current_email = email
-    
-    def filtering_node(state: EmailState) -> EmailState:
-        current_email = state.current_email
-        print('filtering node started for email id : %s' % current_email.get("id", "unknown"))
-        classification = filtering_agent.filter_email(current_email)
-        current_email["classification"] = classification
-        state.metadata[current_email.get("id", "unknown")] = classification
-        return state
-
-    
-    def summarization_node(state: EmailState) -> EmailState:
-        email = state.current_email
-        summary = summarization_agent.summarize_email(email)
-        email["summary"] = summary
-        return state
-    
-    def response_node(state: EmailState) -> EmailState:
-        email = state.current_email
-        response = response_agent.generate_response(email, email.get("summary", ""),recipient_name,user_name) # The response agent uses the summary to generate a response.
-        # If the classification indicates review or the response is uncertain, let a human intervene
-        if email.get("classification") == "needs_review" or "?" in response:
-            response = human_review_agent.review_email(email, response)
-        email["response"] = response
-        state.history.append({
-            "email_id": email.get("id", "unkonwn"),
-            "response": response
-        })
-        return state
-    
-    graph_builder = StateGraph(EmailState)     # now building tther graph from all the states 
-
-    
-    # addimng the nodes in the graph 
+def filtering_node(state: EmailState) -> EmailState:
+    current_email = state.current_email
+    print('filtering node started for email id : %s' % current_email.get("id", "unknown"))
+    classification = filtering_agent.filter_email(current_email)
+    current_email["classification"] = classification
+    state.metadata[current_email.get("id", "unknown")] = classification
+    return state
+
+def summarization_node(state: EmailState) -> EmailState:
+    email = state.current_email
+    summary = summarization_agent.summarize_email(email)
+    email["summary"] = summary
+    return state
+
+def response_node(state: EmailState) -> EmailState:
+    email = state.current_email
+    response = response_agent.generate_response(email, email.get("summary", ""), state.recipient_name, state.user_name) # The response agent uses the summary to generate a response.
+    # If the classification indicates review or the response is uncertain, let a human intervene
+    if email.get("classification") == "needs_review" or "?" in response:
+        response = human_review_agent.review_email(email, response)
+    email["response"] = response
+    state.history.append({
+        "email_id": email.get("id", "unkonwn"),
+        "response": response
+    })
+    return state
+
+# building conditional wortking with filtering now that it is not spam if spam then dustbin is the way
+def post_filtering(state: EmailState):
+    email = state.current_email
+    if email.get("classification") == "spam":
+        return END
+    else:
+        return "summarization"
+
+def build_email_graph() -> StateGraph:
+    """Builds (but does not compile) the filtering -> summarization -> response graph."""
+    graph_builder = StateGraph(EmailState)     # now building tther graph from all the states
+
+    # addimng the nodes in the graph
     graph_builder.add_node("filtering", filtering_node)
     graph_builder.add_node("summarization", summarization_node)
     graph_builder.add_node("response", response_node)
-    
-    
-    
-    
-    
-    
-    # building conditional wortking with filtering now that it is not spam if spam then dustbin is the way 
-    def post_filtering(state_update: EmailState):
-        email = state.current_email
-        if email.get("classification") == "spam":
-            return END
-        else:
-            return "summarization"
-    
+
     graph_builder.add_conditional_edges("filtering", post_filtering, {"summarization": "summarization", END: END})
-    
+
     # This creates a direct edge (connection) from the "summarization" node to the "response" node.
     # if reaches summary node then must move to response node
     graph_builder.add_edge("summarization", "response")
-    
+
     graph_builder.add_edge("response", END) # if respone comes then end to all please
-    
+
     # Set the entry point to the filtering node.
     graph_builder.set_entry_point("filtering")
-    
-    # Compile the graph.
-    graph = graph_builder.compile()
-    
-    # Invoke the graph with the current state.
-    final_state = graph.invoke(state)
-    return final_state
+    return graph_builder
 
-def supervisor_pm_workflow(email: dict, state: EmailState) -> EmailState:
+@lru_cache(maxsize=1)
+def get_email_graph():
+    """Returns the compiled graph, compiling it on first use only."""
+    return build_email_graph().compile()
+
+# Bringing all the states together with a supervisor helps to manage the flow of the email processing.
+def supervisor_langgraph(email: dict, state: EmailState, user_name: str, recipient_name: str) -> EmailState:
     """
-    Property management workflow: identify tenant/property, categorize, create actions, generate response.
+    Processes an individual email using a LangGraph workflow.
+    Each step (filtering, summarization, response generation) is a node.
+    Conditional edges are used to exit early for spam or to continue processing.
     """
     state.current_email = email
+    state.user_name = user_name
+    state.recipient_name = recipient_name
+
+    # Invoke the shared compiled graph with the current state.
+    final_state = get_email_graph().invoke(state)
+    return final_state
+
+@contextmanager
+def timed_step(email: dict, step: str):
+    """Records how long a PM workflow step took in email["step_timings"] (seconds) and as pm_<step> latency."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        email.setdefault("step_timings", {})[step] = round(seconds, 4)
+        record_latency(f"pm_{step}", seconds)
+
+def lookup_tenant_and_property(email: dict):
+    """Returns (tenant_info, property_info) for the email's sender; either may be None."""
     sender_email = email.get("from")
     tenant_info = get_tenant_by_email(sender_email) if sender_email else None
     property_info = None
     if tenant_info and tenant_info.get("property_id"):
         property_info = get_property_by_id(tenant_info["property_id"])
+    return tenant_info, property_info
 
-    # 1. Categorize and extract info
-    classification_and_extraction = filtering_agent.filter_and_categorize_email(email, tenant_info, property_info)
+def take_pm_actions(state: EmailState, classification_and_extraction: dict, tenant_info, property_info) -> list:
+    """Records the classification on the current email and creates any follow-up actions (e.g. tickets)."""
     state.current_email["classification_details"] = classification_and_extraction
+    state.current_email["classified_at"] = time.time()
     category = classification_and_extraction.get("category", "general_inquiry")
     state.current_email["category"] = category
 
-    # 2. Create actions based on category
     actions_taken = []
     if category == "maintenance_request" and tenant_info:
         issue_summary = classification_and_extraction.get("extracted_issue_summary", "Maintenance issue reported.")
@@ -111,7 +131,8 @@ def supervisor_pm_workflow(email: dict, state: EmailState) -> EmailState:
                 tenant_id=tenant_info["id"],
                 property_id=property_id_for_ticket,
                 issue=issue_summary,
-                priority=urgency
+                priority=urgency,
+                email_id=state.current_email.get("id")
             )
             actions_taken.append({"type": "maintenance_ticket_created", "ticket_id": ticket_id, "issue": issue_summary})
             state.current_email["classification_details"]["maintenance_ticket_id"] = ticket_id
@@ -122,21 +143,130 @@ def supervisor_pm_workflow(email: dict, state: EmailState) -> EmailState:
     elif category == "lockout_emergency":
         actions_taken.append({"type": "lockout_emergency_reported", "tenant_id": tenant_info.get("id") if tenant_info else None, "property_address": property_info.get("address") if property_info else None})
     state.current_email["actions_taken"] = actions_taken
+    return actions_taken
 
-    # 3. Generate response
-    generated_response = response_agent.generate_property_management_response(
-        category=category,
+def generate_pm_response(state: EmailState, tenant_info, property_info) -> str:
+    email = state.current_email
+    return response_agent.generate_property_management_response(
+        category=email["category"],
         email_data=email,
-        analysis_results=state.current_email["classification_details"],
+        analysis_results=email["classification_details"],
         tenant_details=tenant_info,
         property_details=property_info
     )
-    state.current_email["response"] = generated_response
 
+def record_pm_response(state: EmailState, generated_response: str) -> EmailState:
+    email = state.current_email
+    email["response"] = generated_response
     state.history.append({
         "email_id": email.get("id"),
-        "category": category,
-        "actions": actions_taken,
+        "category": email["category"],
+        "actions": email["actions_taken"],
         "response_generated": generated_response[:100] + "..."
     })
     return state
+
+def supervisor_pm_workflow(email: dict, state: EmailState) -> EmailState:
+    """
+    Property management workflow: identify tenant/property, categorize, create actions, generate response.
+    How long each step took is left in email["step_timings"].
+    """
+    state.current_email = email
+    with timed_step(email, "tenant_lookup"):
+        tenant_info, property_info = lookup_tenant_and_property(email)
+
+    # 1. Categorize and extract info
+    with timed_step(email, "classification"):
+        classification_and_extraction = filtering_agent.filter_and_categorize_email(email, tenant_info, property_info)
+
+    # 2. Create actions based on category
+    with timed_step(email, "ticket_insert"):
+        take_pm_actions(state, classification_and_extraction, tenant_info, property_info)
+
+    # 3. Generate response
+    with timed_step(email, "response_generation"):
+        generated_response = generate_pm_response(state, tenant_info, property_info)
+    return record_pm_response(state, generated_response)
+
+def stream_pm_workflow(email: dict, state: EmailState):
+    """
+    supervisor_pm_workflow for a page that shows the response as it is written. Yields (event, data):
+    ("status", {"step": "classifying"}) at once, ("status", {"step": "responding", "category"}) once the
+    email is categorized and its actions taken, ("text", {"text"}) for each piece of the response body as
+    the model streams it, and finally ("done", {"response"}) with the formatted response, which is also
+    recorded on state like supervisor_pm_workflow's. Step timings are kept the same way too.
+    """
+    state.current_email = email
+    yield "status", {"step": "classifying"}
+    with timed_step(email, "tenant_lookup"):
+        tenant_info, property_info = lookup_tenant_and_property(email)
+    with timed_step(email, "classification"):
+        classification_and_extraction = filtering_agent.filter_and_categorize_email(email, tenant_info, property_info)
+    with timed_step(email, "ticket_insert"):
+        take_pm_actions(state, classification_and_extraction, tenant_info, property_info)
+    yield "status", {"step": "responding", "category": email["category"]}
+
+    pieces = []
+    with timed_step(email, "response_generation"):
+        for text in response_agent.stream_property_management_response(
+                category=email["category"],
+                email_data=email,
+                analysis_results=email["classification_details"],
+                tenant_details=tenant_info,
+                property_details=property_info):
+            pieces.append(text)
+            yield "text", {"text": text}
+    generated_response = response_agent.format_property_management_response(email, "".join(pieces), tenant_info)
+    record_pm_response(state, generated_response)
+    yield "done", {"response": generated_response}
+
+# --- Concurrent processing of a whole inbox ---
+
+async def supervisor_pm_workflow_async(email: dict, state: EmailState, executor=None) -> EmailState:
+    """
+    Same steps as supervisor_pm_workflow, with each blocking step (DB lookups, the classification
+    and response LLM calls, ticket creation) run on `executor` so other emails progress meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    state.current_email = email
+    tenant_info, property_info = await loop.run_in_executor(executor, lookup_tenant_and_property, email)
+    classification_and_extraction = await loop.run_in_executor(
+        executor, filtering_agent.filter_and_categorize_email, email, tenant_info, property_info)
+    await loop.run_in_executor(executor, take_pm_actions, state, classification_and_extraction, tenant_info, property_info)
+    generated_response = await loop.run_in_executor(executor, generate_pm_response, state, tenant_info, property_info)
+    return record_pm_response(state, generated_response)
+
+async def run_pm_workflow_batch(state: EmailState, max_concurrency: int = None) -> list:
+    """
+    Runs the property management workflow over every email in state.emails, at most `max_concurrency`
+    (default PM_WORKFLOW_MAX_CONCURRENCY=8) at a time.
+
+    Each email gets its own EmailState so concurrent runs never share current_email. A failing email
+    gets an "error" key and does not affect the others. Returns the per-email states in input order;
+    their history entries are appended to `state.history` in that order too.
+    """
+    max_concurrency = max_concurrency or int(os.getenv("PM_WORKFLOW_MAX_CONCURRENCY", "8"))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(email):
+        email_state = EmailState(emails=[email], user_name=state.user_name, recipient_name=state.recipient_name)
+        async with semaphore:
+            try:
+                return await supervisor_pm_workflow_async(email, email_state, executor)
+            except Exception as e:
+                logger.error(f"PM workflow failed for email {email.get('id', 'unknown')}: {e}")
+                email["error"] = str(e)
+                email_state.history.append({"email_id": email.get("id"), "error": str(e)})
+                return email_state
+
+    # A dedicated pool, so the concurrency limit is not capped by the default executor's size.
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = await asyncio.gather(*(run_one(email) for email in state.emails))
+
+    for email_state in results:
+        state.history.extend(email_state.history)
+    return results
+
+def process_pm_emails(state: EmailState, max_concurrency: int = None) -> list:
+    """Synchronous entry point for run_pm_workflow_batch (for scripts and request handlers)."""
+    return asyncio.run(run_pm_workflow_batch(state, max_concurrency))
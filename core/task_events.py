@@ -0,0 +1,221 @@
+# core/task_events.py
+"""Completion events for the document tasks a user starts from the dashboard (summaries, answers, analyses).
+
+When such a task has saved its LegalDocumentResult (tagged with the Celery task id), the worker publishes
+{"task_id", "status"} on the user's Redis pub/sub channel. /task_events streams those events to the browser
+as server-sent events for the task ids it is asked about, and ends once all of them have finished, so the
+dashboard neither polls nor keeps a connection open while nothing is running.
+
+Pub/sub delivers only to subscribers that are connected, so the stream subscribes first and then looks up
+the tasks, which catches a task that finished before the browser connected. It looks them up again every
+TASK_EVENTS_KEEPALIVE seconds (when it also sends a comment to keep proxies from closing the connection),
+which also covers a lost message or Redis being down. A stream lasts at most TASK_EVENTS_TIMEOUT seconds;
+the browser's EventSource then reconnects. Streams are meant for the gevent web workers (gunicorn.conf.py):
+a sync worker is held for the whole stream and killed past WEB_TIMEOUT, so on one they last at most
+TASK_EVENTS_SYNC_TIMEOUT seconds, and the browser's reconnects turn them into long polling.
+
+An email response task (celery_worker.generate_email_response) reports more than its completion: its
+status, the response text as the model writes it, then "done" or "error". Those events go to a Redis
+stream per task, kept RESPONSE_EVENTS_TTL seconds, which stream_response_events relays from the start,
+so a page that connects after the task started still gets every piece of the response. The web process
+records which user started the task (set_response_owner) for the same time, and only shows that user the
+task's events and result.
+"""
+import json
+import os
+import time
+from core.gevent_io import gevent_active
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TASK_EVENTS_REDIS_URL = os.getenv("TASK_EVENTS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"))
+TASK_EVENTS_TIMEOUT = float(os.getenv("TASK_EVENTS_TIMEOUT", "300"))
+TASK_EVENTS_KEEPALIVE = float(os.getenv("TASK_EVENTS_KEEPALIVE", "15"))
+# Keep below WEB_TIMEOUT (gunicorn.conf.py)
+TASK_EVENTS_SYNC_TIMEOUT = float(os.getenv("TASK_EVENTS_SYNC_TIMEOUT", "25"))
+RESPONSE_EVENTS_TTL = int(os.getenv("RESPONSE_EVENTS_TTL", "3600"))
+# Events that end an email response task's stream
+FINAL_RESPONSE_EVENTS = ("done", "error")
+
+_redis = None
+
+def _client():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(TASK_EVENTS_REDIS_URL, socket_timeout=TASK_EVENTS_KEEPALIVE + 5,
+                                      socket_connect_timeout=1)
+    return _redis
+
+def stream_timeout():
+    """Seconds a stream may stay open in this process: TASK_EVENTS_TIMEOUT, capped when not on gevent."""
+    if gevent_active():
+        return TASK_EVENTS_TIMEOUT
+    return min(TASK_EVENTS_TIMEOUT, TASK_EVENTS_SYNC_TIMEOUT)
+
+def channel(user_id):
+    return f"task_events:{user_id}"
+
+def publish_task_event(user_id, task_id, status):
+    """Tells the user's open streams that task_id finished with status (a Celery state)."""
+    if user_id is None or not task_id:
+        return
+    try:
+        _client().publish(channel(user_id), json.dumps({"task_id": task_id, "status": status}))
+    except Exception as e:
+        # The result is saved either way; streams find it on their next lookup
+        logger.warning(f"Publishing the completion of task {task_id} failed: {e}")
+
+def subscribe(user_id):
+    """A pub/sub subscription to the user's channel, or None if Redis cannot be reached."""
+    try:
+        pubsub = _client().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel(user_id))
+        return pubsub
+    except Exception as e:
+        logger.warning(f"Subscribing to task events failed, checking tasks every {TASK_EVENTS_KEEPALIVE}s: {e}")
+        return None
+
+def _close(pubsub):
+    if pubsub is not None:
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+def format_event(event, name=None):
+    """One server-sent event carrying event as JSON, with an event name if given."""
+    prefix = f"event: {name}\n" if name else ""
+    return f"{prefix}data: {json.dumps(event)}\n\n"
+
+def _next_message(pubsub, seconds):
+    """The next published {"task_id", "status"} within seconds, or None."""
+    until = time.monotonic() + seconds
+    while (remaining := until - time.monotonic()) > 0:
+        if pubsub is None:
+            time.sleep(remaining)
+            return None
+        message = pubsub.get_message(timeout=remaining)
+        if message and message.get("type") == "message":
+            try:
+                return json.loads(message["data"])
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring malformed task event {message['data']!r}")
+    return None
+
+def stream_task_events(user_id, task_ids, lookup, timeout=None, keepalive=None):
+    """
+    Server-sent events for the user's tasks task_ids: one per task once lookup(task_id, status) returns
+    its event (it returns None while the task is running; status is the published state, or None when the
+    stream checks on its own). Ends when every task has had its event, or after timeout seconds.
+    """
+    timeout = stream_timeout() if timeout is None else timeout
+    keepalive = keepalive or TASK_EVENTS_KEEPALIVE
+    pending = list(dict.fromkeys(task_ids))
+    deadline = time.monotonic() + timeout
+    pubsub = subscribe(user_id) if pending else None
+    try:
+        published = {}
+        check_all = True
+        while pending:
+            for task_id in [t for t in pending if check_all or t in published]:
+                event = lookup(task_id, published.pop(task_id, None))
+                if event is not None:
+                    pending.remove(task_id)
+                    yield format_event(event)
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            try:
+                message = _next_message(pubsub, min(keepalive, remaining))
+            except Exception as e:
+                logger.warning(f"Task event subscription failed, checking tasks every {keepalive}s: {e}")
+                _close(pubsub)
+                pubsub, message = None, None
+            if message is None:
+                check_all = True
+                yield ": keepalive\n\n"
+            else:
+                check_all = False
+                if message.get("task_id") in pending:
+                    published[message["task_id"]] = message.get("status")
+    finally:
+        _close(pubsub)
+
+def response_events_key(task_id):
+    return f"response_events:{task_id}"
+
+def response_owner_key(task_id):
+    return f"response_owner:{task_id}"
+
+def set_response_owner(task_id, user_id):
+    """Records that user_id started the email response task task_id."""
+    try:
+        _client().set(response_owner_key(task_id), user_id, ex=RESPONSE_EVENTS_TTL)
+    except Exception as e:
+        # The owner is read from the task's result once it has finished
+        logger.warning(f"Recording the owner of task {task_id} failed: {e}")
+
+def get_response_owner(task_id):
+    """The id of the user who started the email response task task_id, or None if unknown."""
+    try:
+        owner = _client().get(response_owner_key(task_id))
+    except Exception as e:
+        logger.warning(f"Looking up the owner of task {task_id} failed: {e}")
+        return None
+    return int(owner) if owner is not None else None
+
+def append_response_event(task_id, name, data):
+    """Adds an event of an email response task to the task's Redis stream."""
+    try:
+        client = _client()
+        key = response_events_key(task_id)
+        client.xadd(key, {"event": name, "data": json.dumps(data)})
+        client.expire(key, RESPONSE_EVENTS_TTL)
+    except Exception as e:
+        # The page falls back to the task's result once it has finished
+        logger.warning(f"Adding a {name} event of task {task_id} failed: {e}")
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+def stream_response_events(task_id, lookup, timeout=None, keepalive=None):
+    """
+    Server-sent events of an email response task, from its first event, ending after "done" or "error"
+    or after timeout seconds. Whenever no event arrives for keepalive seconds (and straight away, for a
+    task whose events have expired), lookup(task_id) is asked for the finished task's (name, data) event;
+    it returns None while the task has not finished. Without Redis only that final event is sent.
+    """
+    timeout = stream_timeout() if timeout is None else timeout
+    keepalive = keepalive or TASK_EVENTS_KEEPALIVE
+    deadline = time.monotonic() + timeout
+    key = response_events_key(task_id)
+    last_id, use_redis, check = "0", True, False
+    while (remaining := deadline - time.monotonic()) > 0:
+        entries = []
+        if use_redis:
+            try:
+                # Block for the first read only briefly, so an expired stream soon falls back to lookup
+                wait = min(keepalive if check else 1.0, remaining)
+                entries = _client().xread({key: last_id}, count=100, block=max(1, int(wait * 1000))) or []
+            except Exception as e:
+                logger.warning(f"Reading the events of task {task_id} failed, checking it every {keepalive}s: {e}")
+                use_redis = False
+        for _, messages in entries:
+            for message_id, fields in messages:
+                last_id = message_id
+                fields = {_decode(name): _decode(value) for name, value in fields.items()}
+                yield format_event(json.loads(fields["data"]), fields["event"])
+                if fields["event"] in FINAL_RESPONSE_EVENTS:
+                    return
+        if entries:
+            continue
+        check = True
+        event = lookup(task_id)
+        if event is not None:
+            yield format_event(event[1], event[0])
+            return
+        if not use_redis:
+            time.sleep(max(0.0, min(keepalive, deadline - time.monotonic())))
+        yield ": keepalive\n\n"
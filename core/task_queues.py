@@ -0,0 +1,88 @@
+# core/task_queues.py
+"""Celery queues and their depth and wait metrics.
+
+OCR, LLM work a user is waiting on (questions, summaries, party analysis from the web app) and background
+LLM work (analysis after OCR, incoming email) go to separate queues, so an OCR backlog never holds up a
+question. docker-compose.yml runs a worker per queue, each with its own concurrency and prefetch. With
+the Redis broker a worker takes its queues in the order given to -Q, so one consuming
+"llm-interactive,llm-batch" serves every waiting question before batch work.
+
+QueueMonitor reports how many messages wait in each queue and how long started tasks waited: workers push
+each task's wait to a short Redis list per queue, so the web process sees the waits of all workers.
+"""
+import os
+from utils.logger import get_logger
+from utils.metrics import record_latency, summarize
+
+logger = get_logger(__name__)
+
+OCR_QUEUE = "ocr"
+INTERACTIVE_QUEUE = "llm-interactive"
+BATCH_QUEUE = "llm-batch"
+QUEUES = (OCR_QUEUE, INTERACTIVE_QUEUE, BATCH_QUEUE)
+
+QUEUE_WAIT_SAMPLES = int(os.getenv("QUEUE_WAIT_SAMPLES", "500"))
+WAIT_KEY_PREFIX = "queue_wait:"
+
+def current_queue(task):
+    """The queue the running task was delivered from, or None when it was called directly."""
+    return (getattr(task.request, "delivery_info", None) or {}).get("routing_key")
+
+class QueueMonitor:
+    def __init__(self, app, queues=QUEUES, redis_url=None):
+        self.app = app
+        self.queues = queues
+        self.redis_url = redis_url if redis_url is not None else str(app.conf.broker_url or "")
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None and self.redis_url.startswith(("redis://", "rediss://")):
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def depths(self):
+        """Messages waiting per queue; None for every queue if the broker cannot be reached."""
+        try:
+            with self.app.connection_for_read() as connection:
+                connection.ensure_connection(max_retries=1, interval_start=0, timeout=2)
+                channel = connection.default_channel
+                depths = {}
+                for queue in self.queues:
+                    try:
+                        depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+                    except Exception:
+                        depths[queue] = 0  # Never declared: nothing was sent to it yet
+                return depths
+        except Exception as e:
+            logger.warning(f"Reading queue depths failed: {e}")
+            return {queue: None for queue in self.queues}
+
+    def record_wait(self, queue, seconds):
+        record_latency(f"queue_wait_{queue}", seconds)
+        try:
+            client = self._client()
+            if client is not None:
+                key = WAIT_KEY_PREFIX + queue
+                client.pipeline().lpush(key, f"{seconds:.3f}").ltrim(key, 0, QUEUE_WAIT_SAMPLES - 1).execute()
+        except Exception as e:
+            logger.debug(f"Storing the wait of a {queue} task failed: {e}")
+
+    def waits(self):
+        """Per queue: count and p50/p95/max wait of the most recently started tasks, None without samples."""
+        waits = {queue: None for queue in self.queues}
+        try:
+            client = self._client()
+            if client is None:
+                return waits
+            for queue in self.queues:
+                samples = sorted(float(sample) for sample in client.lrange(WAIT_KEY_PREFIX + queue, 0, -1))
+                if samples:
+                    waits[queue] = summarize(samples)
+        except Exception as e:
+            logger.warning(f"Reading queue waits failed: {e}")
+        return waits
+
+    def stats(self):
+        depths, waits = self.depths(), self.waits()
+        return {queue: {"depth": depths[queue], "wait": waits[queue]} for queue in self.queues}
@@ -42,8 +42,8 @@ resource "aws_ecs_task_definition" "app" {
   family                   = "${var.app_name}-task"
   network_mode             = "awsvpc"
   requires_compatibilities = ["FARGATE"]
-  cpu                      = "512"
-  memory                   = "1024"
+  cpu                      = "1024"
+  memory                   = "2048"
   execution_role_arn       = aws_iam_role.ecs_task_execution_role.arn
   task_role_arn            = aws_iam_role.ecs_task_execution_role.arn
 
@@ -57,16 +57,33 @@ resource "aws_ecs_task_definition" "app" {
       portMappings = [{ containerPort = 5000, hostPort = 5000 }]
       environment = [
         { name = "DATABASE_URL", value = "postgresql://${var.db_username}:${var.db_password}@${aws_db_instance.paralegal.address}:5432/${var.db_name}" },
-        { name = "REDIS_URL", value = "redis://${aws_elasticache_cluster.redis.cache_nodes[0].address}:6379" }
+        { name = "REDIS_URL", value = "redis://${aws_elasticache_cluster.redis.cache_nodes[0].address}:6379" },
+        # A quarter vCPU: one gevent worker (gunicorn.conf.py)
+        { name = "WEB_WORKERS", value = "1" }
       ]
     },
     {
-      name      = "worker"
+      name      = "worker-llm"
       image     = var.docker_image
       cpu       = 256
       memory    = 512
       essential = false
-      command   = ["celery", "-A", "celery_worker.celery", "worker", "--loglevel=info"]
+      # LLM tasks on gevent: each task in flight is a greenlet waiting on HTTP, so hundreds fit in 512MB.
+      # Questions are taken before batch LLM work.
+      command   = ["celery", "-A", "celery_worker.celery_app", "worker", "--loglevel=info", "-Q", "llm-interactive,llm-batch", "-P", "gevent", "--concurrency", "200", "--prefetch-multiplier", "1"]
+      environment = [
+        { name = "DATABASE_URL", value = "postgresql://${var.db_username}:${var.db_password}@${aws_db_instance.paralegal.address}:5432/${var.db_name}" },
+        { name = "REDIS_URL", value = "redis://${aws_elasticache_cluster.redis.cache_nodes[0].address}:6379" }
+      ]
+    },
+    {
+      name      = "worker-ocr"
+      image     = var.docker_image
+      cpu       = 512
+      memory    = 1024
+      essential = false
+      # OCR is CPU-bound and stays on prefork
+      command   = ["celery", "-A", "celery_worker.celery_app", "worker", "--loglevel=info", "-Q", "ocr", "-P", "prefork", "--concurrency", "1", "--prefetch-multiplier", "1"]
       environment = [
         { name = "DATABASE_URL", value = "postgresql://${var.db_username}:${var.db_password}@${aws_db_instance.paralegal.address}:5432/${var.db_name}" },
         { name = "REDIS_URL", value = "redis://${aws_elasticache_cluster.redis.cache_nodes[0].address}:6379" }
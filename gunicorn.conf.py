@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+"""
+Web tier settings, read by `gunicorn app:app` from the working directory.
+
+By default each worker is a gevent worker: requests run on greenlets, so a worker serves up to
+WEB_WORKER_CONNECTIONS requests at once while they wait on Postgres, SQLite, Redis or the task event
+streams, instead of one. Postgres queries still go through the worker's connection pool
+(POSTGRES_POOL_MAX), which bounds the load on the database: requests past it wait up to
+POSTGRES_POOL_TIMEOUT for a connection, so far fewer than WEB_WORKER_CONNECTIONS can query at once. Size
+POSTGRES_POOL_MAX to the database requests a worker should run side by side (at least
+DASHBOARD_QUERY_CONCURRENCY, which one dashboard holds), keeping WEB_WORKERS * POSTGRES_POOL_MAX under
+Postgres' max_connections. WEB_WORKER_CLASS=sync brings back one request per worker
+(benchmarks/bench_web_workers.py compares the two).
+
+The server-sent event streams (/task_events, /email/task/<id>/events) need the gevent worker class. A sync
+worker spends the whole stream on it and is killed once a request outlasts `timeout`, so there streams end
+after TASK_EVENTS_SYNC_TIMEOUT (core/task_events.py) and the browser reconnects, each open page still
+taking a worker while it waits.
+"""
+import os
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+worker_class = os.getenv("WEB_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+
+def post_worker_init(worker):
+    # gevent has patched the standard library by now; psycopg2 and gRPC need their own hooks
+    from core.gevent_io import enable_gevent_io
+    if enable_gevent_io():
+        worker.log.info("gevent I/O hooks installed for psycopg2 and gRPC")
@@ -94,16 +94,20 @@ if __name__ == "__main__":
 
 from agents import filtering_agent, summarization_agent, response_agent, human_review_agent
 from langgraph.graph import START, END, StateGraph
-from core.email_imap import fetch_imap_emails
+from core.email_imap import iter_new_imap_emails
 from core.email_sender import send_email, send_draft_to_gmail
 from utils.logger import get_logger
 from config import IMAP_USERNAME, IMAP_PASSWORD, IMAP_SERVER
 from core.supervisor import supervisor_pm_workflow
 from core.state import EmailState
+from core.database import setup_database
 
 
 logger = get_logger(__name__)
 
+# New messages offered per run; the rest are offered on the next runs
+CLI_EMAILS_PER_RUN = 5
+
 def process_email_action(email, your_name):
     action = input("Do you want to (s)end the email or (d)raft it to Gmail? (s/d): ").strip().lower()
     if action == "s":
@@ -128,34 +132,33 @@ def main():
     your_name = input("Please enter your name (for signature): ")
     recipient_name = input("Please enter the recipient's name: ")
     
-    # Use IMAP to fetch live emails
-    emails = fetch_imap_emails(IMAP_USERNAME, IMAP_PASSWORD, IMAP_SERVER)
-    logger.debug(f"Fetched {len(emails)} emails from IMAP.")
-    
-    if not emails:
-        logger.info("No emails found.")
+    # Incrementally sync new mail over IMAP, five messages at a time (oldest first); the CLI keeps its own
+    # sync state, so it does not skip mail the web app's ingestion has not stored yet, or the reverse
+    new_emails = list(iter_new_imap_emails(IMAP_USERNAME, IMAP_PASSWORD, IMAP_SERVER,
+                                           account=f"cli:{IMAP_USERNAME}@{IMAP_SERVER}", limit=CLI_EMAILS_PER_RUN))
+    logger.debug(f"Fetched {len(new_emails)} new emails from IMAP.")
+
+    if not new_emails:
+        logger.info("No new emails since the last sync.")
         return
-    
-    latest_emails = emails[-5:]
-    
+
     print("\nSelect an email to process:")
-    for idx, email in enumerate(latest_emails):
+    for idx, email in enumerate(new_emails):
         print(f"{idx + 1}. {email['subject']}")
-    
+
     choice = int(input("Enter the number of the email you want to choose: ")) - 1
-    if choice < 0 or choice >= len(latest_emails):
+    if choice < 0 or choice >= len(new_emails):
         print("Invalid choice. Exiting.")
         return
-    
-    selected_email = latest_emails[choice]
-    
-    # Create state and process the email through the workflow
-    state = EmailState()
-    state.emails = [selected_email]
-    state.current_email = selected_email
-    # Pass your signature (your_name) to the supervisor pipeline
-    state = supervisor_pm_workflow(selected_email, state, your_name,recipient_name)
-    
+
+    # Only the chosen email is classified and answered (and gets a maintenance ticket if it needs one)
+    selected_email = new_emails[choice]
+    state = EmailState(emails=[selected_email], user_name=your_name, recipient_name=recipient_name)
+    try:
+        supervisor_pm_workflow(selected_email, state)
+    except Exception as e:
+        logger.warning(f"Processing failed for the selected email: {e}")
+
     print("\nGenerated Response:\n")
     print(selected_email.get("response", "No response generated."))
     
@@ -0,0 +1,164 @@
+"""A minimal in-process IMAP server for tests: LOGIN, SELECT/EXAMINE, UID SEARCH, UID FETCH, IDLE and LOGOUT
+over plain TCP on localhost, with single-part text messages. add_message() notifies idling clients with EXISTS."""
+import re
+import socketserver
+import threading
+import time
+
+
+def make_message(uid, sender="tenant@example.com", subject=None, body=None):
+    subject = subject or f"Issue {uid}"
+    body = body or f"Body {uid}"
+    return (f"From: {sender}\r\nSubject: {subject}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n{body}").encode()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server.stand_in
+        server._connected(self)
+        try:
+            self.send(b"* OK [CAPABILITY IMAP4rev1 IDLE] stand-in ready\r\n")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                if command == "CAPABILITY":
+                    self.send(b"* CAPABILITY IMAP4rev1 IDLE\r\n")
+                elif command in ("SELECT", "EXAMINE"):
+                    self.send(f"* {len(server.messages)} EXISTS\r\n* OK [UIDVALIDITY {server.uidvalidity}] ok\r\n".encode())
+                elif command == "UID":
+                    self._uid(server, args)
+                elif command == "IDLE":
+                    # Mail that arrives as the IDLE starts is announced in the same segment as the continuation
+                    arrived = server._arrive_with_idle()
+                    self.send(b"+ idling\r\n" + (f"* {arrived} EXISTS\r\n".encode() if arrived else b""))
+                    server._idling(self, True)
+                    done = self.rfile.readline()
+                    server._idling(self, False)
+                    if not done:
+                        return
+                elif command == "LOGOUT":
+                    self.send(b"* BYE logging out\r\n")
+                    self.send(f"{tag} OK LOGOUT completed\r\n".encode())
+                    return
+                self.send(f"{tag} OK {command} completed\r\n".encode())
+        except OSError:
+            pass
+        finally:
+            server._disconnected(self)
+
+    def _uid(self, server, args):
+        subcommand, _, args = args.partition(" ")
+        with server.lock:
+            uids = sorted(server.messages)
+        if subcommand.upper() == "SEARCH":
+            match = re.search(r"UID (\d+):\*", args)
+            if match:
+                uids = [uid for uid in uids if uid >= int(match.group(1))] or uids[-1:]
+            self.send(("* SEARCH " + " ".join(map(str, uids)) + "\r\n").encode())
+            return
+        uid_set, _, items = args.partition(" ")
+        first, _, last = uid_set.partition(":")
+        last = int(last) if last and last != "*" else (uids[-1] if last == "*" and uids else int(first))
+        for seq, uid in enumerate(uids, 1):
+            if not int(first) <= uid <= last:
+                continue
+            raw = server.messages[uid]
+            header, _, body = raw.partition(b"\r\n\r\n")
+            internaldate = time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime(server.arrivals[uid]))
+            parts = [("BODY[]", raw)] if "BODY.PEEK[]" in items else [("BODY[HEADER]", header + b"\r\n\r\n"), ("BODY[1]", body)]
+            out = f'* {seq} FETCH (UID {uid} INTERNALDATE "{internaldate}"'.encode()
+            for name, payload in parts:
+                out += f" {name} {{{len(payload)}}}\r\n".encode() + payload
+            self.send(out + b")\r\n")
+
+
+class IMAPStandIn:
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = {}
+        self.arrivals = {}
+        self.lock = threading.Lock()
+        self.handlers = set()
+        self.idlers = set()
+        self.peak_connections = 0
+        self.total_connections = 0
+        self.messages_with_next_idle = 0
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_message(self, raw=None):
+        with self.lock:
+            uid = max(self.messages, default=0) + 1
+            self.messages[uid] = raw or make_message(uid)
+            self.arrivals[uid] = time.time()
+            count = len(self.messages)
+            idlers = list(self.idlers)
+        for handler in idlers:
+            try:
+                handler.send(f"* {count} EXISTS\r\n".encode())
+            except OSError:
+                pass
+        return uid
+
+    def add_message_with_next_idle(self):
+        """Has the next IDLE command add a message and announce it right after the "+ idling" continuation."""
+        with self.lock:
+            self.messages_with_next_idle += 1
+
+    def _arrive_with_idle(self):
+        with self.lock:
+            if not self.messages_with_next_idle:
+                return 0
+            self.messages_with_next_idle -= 1
+            uid = max(self.messages, default=0) + 1
+            self.messages[uid] = make_message(uid)
+            self.arrivals[uid] = time.time()
+            return len(self.messages)
+
+    def drop_connections(self):
+        with self.lock:
+            handlers = list(self.handlers)
+        for handler in handlers:
+            try:
+                handler.connection.shutdown(2)
+            except OSError:
+                pass
+
+    @property
+    def active_connections(self):
+        with self.lock:
+            return len(self.handlers)
+
+    def _connected(self, handler):
+        with self.lock:
+            self.handlers.add(handler)
+            self.total_connections += 1
+            self.peak_connections = max(self.peak_connections, len(self.handlers))
+
+    def _disconnected(self, handler):
+        with self.lock:
+            self.handlers.discard(handler)
+            self.idlers.discard(handler)
+
+    def _idling(self, handler, idling):
+        with self.lock:
+            (self.idlers.add if idling else self.idlers.discard)(handler)
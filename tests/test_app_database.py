@@ -0,0 +1,87 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from core.app_database import app_database_url, engine_options, copy_tables
+from app import db, User, LegalDocumentResult
+
+POSTGRES_URL = "postgresql+psycopg2://secretary:secretarypass@db:5432/secretary_pm"
+
+
+@pytest.fixture
+def postgres_schema():
+    """An engine on a throwaway Postgres schema holding only the app models' tables."""
+    admin = create_engine(POSTGRES_URL)
+    with admin.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS test_app_database CASCADE"))
+        connection.execute(text("CREATE SCHEMA test_app_database"))
+    engine = create_engine(POSTGRES_URL, connect_args={"options": "-csearch_path=test_app_database"},
+                           **engine_options(POSTGRES_URL))
+    yield engine
+    engine.dispose()
+    with admin.begin() as connection:
+        connection.execute(text("DROP SCHEMA test_app_database CASCADE"))
+    admin.dispose()
+
+
+def test_database_url_and_pool_settings(monkeypatch):
+    monkeypatch.delenv("APP_DATABASE_URL", raising=False)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    assert app_database_url() == "sqlite:///paralegal.db" and engine_options(app_database_url()) == {}
+    monkeypatch.setenv("DATABASE_URL", "postgres://u:p@rds:5432/app")
+    assert app_database_url() == "postgresql+psycopg2://u:p@rds:5432/app"
+    monkeypatch.setenv("APP_DATABASE_URL", "postgresql://u:p@db/app")
+    assert app_database_url() == "postgresql+psycopg2://u:p@db/app"
+    assert engine_options(app_database_url())["pool_pre_ping"] is True
+
+
+def test_sqlite_rows_are_copied_and_ids_continue(tmp_path, postgres_schema):
+    source = create_engine(f"sqlite:///{tmp_path / 'paralegal.db'}")
+    with source.begin() as connection:
+        # An old database: results from before the task_id column
+        connection.execute(text('CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80), email VARCHAR(120), '
+                                'password_hash VARCHAR(128), gemini_api_key VARCHAR(256), is_admin BOOLEAN)'))
+        connection.execute(text('CREATE TABLE legal_document_result (id INTEGER PRIMARY KEY, user_id INTEGER, '
+                                'doc_id VARCHAR(128), result_type VARCHAR(32), content TEXT, created_at DATETIME, '
+                                'question TEXT, party VARCHAR(32))'))
+        connection.execute(text("INSERT INTO user VALUES (7, 'ann', 'ann@example.com', 'h', NULL, 0)"))
+        connection.execute(text("INSERT INTO legal_document_result VALUES (41, 7, 'doc', 'summary', 'Lease ends.', "
+                                "'2099-01-01 10:00:00', NULL, NULL)"))
+
+    assert copy_tables(db.metadata, source, postgres_schema)["legal_document_result"] == 1
+    with Session(postgres_schema) as session:
+        copied = session.get(LegalDocumentResult, 41)
+        assert (copied.user.username, copied.content, copied.task_id) == ("ann", "Lease ends.", None)
+        session.add(User(username="bob", email="bob@example.com", password_hash="h"))
+        session.commit()
+        assert session.query(User).filter_by(username="bob").one().id == 8
+    with pytest.raises(ValueError, match="already have rows"):
+        copy_tables(db.metadata, source, postgres_schema)
+    source.dispose()
+
+
+def test_concurrent_writers_all_commit_on_postgres(postgres_schema):
+    copy_tables(db.metadata, create_engine("sqlite://"), postgres_schema)
+    with Session(postgres_schema) as session:
+        session.add(User(id=1, username="writer", email="writer@example.com", password_hash="h"))
+        session.commit()
+    errors = []
+
+    def write(writer):
+        for n in range(20):
+            with Session(postgres_schema) as session:
+                try:
+                    session.get(User, 1)
+                    session.add(LegalDocumentResult(user_id=1, doc_id=f"doc-{writer}-{n}", result_type="qa", content="Yes."))
+                    session.commit()
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    with Session(postgres_schema) as session:
+        assert session.query(LegalDocumentResult).count() == 240
@@ -0,0 +1,65 @@
+import json
+import re
+from unittest.mock import patch
+import pytest
+from core.llm_cache import InMemoryCacheBackend, LLMResponseCache
+from agents.filtering_agent import filter_and_categorize_emails
+
+
+def make_emails(n):
+    return [{"id": str(i), "subject": f"Issue {i}", "body": f"Problem number {i}"} for i in range(n)]
+
+
+def batch_reply(prompt, skip=()):
+    """Answers a batch prompt with one entry per email id, in reverse order."""
+    ids = re.findall(r"### Email id: (\S+)", prompt)
+    if not ids:
+        return json.dumps({"category": "fallback"})
+    entries = [{"id": batch_id, "category": f"cat-{batch_id}"} for batch_id in reversed(ids) if batch_id not in skip]
+    return "```json\n" + json.dumps(entries) + "\n```"
+
+
+def run(emails, invoke, cache=None, **kwargs):
+    with patch("agents.filtering_agent.ChatGoogleGenerativeAI") as mock_llm, \
+         patch("agents.filtering_agent.llm_cache", cache or LLMResponseCache(InMemoryCacheBackend())):
+        mock_llm.return_value.model = "gemini-2.0-flash"
+        mock_llm.return_value.invoke.side_effect = invoke
+        results = filter_and_categorize_emails(emails, **kwargs)
+    return results, mock_llm.return_value.invoke
+
+
+def test_results_match_input_order_with_one_call_per_batch():
+    results, invoke = run(make_emails(7), batch_reply, batch_size=3, max_concurrency=2)
+    assert [r["category"] for r in results] == [f"cat-e{i}" for i in range(7)]
+    assert invoke.call_count == 3
+
+
+def test_missing_entries_fall_back_to_single_email_calls():
+    results, invoke = run(make_emails(4), lambda prompt: batch_reply(prompt, skip={"e2"}), batch_size=4)
+    assert [r["category"] for r in results] == ["cat-e0", "cat-e1", "fallback", "cat-e3"]
+    assert invoke.call_count == 2
+
+
+def test_failed_batch_falls_back_for_every_email():
+    def invoke(prompt):
+        if "### Email id:" in prompt:
+            raise TimeoutError("model timed out")
+        return json.dumps({"category": "fallback"})
+    results, invoke_mock = run(make_emails(3), invoke, batch_size=3)
+    assert [r["category"] for r in results] == ["fallback"] * 3
+    assert invoke_mock.call_count == 4
+
+
+def test_cached_emails_are_not_resent():
+    cache = LLMResponseCache(InMemoryCacheBackend())
+    emails = make_emails(3)
+    run(emails[:2], batch_reply, cache=cache, batch_size=10)
+    results, invoke = run(emails, batch_reply, cache=cache, batch_size=10)
+    assert [r["category"] for r in results] == ["cat-e0", "cat-e1", "cat-e2"]
+    assert invoke.call_count == 1
+    assert "Issue 2" in invoke.call_args[0][0] and "Issue 0" not in invoke.call_args[0][0]
+
+
+def test_contexts_must_match_the_emails():
+    with pytest.raises(ValueError):
+        run(make_emails(3), batch_reply, contexts=[(None, None)] * 2)
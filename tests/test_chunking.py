@@ -0,0 +1,84 @@
+from unittest.mock import patch, MagicMock
+import pytest
+from core.chunking import iter_chunk_spans, read_span, combine_partials
+from core.legal_results import merge_legal_fields
+
+
+def write(tmp_path, text):
+    path = tmp_path / "doc.txt"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+def test_chunks_cover_the_text_at_page_breaks_with_overlap(tmp_path):
+    pages = [f"Page {i}. " + "Hearing set for the plaintiff. " * 20 for i in range(12)]
+    path = write(tmp_path, "\f".join(pages))
+    spans = list(iter_chunk_spans(path, chunk_size=1500, overlap=100, read_size=256))
+    chunks = [read_span(path, start, end) for start, end in spans]
+    assert len(spans) > 1 and all(end - start <= 1500 for start, end in spans)
+    assert spans[0][0] == 0 and spans[-1][1] == len("\f".join(pages).encode())
+    # Every chunk but the last ends on a page break, and neighbours overlap
+    assert all(chunk.endswith("\f") for chunk in chunks[:-1])
+    assert all(next_start < end for (_, end), (next_start, _) in zip(spans, spans[1:]))
+    for page in pages:
+        assert any(page in chunk for chunk in chunks)
+
+
+def test_unbroken_text_is_cut_on_character_boundaries(tmp_path):
+    path = write(tmp_path, "é" * 5000)
+    spans = list(iter_chunk_spans(path, chunk_size=999, overlap=10))
+    assert len(spans) > 1 and all("\ufffd" not in read_span(path, *span) for span in spans)
+    assert spans[-1][1] == len("é".encode()) * 5000
+
+
+def test_blank_documents_and_bad_settings(tmp_path):
+    assert list(iter_chunk_spans(write(tmp_path, " \n\f\n "), chunk_size=100, overlap=10)) == []
+    with pytest.raises(ValueError):
+        list(iter_chunk_spans(write(tmp_path, "x"), chunk_size=100, overlap=60))
+
+
+def test_combine_partials_keeps_each_call_bounded():
+    calls = []
+    def combine(group):
+        calls.append(group)
+        return "c" * 10
+    assert combine_partials(["p" * 40] * 9, combine, max_chars=100) == "c" * 10
+    assert all(sum(map(len, group)) <= 120 for group in calls) and len(calls) > 1
+    assert combine_partials(["only"], combine, 100) == "only"
+
+
+def test_merge_legal_fields_dedupes_parties_and_unions_dates():
+    merged = merge_legal_fields([
+        {"document_type": "Motion", "case_number": "CV-1", "parties": ["Acme Corp", "John  Smith"],
+         "event_dates": ["2099-03-01T10:00:00"], "raw_excerpt": "IN THE SUPERIOR COURT"},
+        None,
+        {"document_type": "Order", "court": "Superior Court", "parties": ["john smith", "Jane Doe"],
+         "event_dates": ["2099-01-15T09:00:00", "2099-03-01T10:00:00"]},
+    ])
+    assert merged["document_type"] == "Motion" and merged["court"] == "Superior Court"
+    assert merged["parties"] == ["Acme Corp", "John Smith", "Jane Doe"]
+    assert merged["event_dates"] == ["2099-01-15T09:00:00", "2099-03-01T10:00:00"]
+    assert merged["raw_excerpt"] == "IN THE SUPERIOR COURT"
+
+
+@patch("celery_worker.get_llm_for_user")
+def test_long_documents_fan_out_and_short_ones_run_inline(mock_llm, tmp_path, monkeypatch):
+    import celery_worker
+    mock_llm.return_value = MagicMock(model="fake")
+    mock_llm.return_value.invoke.return_value.content = "Short summary."
+    monkeypatch.setattr(celery_worker, "DOCUMENT_CHUNK_SIZE", 500)
+    monkeypatch.setattr(celery_worker, "DOCUMENT_CHUNK_OVERLAP", 50)
+
+    short_path = write(tmp_path, "A short notice of hearing.")
+    assert celery_worker.summarize_legal_document(short_path) == short_path + ".summary.txt"
+
+    long_path = str(tmp_path / "long.txt")
+    with open(long_path, "w") as f:
+        f.write("\f".join(f"Page {i}. " + "The tenant shall vacate. " * 15 for i in range(6)))
+    with patch.object(celery_worker.summarize_legal_document, "replace", side_effect=RuntimeError("replaced")) as replace:
+        with pytest.raises(RuntimeError):
+            celery_worker.summarize_legal_document(long_path)
+    workflow = replace.call_args.args[0]
+    assert len(workflow.tasks) == len(celery_worker.document_chunk_spans(long_path)) > 1
+    partials = [celery_worker.map_chunk(*task.args, **task.kwargs) for task in workflow.tasks]
+    assert celery_worker.reduce_document_chunks(partials, *workflow.body.args, **workflow.body.kwargs) == long_path + ".summary.txt"
@@ -0,0 +1,136 @@
+import os
+import threading
+import pytest
+from core import database
+from core.database import ConnectionPool, PoolTimeout, db_connection, db_cursor, get_pool_stats, setup_database
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    monkeypatch.setenv("POSTGRES_POOL_MIN", "1")
+    monkeypatch.setenv("POSTGRES_POOL_MAX", "3")
+    monkeypatch.setenv("POSTGRES_POOL_TIMEOUT", "1")
+    database.close_pool()
+    yield
+    database.close_pool()
+
+
+def backend_pid(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid() AS pid")
+        return cursor.fetchone()["pid"]
+
+
+def test_connections_are_reused():
+    with db_connection() as conn:
+        first = backend_pid(conn)
+    with db_connection() as conn:
+        second = backend_pid(conn)
+    assert first == second
+    stats = get_pool_stats()
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 0
+    assert stats["size"] == 1
+
+
+def test_crud_helpers_go_through_pool():
+    setup_database()
+    database.get_tenant_by_email("nobody@example.com")
+    database.get_property_by_id(1)
+    assert get_pool_stats()["checkouts"] >= 3
+    assert get_pool_stats()["size"] == 1
+
+
+def test_error_rolls_back_and_returns_connection():
+    with pytest.raises(ZeroDivisionError):
+        with db_cursor() as cursor:
+            cursor.execute("SELECT 1")
+            1 / 0
+    with db_cursor() as cursor:
+        cursor.execute("SELECT 1 AS one")
+        assert cursor.fetchone()["one"] == 1
+    assert get_pool_stats()["in_use"] == 0
+
+
+def test_dead_connection_is_replaced_on_checkout():
+    pool = database.get_pool()
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    with db_cursor() as cursor:
+        cursor.execute("SELECT 1 AS one")
+        assert cursor.fetchone()["one"] == 1
+
+
+def test_stale_idle_connection_is_pinged():
+    pool = database.get_pool()
+    stale = pool.getconn()
+    other = pool.getconn()
+    stale_pid = backend_pid(stale)
+    stale.commit()
+    with other.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(%s)", (stale_pid,))
+    pool.putconn(other)
+    pool.putconn(stale)
+    with db_connection() as conn:
+        assert backend_pid(conn) != stale_pid
+    assert get_pool_stats()["reconnects"] == 1
+
+
+def test_exhausted_pool_waits_then_times_out():
+    pool = ConnectionPool(minconn=0, maxconn=1, timeout=0.2)
+    held = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    released = threading.Timer(0.1, pool.putconn, args=(held,))
+    released.start()
+    conn = pool.getconn(timeout=2)
+    pool.putconn(conn)
+    stats = pool.stats()
+    assert stats["waits"] == 2
+    assert stats["timeouts"] == 1
+    pool.closeall()
+
+
+def test_pool_is_thread_safe():
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                with db_cursor() as cursor:
+                    cursor.execute("SELECT 1")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    stats = get_pool_stats()
+    assert stats["size"] <= 3
+    assert stats["in_use"] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork()")
+def test_child_process_gets_its_own_pool():
+    with db_connection() as conn:
+        parent_pid = backend_pid(conn)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            with db_connection() as conn:
+                os.write(write_fd, str(backend_pid(conn)).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    child_pid = int(os.read(read_fd, 32))
+    os.close(read_fd)
+    assert child_pid != parent_pid
+    # The parent's pooled connection must still be usable after the child exits.
+    with db_connection() as conn:
+        assert backend_pid(conn) == parent_pid
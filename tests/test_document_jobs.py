@@ -0,0 +1,88 @@
+import threading
+from unittest.mock import patch
+import pytest
+from core.database import setup_database, db_cursor, get_document_job, claim_document_job
+from core.document_jobs import enqueue_document, file_content_hash
+from core.email_ingestion import ingest_emails
+
+
+@pytest.fixture
+def attachments(tmp_path, monkeypatch):
+    setup_database()
+    monkeypatch.setattr("core.document_jobs.ATTACHMENTS_DIR", str(tmp_path))
+    hashes = []
+    def write(name, content):
+        path = tmp_path / name
+        path.write_bytes(content)
+        hashes.append(file_content_hash(path))
+        return str(path)
+    yield write
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM document_jobs WHERE content_hash = ANY(%s)", (hashes,))
+        cursor.execute("DELETE FROM emails WHERE id LIKE 'docjob-test-%'")
+
+
+def legal_email(email_id, filename):
+    return {"id": email_id, "from": "clerk@court.gov", "subject": "Motion filed", "timestamp": "2099-03-01T09:00:00",
+            "attachments": [filename]}
+
+
+@patch("celery_worker.ocr_pdf")
+def test_ingestion_queues_each_document_content_once(mock_ocr, attachments):
+    attachments("a.pdf", b"%PDF same content")
+    attachments("b.pdf", b"%PDF same content")
+    attachments("c.pdf", b"%PDF other content")
+    emails = [legal_email("docjob-test-1", "a.pdf"), legal_email("docjob-test-2", "b.pdf"),
+              legal_email("docjob-test-3", "c.pdf")]
+    ingest_emails(emails, user_id=4)
+    ingest_emails(emails)
+    assert mock_ocr.delay.call_count == 2
+    # The documents are analysed for the user whose mailbox they came from
+    assert {call.args[1] for call in mock_ocr.delay.call_args_list} == {4}
+    queued = {call.kwargs["content_hash"] for call in mock_ocr.delay.call_args_list}
+    assert all(get_document_job(h)["status"] == "queued" for h in queued)
+
+
+@patch("celery_worker.ocr_pdf")
+def test_concurrent_enqueues_claim_a_document_once(mock_ocr, attachments):
+    path = attachments("race.pdf", b"%PDF raced")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(enqueue_document(path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([r for r in results if r]) == 1
+    assert mock_ocr.delay.call_count == 1
+
+
+def write_sidecar(args, **kwargs):
+    with open(args[args.index("--sidecar") + 1], "w") as f:
+        f.write("Notice of hearing")
+
+
+@patch("celery_worker.analyze_legal_document")
+@patch("core.ocr.subprocess.run", side_effect=write_sidecar)
+def test_ocr_task_tracks_job_and_skips_redelivery(mock_run, mock_analyze, attachments):
+    from celery_worker import ocr_pdf
+    path = attachments("tracked.pdf", b"%PDF tracked")
+    content_hash = file_content_hash(path)
+    assert claim_document_job(content_hash, path)
+
+    assert ocr_pdf(path, None, content_hash=content_hash).endswith("tracked.txt")
+    assert get_document_job(content_hash)["status"] == "done"
+    assert ocr_pdf(path, None, content_hash=content_hash) is None
+    assert mock_run.call_count == 1 and mock_analyze.delay.call_count == 1
+
+
+@patch("core.ocr.subprocess.run", side_effect=RuntimeError("ocrmypdf crashed"))
+def test_failed_jobs_are_only_retried_on_request(mock_run, attachments):
+    from celery_worker import ocr_pdf
+    path = attachments("broken.pdf", b"%PDF broken")
+    content_hash = file_content_hash(path)
+    assert claim_document_job(content_hash, path)
+    ocr_pdf(path, None, content_hash=content_hash)
+    job = get_document_job(content_hash)
+    assert job["status"] == "failed" and "crashed" in job["error"] and job["attempts"] == 1
+    assert not claim_document_job(content_hash, path)
+    assert claim_document_job(content_hash, path, retry_failed=True)
@@ -0,0 +1,150 @@
+import re
+from unittest.mock import patch
+from core import email_imap
+from core.email_imap import iter_new_imap_emails, parse_fetch_response
+
+
+def plain_message(uid):
+    header = f"From: tenant{uid}@example.com\r\nSubject: Issue {uid}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n".encode()
+    return {"HEADER": header, "1": f"Body {uid}".encode()}
+
+
+def html_only_message(uid):
+    header = (f"From: tenant{uid}@example.com\r\nSubject: =?utf-8?q?Caf=C3=A9_{uid}?=\r\n"
+              "Content-Type: multipart/mixed; boundary=XX\r\n\r\n").encode()
+    full = header + (b"--XX\r\nContent-Type: text/html\r\n\r\n<p>html</p>\r\n"
+                     b"--XX\r\nContent-Type: text/plain\r\n\r\nPlain fallback\r\n--XX--\r\n")
+    return {"HEADER": header, "1.MIME": b"Content-Type: text/html\r\n\r\n", "1": b"<p>html</p>", "": full}
+
+
+class FakeIMAP:
+    def __init__(self, messages, uidvalidity=7):
+        self.messages = messages
+        self.uidvalidity = uidvalidity
+        self.fetches = []
+
+    def __call__(self, server):
+        return self
+
+    def login(self, username, password):
+        return "OK", [b"logged in"]
+
+    def select(self, mailbox, readonly=False):
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [str(self.uidvalidity).encode()]
+
+    def logout(self):
+        return "BYE", []
+
+    def uid(self, command, *args):
+        uids = sorted(self.messages)
+        if command == "SEARCH":
+            criterion = args[1]
+            if criterion != "ALL":
+                start = int(re.match(r"UID (\d+):\*", criterion).group(1))
+                uids = [uid for uid in uids if uid >= start] or uids[-1:]
+            return "OK", [" ".join(map(str, uids)).encode()]
+        uid_set, items = args
+        self.fetches.append((uid_set, items))
+        first, _, last = uid_set.partition(":")
+        wanted = [uid for uid in uids if int(first) <= uid <= int(last or first)]
+        data = []
+        for seq, uid in enumerate(wanted, 1):
+            sections = self.messages[uid]
+            names = [""] if "BODY.PEEK[]" in items else ["HEADER", "1.MIME", "1"]
+            lead = f"{seq} (UID {uid} "
+            for name in names:
+                if name not in sections:
+                    continue
+                data.append((f"{lead}BODY[{name}] {{{len(sections[name])}}}".encode(), sections[name]))
+                lead = " "
+            data.append(b")")
+        return "OK", data
+
+
+# The sync state of iter_new_imap_emails("me@example.com", ...) on the default server
+ACCOUNT = "me@example.com@imap.gmail.com"
+
+
+def sync(fake, store, **kwargs):
+    with patch.object(email_imap.imaplib, "IMAP4_SSL", fake), \
+         patch.object(email_imap, "get_imap_sync_state", lambda account, mailbox: store.get((account, mailbox))), \
+         patch.object(email_imap, "save_imap_sync_state",
+                      lambda account, mailbox, uidvalidity, last_uid: store.__setitem__((account, mailbox), {"uidvalidity": uidvalidity, "last_uid": last_uid})):
+        return list(iter_new_imap_emails("me@example.com", "pw", **kwargs))
+
+
+def test_initial_sync_fetches_newest_window_in_batched_ranges():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 11)})
+    store = {}
+    emails = sync(fake, store, batch_size=2, initial_window=4)
+    assert [e["uid"] for e in emails] == [7, 8, 9, 10]
+    assert emails[0] == {"id": "7", "uid": 7, "mailbox": "inbox", "uidvalidity": 7, "from": "tenant7@example.com",
+                         "subject": "Issue 7", "body": "Body 7", "received_at": None}
+    assert [uid_set for uid_set, _ in fake.fetches] == ["7:8", "9:10"]
+    assert store[(ACCOUNT, "inbox")] == {"uidvalidity": 7, "last_uid": 10}
+
+
+def test_initial_sync_without_window_starts_from_newest_uid():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 6)})
+    store = {}
+    assert sync(fake, store, initial_window=0) == []
+    assert store[(ACCOUNT, "inbox")] == {"uidvalidity": 7, "last_uid": 5}
+    fake.messages[6] = plain_message(6)
+    assert [e["uid"] for e in sync(fake, store)] == [6]
+
+
+def test_incremental_sync_fetches_only_new_uids():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 6)})
+    store = {(ACCOUNT, "inbox"): {"uidvalidity": 7, "last_uid": 5}}
+    assert sync(fake, store) == []
+    assert fake.fetches == []
+    fake.messages[9] = plain_message(9)
+    assert [e["uid"] for e in sync(fake, store)] == [9]
+    assert store[(ACCOUNT, "inbox")]["last_uid"] == 9
+
+
+def test_each_account_keeps_its_own_sync_state():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 4)})
+    store = {(ACCOUNT, "inbox"): {"uidvalidity": 7, "last_uid": 3}, ("cli:me", "inbox"): {"uidvalidity": 7, "last_uid": 3}}
+    fake.messages[4] = plain_message(4)
+    assert [e["uid"] for e in sync(fake, store)] == [4]
+    # Another consumer of the same mailbox still gets the message
+    assert [e["uid"] for e in sync(fake, store, account="cli:me")] == [4]
+    assert store[(ACCOUNT, "inbox")]["last_uid"] == store[("cli:me", "inbox")]["last_uid"] == 4
+
+
+def test_limit_fetches_and_records_only_the_messages_returned():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 4)})
+    store = {(ACCOUNT, "inbox"): {"uidvalidity": 7, "last_uid": 3}}
+    for uid in range(4, 11):
+        fake.messages[uid] = plain_message(uid)
+    assert [e["uid"] for e in sync(fake, store, limit=5)] == [4, 5, 6, 7, 8]
+    assert [uid_set for uid_set, _ in fake.fetches] == ["4:8"] and store[(ACCOUNT, "inbox")]["last_uid"] == 8
+    # The rest come on the next sync
+    assert [e["uid"] for e in sync(fake, store, limit=5)] == [9, 10]
+
+
+def test_uidvalidity_change_resyncs():
+    fake = FakeIMAP({uid: plain_message(uid) for uid in range(1, 4)}, uidvalidity=8)
+    store = {(ACCOUNT, "inbox"): {"uidvalidity": 7, "last_uid": 500}}
+    assert [e["uid"] for e in sync(fake, store, initial_window=10)] == [1, 2, 3]
+    assert store[(ACCOUNT, "inbox")] == {"uidvalidity": 8, "last_uid": 3}
+
+
+def test_full_message_is_fetched_only_when_first_part_is_not_plain_text():
+    fake = FakeIMAP({1: plain_message(1), 2: html_only_message(2)})
+    emails = sync(fake, {}, initial_window=10)
+    assert emails[1]["subject"] == "Café 2"
+    assert emails[1]["body"] == "Plain fallback"
+    assert [items for _, items in fake.fetches].count("(BODY.PEEK[])") == 1
+    assert fake.fetches[-1][0] == "2"
+
+
+def test_parse_fetch_response_handles_trailing_uid():
+    data = [(b'1 (INTERNALDATE "17-Jul-1996 02:44:25 +0000" BODY[HEADER] {4}', b"H: 1"), (b" BODY[1] {1}", b"x"), b" UID 42)"]
+    parsed = parse_fetch_response(data)
+    assert parsed[42]["BODY[HEADER]"] == b"H: 1" and parsed[42]["BODY[1]"] == b"x"
+    assert parsed[42]["INTERNALDATE"] == 837571465
@@ -0,0 +1,94 @@
+from datetime import datetime
+from unittest.mock import patch
+import pytest
+from core import email_imap
+from core.database import setup_database, db_cursor, get_email, list_emails, update_email_status
+from core.email_ingestion import annotate_email, ingest_emails, ingest_imap
+from tests.test_email_imap import FakeIMAP, plain_message
+
+
+@pytest.fixture
+def clean_emails():
+    setup_database()
+    yield
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM emails WHERE id LIKE 'ingest-test-%'")
+
+
+def test_annotate_flags_legal_attachments_and_parses_timestamps():
+    row = annotate_email({"id": 5, "from": "clerk@court.gov", "subject": "Motion filed", "timestamp": "2025-02-08T09:00:00"})
+    assert row["id"] == "5" and row["is_legal_communication"] is True
+    assert row["attachments"] == ["5_document.pdf"] and row["category"] == "legal_document"
+    assert row["received_at"] == datetime(2025, 2, 8, 9, 0)
+    imap_row = annotate_email({"id": "u1", "from": "a@b.c", "subject": "Hi", "received_at": 0}, source="imap")
+    assert imap_row["received_at"] == datetime(1970, 1, 1) and imap_row["source"] == "imap"
+
+
+def test_reingestion_keeps_reply_status_and_classification(clean_emails):
+    email = {"id": "ingest-test-1", "from": "t@example.com", "subject": "Leak", "body": "b",
+             "timestamp": "2099-01-01T00:00:00", "category": "maintenance_request"}
+    ingest_emails([email])
+    update_email_status("ingest-test-1", replied=True)
+    ingest_emails([dict(email, category=None, subject="Leak (updated)")])
+    stored = get_email("ingest-test-1")
+    assert stored["replied"] is True and stored["category"] == "maintenance_request"
+    assert stored["subject"] == "Leak (updated)" and stored["from"] == "t@example.com"
+
+
+def test_uids_reused_after_a_uidvalidity_change_are_new_emails(clean_emails):
+    store = {}
+    def ingest(fake):
+        with patch.object(email_imap.imaplib, "IMAP4_SSL", fake), \
+             patch.object(email_imap, "get_imap_sync_state", lambda account, mailbox: store.get((account, mailbox))), \
+             patch.object(email_imap, "save_imap_sync_state",
+                          lambda account, mailbox, uidvalidity, last_uid: store.__setitem__((account, mailbox), {"uidvalidity": uidvalidity, "last_uid": last_uid})):
+            return ingest_imap("ingest-test-imap", "pw")
+    assert ingest(FakeIMAP({1: plain_message(1)}, uidvalidity=7)) == 1
+    update_email_status("ingest-test-imap@imap.gmail.com:inbox:7:1", replied=True)
+    # The mailbox was rebuilt: UID 1 is now another message
+    assert ingest(FakeIMAP({1: plain_message(2)}, uidvalidity=8)) == 1
+    old, new = get_email("ingest-test-imap@imap.gmail.com:inbox:7:1"), get_email("ingest-test-imap@imap.gmail.com:inbox:8:1")
+    assert (old["subject"], old["replied"]) == ("Issue 1", True)
+    assert (new["subject"], new["replied"]) == ("Issue 2", False)
+
+
+def test_list_emails_filters_and_pages(clean_emails):
+    ingest_emails([{"id": f"ingest-test-p{i}", "from": f"s{i % 2}@example.com", "subject": str(i),
+                    "timestamp": f"2099-02-0{i}T00:00:00"} for i in range(1, 6)], batch_size=2)
+    page = list_emails(limit=2, sender="s1@example.com")
+    assert [e["id"] for e in page] == ["ingest-test-p5", "ingest-test-p3"]
+    rest = list_emails(limit=2, sender="s1@example.com", before=(page[-1]["received_at"], page[-1]["id"]))
+    assert [e["id"] for e in rest] == ["ingest-test-p1"]
+
+
+def rollup_snapshot():
+    with db_cursor() as cursor:
+        cursor.execute('SELECT day, category, replied, draft_saved, count FROM email_daily_rollups WHERE count <> 0 ORDER BY 1, 2, 3, 4')
+        daily = [tuple(row.values()) for row in cursor.fetchall()]
+        cursor.execute('SELECT issue, count FROM email_issue_rollups WHERE count <> 0 ORDER BY 1')
+        issues = [tuple(row.values()) for row in cursor.fetchall()]
+    return daily, issues
+
+
+def test_triggers_keep_rollups_equal_to_a_rebuild(clean_emails):
+    from core.database import rebuild_email_rollups, get_email_dashboard_stats
+    rebuild_email_rollups()
+    before = get_email_dashboard_stats()
+    ingest_emails([{"id": f"ingest-test-r{i}", "from": "t@example.com", "subject": f"Leak {i % 2}",
+                    "timestamp": f"2099-03-0{1 + i % 3}T08:00:00", "category": "spam" if i == 4 else "maintenance_request"}
+                   for i in range(6)])
+    update_email_status("ingest-test-r1", replied=True)
+    update_email_status("ingest-test-r2", draft_saved=True)
+    ingest_emails([{"id": "ingest-test-r3", "from": "t@example.com", "subject": "Leak 1", "timestamp": "2099-03-02T08:00:00",
+                    "category": "rent_inquiry", "extracted_issue_summary": "Rent question"}])
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM emails WHERE id = 'ingest-test-r5'")
+
+    maintained = rollup_snapshot()
+    rebuild_email_rollups()
+    assert rollup_snapshot() == maintained
+
+    stats = get_email_dashboard_stats()
+    assert stats["total"] - before["total"] == 5
+    assert stats["replied"] - before["replied"] == 1 and stats["drafts"] - before["drafts"] == 1
+    assert stats["category_counts"]["maintenance_request"] - before["category_counts"].get("maintenance_request", 0) == 3
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+from core.gevent_io import run_concurrently, enable_gevent_io
+
+
+def test_calls_run_one_after_another_without_gevent():
+    order = []
+    assert run_concurrently(lambda: order.append(1) or "a", lambda: order.append(2) or "b") == ["a", "b"]
+    assert order == [1, 2]
+    assert enable_gevent_io() is False
+
+
+def test_calls_overlap_and_raise_in_a_gevent_process():
+    script = """
+from gevent import monkey; monkey.patch_all()
+import time
+from core.gevent_io import run_concurrently, enable_gevent_io
+assert enable_gevent_io() and enable_gevent_io()
+started = time.perf_counter()
+assert run_concurrently(*[lambda i=i: time.sleep(0.2) or i for i in range(5)]) == [0, 1, 2, 3, 4]
+assert time.perf_counter() - started < 0.6
+active, peak = [0], [0]
+def query(i):
+    active[0] += 1
+    peak[0] = max(peak[0], active[0])
+    time.sleep(0.2)
+    active[0] -= 1
+    return i
+assert run_concurrently(*[lambda i=i: query(i) for i in range(4)], limit=2) == [0, 1, 2, 3] and peak[0] == 2
+try:
+    run_concurrently(lambda: 1, lambda: 1 / 0)
+except ZeroDivisionError:
+    print("ok")
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+    assert result.stdout.strip() == "ok", result.stderr
+
+
+def test_tasks_reach_the_database_on_the_gevent_pool(tmp_path):
+    # Each task runs in a new greenlet of the pool, which must have its own app context
+    script = """
+from gevent import monkey; monkey.patch_all()
+import sys
+from unittest.mock import patch
+from celery.concurrency.gevent import TaskPool
+import celery_worker
+from app import app, db, User, LegalDocumentResult
+with app.app_context():
+    db.create_all()
+    db.session.add(User(id=1, username="ann", email="a@example.com", password_hash="h", gemini_api_key="ann-key"))
+    db.session.commit()
+keys, results = [], []
+def client(cls, **kwargs):
+    keys.append(kwargs["google_api_key"])
+    return object()
+pool = TaskPool(limit=2)
+pool.start()
+with patch.object(celery_worker, "get_llm_client", client), patch.object(celery_worker, "ask_llm", return_value="Vacate."):
+    pool.on_apply(celery_worker.summarize_legal_document, (sys.argv[1],), {"user_id": 1, "doc_id": "doc-1"},
+                  callback=results.append)
+    pool._pool.join()
+with app.app_context():
+    saved = [result.content for result in LegalDocumentResult.query.filter_by(user_id=1, doc_id="doc-1")]
+assert keys and set(keys) == {"ann-key"} and results == [sys.argv[1] + ".summary.txt"] and saved == ["Vacate."]
+print("ok")
+"""
+    path = tmp_path / "lease.txt"
+    path.write_text("The tenant shall vacate by June 1.")
+    env = dict(os.environ, APP_DATABASE_URL=f"sqlite:///{tmp_path / 'paralegal.db'}")
+    result = subprocess.run([sys.executable, "-c", script, str(path)], capture_output=True, text=True, timeout=120, env=env)
+    assert result.stdout.strip().endswith("ok"), result.stderr
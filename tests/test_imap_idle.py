@@ -0,0 +1,133 @@
+import threading
+import time
+from unittest.mock import patch
+import pytest
+from core import email_imap
+from core.imap_idle import ImapIdleSupervisor, ImapProfile, imap_latencies
+from tests.imap_stand_in import IMAPStandIn
+from tests.test_task_queues import StandInRedis
+
+
+@pytest.fixture
+def stand_in():
+    server = IMAPStandIn().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def sync_store():
+    store = {}
+    with patch.object(email_imap, "get_imap_sync_state", lambda account, mailbox: store.get((account, mailbox))), \
+         patch.object(email_imap, "save_imap_sync_state",
+                      lambda account, mailbox, uidvalidity, last_uid: store.__setitem__((account, mailbox), {"uidvalidity": uidvalidity, "last_uid": last_uid})):
+        yield store
+
+
+def profile_for(server, profile_id=1):
+    return ImapProfile(id=profile_id, host="127.0.0.1", port=server.port, username=f"user{profile_id}", password="pw", use_ssl=False)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class Collector:
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, profile, message):
+        with self.lock:
+            self.messages.append((profile.id, message))
+
+    def uids(self):
+        with self.lock:
+            return [message["uid"] for _, message in self.messages]
+
+
+def test_listener_wakes_on_exists_and_fetches_only_new_mail(stand_in):
+    stand_in.add_message()  # already in the mailbox before the listener starts
+    collected = Collector()
+    supervisor = ImapIdleSupervisor([profile_for(stand_in)], collected, max_connections=2, poll_interval=0.05)
+    supervisor.start()
+    try:
+        assert wait_for(lambda: stand_in.idlers)
+        uid = stand_in.add_message()
+        assert wait_for(lambda: collected.uids() == [uid])
+        assert collected.messages[0][1]["subject"] == f"Issue {uid}"
+        assert collected.messages[0][1]["id"] == f"user1@127.0.0.1:inbox:{stand_in.uidvalidity}:{uid}"
+        assert collected.messages[0][1]["received_at"] == pytest.approx(stand_in.arrivals[uid], abs=1)
+    finally:
+        supervisor.stop()
+
+
+def test_listener_sees_exists_sent_with_the_idle_continuation(stand_in):
+    collected = Collector()
+    stand_in.add_message_with_next_idle()
+    # The EXISTS is already in imaplib's buffer, so waiting on the socket alone would miss it until the IDLE timeout
+    supervisor = ImapIdleSupervisor([profile_for(stand_in)], collected, poll_interval=0.05, idle_timeout=60)
+    supervisor.start()
+    try:
+        assert wait_for(lambda: collected.uids() == [1], timeout=3)
+    finally:
+        supervisor.stop()
+
+
+def test_listener_reconnects_after_a_dropped_connection(stand_in):
+    collected = Collector()
+    supervisor = ImapIdleSupervisor([profile_for(stand_in)], collected, poll_interval=0.05, min_backoff=0.05)
+    supervisor.start()
+    try:
+        assert wait_for(lambda: stand_in.idlers)
+        stand_in.drop_connections()
+        assert wait_for(lambda: stand_in.total_connections >= 2 and stand_in.idlers)
+        uid = stand_in.add_message()
+        assert wait_for(lambda: collected.uids() == [uid])
+        assert supervisor.listeners[0].reconnects >= 1
+    finally:
+        supervisor.stop()
+
+
+def test_connection_cap_limits_listeners_and_shards_split_profiles(stand_in):
+    from core.imap_idle import shard_profiles
+    profiles = [profile_for(stand_in, i) for i in range(1, 4)]
+    supervisor = ImapIdleSupervisor(profiles, Collector(), max_connections=2, poll_interval=0.05)
+    supervisor.start()
+    try:
+        assert wait_for(lambda: len(stand_in.idlers) == 2)
+        time.sleep(0.2)
+        assert stand_in.peak_connections == 2
+        assert [p.id for p in supervisor.skipped] == [3]
+    finally:
+        supervisor.stop()
+    assert [p.id for p in shard_profiles(profiles, shard=0, shards=2)] == [2]
+    assert [p.id for p in shard_profiles(profiles, shard=1, shards=2)] == [1, 3]
+
+
+def test_process_incoming_email_records_arrival_to_classification_latency():
+    from celery_worker import process_incoming_email
+    from utils.metrics import latency
+    latency.clear()
+    email = {"id": "7", "uid": 7, "from": "nobody@example.com", "subject": "Leak", "body": "Sink leaks", "received_at": time.time() - 2}
+    with patch("core.supervisor.get_tenant_by_email", return_value=None), \
+         patch("agents.filtering_agent.filter_and_categorize_email", return_value={"category": "general_inquiry"}), \
+         patch("agents.response_agent.generate_property_management_response", return_value="Thanks"), \
+         patch("celery_worker.ingest_emails") as mock_ingest, \
+         patch.object(imap_latencies, "_redis", StandInRedis()):
+        result = process_incoming_email(email, 3, time.time() - 0.5, user_id=5)
+        # The worker's samples reach Redis, where /admin/metrics in the web process reads them
+        shared = imap_latencies.stats()
+    assert result["category"] == "general_inquiry" and result["profile_id"] == 3
+    assert mock_ingest.call_args[0][0][0]["category"] == "general_inquiry" and mock_ingest.call_args.kwargs["user_id"] == 5
+    stats = latency.stats()
+    assert stats["imap_arrival_to_classified"]["count"] == 1
+    assert stats["imap_arrival_to_classified"]["p50_ms"] >= 2000
+    assert stats["imap_queue_wait"]["p50_ms"] >= 500
+    assert shared["imap_arrival_to_classified"]["count"] == 1 and shared["imap_arrival_to_classified"]["p50_ms"] >= 2000
+    assert shared["imap_queue_wait"]["count"] == 1 and shared["imap_arrival_to_fetched"] is None
@@ -63,6 +63,18 @@ def test_ticket_crud(test_db):
     assert row["issue"] == "Leaky faucet"
 
 
+def test_ticket_is_opened_once_per_email(test_db):
+    prop_id = create_property("12 Elm St", 1)
+    tenant_id = create_tenant("Cara", "cara@example.com", prop_id, "1")
+    first = create_maintenance_ticket_db(tenant_id, prop_id, "No heat", "high", email_id="e-heat")
+    # The workflow re-run on the same email, e.g. by a task retried after an LLM rate limit
+    assert create_maintenance_ticket_db(tenant_id, prop_id, "No heat", "high", email_id="e-heat") == first
+    assert create_maintenance_ticket_db(tenant_id, prop_id, "No hot water", "high", email_id="e-water") != first
+    cursor = get_db_connection().cursor()
+    cursor.execute("SELECT count(*) AS n FROM maintenance_tickets")
+    assert cursor.fetchone()["n"] == 2
+
+
 @pytest.mark.parametrize("email_obj,expected_category", [
     ( {"subject": "Leaking faucet in kitchen", "body": "My kitchen faucet is leaking."}, "maintenance_request" ),
     ( {"subject": "Question about rent payment", "body": "Did you get my rent?"}, "rent_inquiry" ),
@@ -111,4 +123,65 @@ def test_supervisor_workflow():
         mock_filter.return_value = {"category": "maintenance_request", "extracted_issue_summary": "My faucet leaks."}
         mock_response.return_value = "Thank you for your request."
         new_state = supervisor_pm_workflow(email, state)
-        assert new_state.current_email["response"] == "Thank you for your request." 
\ No newline at end of file
+        assert new_state.current_email["response"] == "Thank you for your request." 
+
+def test_stream_pm_workflow_yields_the_response_as_written():
+    from core.supervisor import stream_pm_workflow
+    email = {"id": "s1", "from": "alice@example.com", "subject": "Leaking faucet", "body": "My faucet leaks."}
+    state = EmailState(emails=[email])
+    with patch("core.supervisor.get_tenant_by_email", return_value=None), \
+         patch("agents.filtering_agent.filter_and_categorize_email", return_value={"category": "general_inquiry"}), \
+         patch("agents.response_agent.stream_property_management_response", return_value=iter(["Thank you ", "for writing."])):
+        events = list(stream_pm_workflow(email, state))
+    assert events[:4] == [
+        ("status", {"step": "classifying"}),
+        ("status", {"step": "responding", "category": "general_inquiry"}),
+        ("text", {"text": "Thank you "}),
+        ("text", {"text": "for writing."}),
+    ]
+    assert events[4][0] == "done" and "Hi Resident,\n\nThank you for writing." in events[4][1]["response"]
+    assert state.current_email["response"] == events[4][1]["response"] and state.history[0]["email_id"] == "s1"
+    assert set(email["step_timings"]) == {"tenant_lookup", "classification", "ticket_insert", "response_generation"}
+
+def test_supervisor_langgraph_reuses_compiled_graph():
+    from core.supervisor import supervisor_langgraph, get_email_graph
+    seen = []
+    with patch("agents.filtering_agent.filter_email", create=True, return_value="ham"), \
+         patch("agents.summarization_agent.summarize_email", return_value="summary"), \
+         patch("agents.response_agent.generate_response", side_effect=lambda email, summary, recipient, user: seen.append((recipient, user)) or "Noted."):
+        graph = get_email_graph()
+        supervisor_langgraph({"id": "1", "body": "a"}, EmailState(), "Me", "Alice")
+        supervisor_langgraph({"id": "2", "body": "b"}, EmailState(), "Me", "Bob")
+        assert get_email_graph() is graph
+    assert seen == [("Alice", "Me"), ("Bob", "Me")]
+
+def test_pm_workflow_batch_keeps_order_and_isolates_failures():
+    import threading
+    import time
+    from core.supervisor import process_pm_emails
+    emails = [{"id": str(i), "from": f"t{i}@example.com", "subject": f"s{i}", "body": "b"} for i in range(6)]
+    state = EmailState(emails=emails)
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def classify(email, tenant_info, property_info):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05 * (6 - int(email["id"])))  # later emails finish first
+        with lock:
+            active[0] -= 1
+        if email["id"] == "2":
+            raise RuntimeError("LLM unavailable")
+        return {"category": "general_inquiry"}
+
+    with patch("core.supervisor.get_tenant_by_email", return_value=None), \
+         patch("agents.filtering_agent.filter_and_categorize_email", side_effect=classify), \
+         patch("agents.response_agent.generate_property_management_response",
+               side_effect=lambda category, email_data, **kw: f"Reply to {email_data['id']}"):
+        results = process_pm_emails(state, max_concurrency=3)
+
+    assert [r.current_email["id"] for r in results] == [e["id"] for e in emails]
+    assert emails[2]["error"] == "LLM unavailable" and "response" not in emails[2]
+    assert [e["response"] for i, e in enumerate(emails) if i != 2] == ["Reply to 0", "Reply to 1", "Reply to 3", "Reply to 4", "Reply to 5"]
+    assert [h["email_id"] for h in state.history] == [e["id"] for e in emails]
+    assert peak[0] == 3
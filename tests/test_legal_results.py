@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+import pytest
+from core.database import (setup_database, db_cursor, get_legal_document, list_legal_documents, list_legal_events,
+                           count_legal_documents, count_legal_events)
+from core.legal_results import store_analysis, import_result_files, parse_event_date
+
+USER, OTHER_USER = 90001, 90002
+
+
+@pytest.fixture
+def clean_results():
+    setup_database()
+    yield
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM legal_documents WHERE doc_id LIKE 'legal-test-%'")
+
+
+def analysis(case_number, *dates):
+    return {"document_type": "Motion", "case_number": case_number, "court": "Superior Court",
+            "parties": ["Acme", "Smith"], "event_dates": list(dates), "raw_excerpt": "..."}
+
+
+def test_parse_event_date_normalizes_to_naive_utc():
+    assert parse_event_date("2099-01-02T10:00:00+02:00") == datetime(2099, 1, 2, 8, 0)
+    assert parse_event_date("next Tuesday") is None
+
+
+def test_documents_and_events_are_paged_and_filtered_by_user(clean_results):
+    for i in range(3):
+        store_analysis(f"legal-test-{i}", analysis(f"CV-{i}", f"2099-0{i + 1}-01T09:00:00", "not a date"),
+                       user_id=str(USER) if i < 2 else OTHER_USER)
+
+    first = list_legal_documents(limit=2, user_id=USER)
+    assert [d["doc_id"] for d in first] == ["legal-test-1", "legal-test-0"]
+    assert first[0]["parties"] == ["Acme", "Smith"]
+    assert list_legal_documents(limit=2, user_id=USER, before=(first[-1]["analyzed_at"], first[-1]["id"])) == []
+
+    events = list_legal_events(limit=10, since=datetime(2099, 1, 15), user_id=USER)
+    assert [(e["case_number"], e["starts_at"]) for e in events] == [("CV-1", datetime(2099, 2, 1, 9, 0))]
+    assert events[0]["ics_filename"] == f"CV-1_Motion_20990201_090000_user{USER}.ics"
+    page = list_legal_events(limit=1, since=datetime(2099, 1, 1))
+    later = list_legal_events(limit=10, since=datetime(2099, 1, 1), after=(page[0]["starts_at"], page[0]["id"]))
+    assert page[0]["case_number"] == "CV-0" and [e["case_number"] for e in later][:2] == ["CV-1", "CV-2"]
+    assert count_legal_documents(USER) == 2 and count_legal_events(OTHER_USER) == 1
+
+
+def test_reanalysis_replaces_events(clean_results):
+    store_analysis("legal-test-re", analysis("CV-9", "2099-05-01T09:00:00", "2099-06-01T09:00:00"), user_id=USER)
+    store_analysis("legal-test-re", analysis("CV-9", "2099-07-01T09:00:00"))
+    document = get_legal_document("legal-test-re")
+    assert document["user_id"] == USER
+    assert [e["starts_at"].month for e in list_legal_events(user_id=USER, since=datetime(2099, 1, 1))
+            if e["doc_id"] == "legal-test-re"] == [7]
+
+
+def test_import_result_files_loads_existing_json(clean_results, tmp_path):
+    (tmp_path / "legal-test-imported.json").write_text(json.dumps(dict(analysis("CV-7"), user_id=USER)))
+    (tmp_path / "legal-test-imported.txt").write_text("text")
+    assert import_result_files(str(tmp_path)) == 1
+    document = get_legal_document("legal-test-imported")
+    assert document["case_number"] == "CV-7" and document["txt_path"] == str(tmp_path / "legal-test-imported.txt")
@@ -0,0 +1,72 @@
+import json
+import time
+from unittest.mock import patch, MagicMock
+from core.llm_cache import InMemoryCacheBackend, LLMResponseCache
+from agents.filtering_agent import filter_and_categorize_email
+
+
+def test_hit_skips_compute_and_counts():
+    cache = LLMResponseCache(InMemoryCacheBackend())
+    compute = MagicMock(return_value={"category": "spam"})
+    first = cache.get_or_compute("classification", "1", "gemini", 0.2, "hello", compute)
+    second = cache.get_or_compute("classification", "1", "gemini", 0.2, "hello", compute)
+    assert first == second == {"category": "spam"}
+    assert compute.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_key_covers_version_model_and_temperature():
+    cache = LLMResponseCache(InMemoryCacheBackend())
+    compute = MagicMock(return_value="x")
+    cache.get_or_compute("summary", "1", "gemini", 0.3, "doc", compute)
+    cache.get_or_compute("summary", "2", "gemini", 0.3, "doc", compute)
+    cache.get_or_compute("summary", "1", "gpt", 0.3, "doc", compute)
+    cache.get_or_compute("summary", "1", "gemini", 0.5, "doc", compute)
+    assert compute.call_count == 4
+
+
+def test_cached_values_are_copies():
+    cache = LLMResponseCache(InMemoryCacheBackend())
+    value = cache.get_or_compute("classification", "1", "m", 0.2, "t", lambda: {"category": "a"})
+    value["maintenance_ticket_id"] = 7
+    assert cache.get_or_compute("classification", "1", "m", 0.2, "t", lambda: None) == {"category": "a"}
+
+
+def test_ttl_and_size_eviction():
+    backend = InMemoryCacheBackend(max_entries=2)
+    backend.set("a", 1, ttl=0.05)
+    backend.set("b", 2)
+    backend.set("c", 3)
+    assert backend.get("a") is None  # evicted by size
+    assert backend.evictions == 1
+    backend.set("d", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("d") is None  # expired
+
+
+def test_backend_errors_fall_back_to_compute():
+    broken = MagicMock()
+    broken.get.side_effect = ConnectionError("redis down")
+    broken.set.side_effect = ConnectionError("redis down")
+    cache = LLMResponseCache(broken)
+    assert cache.get_or_compute("n", "1", "m", 0.1, "t", lambda: "fresh") == "fresh"
+    assert cache.stats()["errors"] == 2
+
+
+def test_unparseable_classification_is_not_cached():
+    cache = LLMResponseCache(InMemoryCacheBackend())
+    compute = MagicMock(return_value={"category": "unknown_format", "error": "bad"})
+    cache.get_or_compute("c", "1", "m", 0.2, "t", compute, cacheable=lambda v: "error" not in v)
+    cache.get_or_compute("c", "1", "m", 0.2, "t", compute, cacheable=lambda v: "error" not in v)
+    assert compute.call_count == 2
+
+
+def test_repeat_classification_makes_one_model_call():
+    email = {"subject": "Broken heater", "body": "The heater in 4C stopped working."}
+    with patch("agents.filtering_agent.ChatGoogleGenerativeAI") as mock_llm:
+        mock_llm.return_value.invoke.return_value = json.dumps({"category": "maintenance_request"})
+        first = filter_and_categorize_email(email)
+        second = filter_and_categorize_email(email)
+    assert first == second == {"category": "maintenance_request"}
+    assert mock_llm.return_value.invoke.call_count == 1
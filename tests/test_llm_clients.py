@@ -0,0 +1,50 @@
+import pytest
+from core.llm_clients import LLMClientRegistry, get_llm_client_for_service, registry
+
+
+class FakeClient:
+    created = 0
+
+    def __init__(self, **kwargs):
+        FakeClient.created += 1
+        self.kwargs = kwargs
+
+
+def test_same_settings_reuse_one_client():
+    reg = LLMClientRegistry(max_size=4)
+    a = reg.get(FakeClient, model="m", temperature=0.2, google_api_key="k1")
+    b = reg.get(FakeClient, temperature=0.2, google_api_key="k1", model="m")
+    c = reg.get(FakeClient, model="m", temperature=0.5, google_api_key="k1")
+    assert a is b
+    assert a is not c
+    assert reg.stats()["hits"] == 1
+    assert reg.stats()["misses"] == 2
+
+
+def test_least_recently_used_client_is_evicted():
+    reg = LLMClientRegistry(max_size=2)
+    first = reg.get(FakeClient, model="m", api_key="a")
+    reg.get(FakeClient, model="m", api_key="b")
+    reg.get(FakeClient, model="m", api_key="a")  # touch "a" so "b" is the oldest
+    reg.get(FakeClient, model="m", api_key="c")
+    assert reg.get(FakeClient, model="m", api_key="a") is first
+    assert reg.stats()["evictions"] == 1
+    assert reg.stats()["size"] == 2
+
+
+def test_evict_by_api_key():
+    reg = LLMClientRegistry()
+    old = reg.get(FakeClient, model="m", openai_api_key="old")
+    reg.get(FakeClient, model="m", openai_api_key="other")
+    assert reg.evict("old") == 1
+    assert reg.get(FakeClient, model="m", openai_api_key="old") is not old
+
+
+def test_llm_service_rows_share_clients():
+    registry.clear()
+    a = get_llm_client_for_service("openai", "sk-test", 0.3)
+    b = get_llm_client_for_service("openai", "sk-test", 0.3)
+    assert a is b
+    with pytest.raises(ValueError):
+        get_llm_client_for_service("unknown", "key", 0.3)
+    registry.clear()
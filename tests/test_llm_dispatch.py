@@ -0,0 +1,148 @@
+from unittest.mock import MagicMock, patch
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+from core import llm_dispatch
+from core.llm_dispatch import TokenBuckets, LLMRateLimited, invoke_llm, stream_llm, api_key_id, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    """Named like openai.RateLimitError, the way the providers' 429s are recognised."""
+
+
+class StandInModel:
+    def __init__(self, *replies, api_key="key-1"):
+        self.google_api_key = api_key
+        self.replies = list(replies)
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        for chunk in self.replies.pop(0):
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class Clock:
+    """Stands in for the time module in core.llm_dispatch: sleeping moves the clock on."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_dispatch, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def local_buckets(monkeypatch, clock):
+    buckets = TokenBuckets(requests_per_minute=60, tokens_per_minute=600, redis_url="")
+    monkeypatch.setattr(llm_dispatch, "buckets", buckets)
+    return buckets
+
+
+def test_buckets_give_requests_and_tokens_per_key_until_empty(clock):
+    buckets = TokenBuckets(requests_per_minute=2, tokens_per_minute=600, redis_url="")
+    assert buckets.take("a", 1, 500) == 0 and buckets.take("b", 1, 500) == 0
+    # 100 tokens left for "a", refilling at 10/s
+    assert buckets.take("a", 1, 200) == pytest.approx(10)
+    assert buckets.take("a", 1, 100) == 0
+    assert buckets.take("a", 1, 1) == pytest.approx(30)  # both requests used, one back every 30s
+    clock.sleep(30)
+    assert buckets.take("a", 1, 1) == 0
+    buckets.charge("b", -400)
+    assert buckets.take("b", 1, 490) == 0
+
+
+def test_invoke_waits_for_budget_and_charges_reported_usage(local_buckets, clock):
+    reply = AIMessage(content="ok", usage_metadata={"input_tokens": 100, "output_tokens": 400, "total_tokens": 500})
+    model = StandInModel(reply, AIMessage(content="again"))
+    assert invoke_llm(model, "x" * 396) is reply  # estimated at 100 tokens, charged 500
+    assert not clock.sleeps
+    # 100 tokens left and 200 needed, at 10 tokens/s
+    assert invoke_llm(model, "y" * 796).content == "again"
+    assert sum(clock.sleeps) == pytest.approx(10, abs=1.01)
+    assert local_buckets.stats()["waits"] == len(clock.sleeps)
+
+
+def test_budget_waits_past_the_deadline_are_refused(local_buckets, monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "LLM_RATE_LIMIT_MAX_WAIT", 5)
+    model = StandInModel(AIMessage(content="ok"), AIMessage(content="never"))
+    invoke_llm(model, "x" * 2396)  # all 600 tokens
+    with pytest.raises(LLMRateLimited) as refused:
+        invoke_llm(model, "y" * 396)
+    assert refused.value.retry_after == pytest.approx(10) and len(model.prompts) == 1
+
+
+def test_provider_rate_limits_are_retried_with_backoff(local_buckets, clock, monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "LLM_RATE_LIMIT_RETRIES", 2)
+    model = StandInModel(RateLimitError("429"), RateLimitError("429"), AIMessage(content="done"))
+    assert invoke_llm(model, "prompt").content == "done"
+    assert len(model.prompts) == 3 and len(clock.sleeps) == 2
+    assert clock.sleeps[0] <= llm_dispatch.LLM_RATE_LIMIT_BACKOFF and clock.sleeps[1] <= 2 * llm_dispatch.LLM_RATE_LIMIT_BACKOFF
+
+    model = StandInModel(*[RateLimitError("429")] * 3)
+    with pytest.raises(LLMRateLimited):
+        invoke_llm(model, "prompt")
+    model = StandInModel(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        invoke_llm(model, "prompt")
+
+
+def test_streams_retry_only_before_the_first_chunk_and_charge_summed_usage(local_buckets, clock):
+    usage = {"input_tokens": 100, "output_tokens": 150, "total_tokens": 250}
+    chunks = [AIMessageChunk(content="Hel", usage_metadata=usage), AIMessageChunk(content="lo", usage_metadata=usage)]
+    assert [chunk.content for chunk in stream_llm(StandInModel(chunks), "x" * 396)] == ["Hel", "lo"]
+    assert not clock.sleeps
+    # Estimated at 100 tokens, charged 500: the next 200 wait for 10s of refill
+    list(stream_llm(StandInModel([AIMessageChunk(content="ok")]), "y" * 796))
+    assert sum(clock.sleeps) == pytest.approx(10, abs=1.01)
+
+    model = StandInModel([RateLimitError("429")], [AIMessageChunk(content="again")])
+    assert [chunk.content for chunk in stream_llm(model, "prompt")] == ["again"]
+    assert len(model.prompts) == 2
+    model = StandInModel([AIMessageChunk(content="Hel"), RateLimitError("429")], [AIMessageChunk(content="never")])
+    streamed = stream_llm(model, "prompt")
+    assert next(streamed).content == "Hel"
+    with pytest.raises(RateLimitError):
+        next(streamed)
+    assert len(model.prompts) == 1
+
+
+def test_rate_limits_are_recognised_through_wrapping():
+    try:
+        try:
+            raise RateLimitError("429")
+        except RateLimitError as e:
+            raise RuntimeError("chain failed") from e
+    except RuntimeError as wrapped:
+        assert is_rate_limit_error(wrapped)
+    assert not is_rate_limit_error(ValueError("bad request"))
+    assert api_key_id(StandInModel()) == api_key_id(StandInModel(api_key="key-1")) != api_key_id(StandInModel(api_key="key-2"))
+    assert "key-1" not in api_key_id(StandInModel())
+
+
+def test_rate_limited_chunks_retry_their_task():
+    import celery_worker
+    with patch.dict(celery_worker.CHUNK_MAPPERS, {"summary": MagicMock(side_effect=LLMRateLimited("busy", 5))}):
+        with pytest.raises(LLMRateLimited):
+            celery_worker.map_chunk("summary", __file__, 0, 10, 0, 2)
+    for task in (celery_worker.map_document_chunk, celery_worker.qa_legal_document, celery_worker.process_incoming_email):
+        assert task.autoretry_for == (LLMRateLimited,) and task.retry_jitter
@@ -0,0 +1,117 @@
+import os
+import shutil
+from unittest.mock import patch
+import pikepdf
+import pytest
+from fpdf import FPDF
+from core.database import (setup_database, db_cursor, claim_document_job, get_document_job,
+                           get_document_ocr_pages)
+from core.document_jobs import file_content_hash
+from core.ocr import text_layer, ocr_range, sidecar_pages, page_timings, ocr_output_path, work_dir
+
+
+def write_pdf(path, pages, text_pages=()):
+    """A PDF whose pages in text_pages have a text layer; the others stand in for scans."""
+    pdf = FPDF()
+    pdf.set_font("helvetica", size=12)
+    for page in range(pages):
+        pdf.add_page()
+        if page in text_pages:
+            pdf.multi_cell(0, 10, text=f"Filed text of page {page + 1}. " + "The motion is granted. " * 8)
+    pdf.output(str(path))
+    return str(path)
+
+
+def fake_ocrmypdf(args, **kwargs):
+    """Copies the input and writes a sidecar the way ocrmypdf does with --skip-text or --force-ocr."""
+    input_pdf, output_pdf = args[-2], args[-1]
+    shutil.copy(input_pdf, output_pdf)
+    name = os.path.basename(input_pdf)
+    skip_text = "--skip-text" in args
+    sections = [f"[OCR skipped on page(s) {page + 1}]" if text and skip_text else f"Scanned {name} page {page + 1}"
+                for page, text in enumerate(text_layer(input_pdf))]
+    with open(args[args.index("--sidecar") + 1], "w") as f:
+        f.write("\f".join(sections))
+
+
+@pytest.fixture
+def tracked():
+    setup_database()
+    hashes = []
+    def track(pdf_path):
+        content_hash = file_content_hash(pdf_path)
+        hashes.append(content_hash)
+        assert claim_document_job(content_hash, pdf_path)
+        return content_hash
+    yield track
+    with db_cursor() as cursor:
+        cursor.execute("DELETE FROM document_jobs WHERE content_hash = ANY(%s)", (hashes,))
+
+
+def test_sidecar_pages_expands_skipped_ranges():
+    assert sidecar_pages("one\f[OCR skipped on page(s) 2-4]\ffive\f[OCR skipped on page(s) 6]\f") == \
+        ["one", None, None, None, "five", None]
+
+
+@patch("core.ocr.subprocess.run", side_effect=fake_ocrmypdf)
+def test_skipped_pages_keep_their_text_layer(mock_run, tmp_path):
+    pdf_path = write_pdf(tmp_path / "filing.pdf", 3, text_pages={1})
+    txt_path = str(tmp_path / "filing.txt")
+    result = ocr_range(pdf_path, ocr_output_path(pdf_path), txt_path, jobs=2)
+    assert mock_run.call_args.args[0][:4] == ["ocrmypdf", "--skip-text", "--jobs", "2"]
+    with open(txt_path) as f:
+        pages = f.read().split("\f")
+    assert pages[0] == "Scanned filing.pdf page 1" and pages[1].startswith("Filed text of page 2.")
+    assert result["ocr"] == [True, False, True]
+    rows = page_timings(dict(result, seconds=3.0), [10, 11, 12], shard=2)
+    assert [(row["page"], row["shard"], row["seconds"]) for row in rows] == [(11, 2, 1.5), (12, 2, 0.0), (13, 2, 1.5)]
+
+
+@patch("celery_worker.analyze_legal_document")
+@patch("core.ocr.subprocess.run", side_effect=fake_ocrmypdf)
+def test_born_digital_pdfs_skip_ocr(mock_run, mock_analyze, tmp_path, tracked):
+    import celery_worker
+    pdf_path = write_pdf(tmp_path / "order.pdf", 3, text_pages={0, 1, 2})
+    content_hash = tracked(pdf_path)
+    txt_path = celery_worker.ocr_pdf(pdf_path, 7, content_hash=content_hash)
+    assert mock_run.call_count == 0
+    mock_analyze.delay.assert_called_once_with(txt_path, 7)
+    with open(txt_path) as f:
+        assert [page[:21] for page in f.read().split("\f")] == [f"Filed text of page {n}." for n in (1, 2, 3)]
+    job = get_document_job(content_hash)
+    assert job["status"] == "done" and job["route"] == "text_layer"
+    assert (job["page_count"], job["ocr_page_count"]) == (3, 0)
+
+
+@patch("celery_worker.analyze_legal_document")
+@patch("core.ocr.subprocess.run", side_effect=fake_ocrmypdf)
+def test_only_scanned_pages_are_ocrd_in_shards(mock_run, mock_analyze, tmp_path, tracked, monkeypatch):
+    import celery_worker
+    monkeypatch.setattr(celery_worker, "OCR_SHARD_MIN_PAGES", 4)
+    monkeypatch.setattr("core.ocr.OCR_SHARD_PAGES", 3)
+    pdf_path = write_pdf(tmp_path / "filing.pdf", 10, text_pages={0, 5})
+    content_hash = tracked(pdf_path)
+    with patch.object(celery_worker.ocr_pdf, "replace", side_effect=RuntimeError("replaced")) as replace:
+        with pytest.raises(RuntimeError):
+            celery_worker.ocr_pdf(pdf_path, 7, content_hash=content_hash)
+    workflow = replace.call_args.args[0]
+    assert [task.args[1] for task in workflow.tasks] == [[1, 2, 3], [4, 6, 7], [8, 9]]
+    results = [celery_worker.ocr_pdf_shard(*task.args) for task in workflow.tasks]
+    assert all("--force-ocr" in call.args[0] for call in mock_run.call_args_list)
+    txt_path = celery_worker.finish_ocr_shards(results, *workflow.body.args)
+
+    with open(txt_path) as f:
+        pages = f.read().split("\f")
+    assert len(pages) == 10
+    assert pages[0].startswith("Filed text of page 1.") and pages[5].startswith("Filed text of page 6.")
+    assert pages[4] == "Scanned shard-0001.pdf page 1" and pages[9] == "Scanned shard-0002.pdf page 2"
+    with pikepdf.open(ocr_output_path(pdf_path)) as pdf:
+        assert len(pdf.pages) == 10
+    assert not os.path.exists(work_dir(pdf_path))
+    job = get_document_job(content_hash)
+    assert job["status"] == "done" and job["route"] == "mixed" and job["ocr_page_count"] == 8
+    timings = get_document_ocr_pages(content_hash)
+    assert [row["page"] for row in timings] == [2, 3, 4, 5, 7, 8, 9, 10]
+    assert [row["shard"] for row in timings] == [0, 0, 0, 1, 1, 1, 2, 2]
+    assert job["saved_seconds"] == pytest.approx(2 * sum(row["seconds"] for row in timings) / 8, rel=1e-3)
+    mock_analyze.delay.assert_called_once_with(txt_path, 7)
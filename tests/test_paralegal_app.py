@@ -18,6 +18,20 @@ def client():
     os.close(db_fd)
     os.unlink(db_path)
 
+@pytest.fixture
+def stored_emails():
+    """Stores emails in the Postgres emails table for one test and removes them afterwards."""
+    from core.database import setup_database, db_cursor
+    from core.email_ingestion import ingest_emails
+    setup_database()
+    ids = []
+    def store(*emails):
+        ingest_emails(emails)
+        ids.extend(e["id"] for e in emails)
+    yield store
+    with db_cursor() as cursor:
+        cursor.execute('DELETE FROM emails WHERE id = ANY(%s)', (ids,))
+
 def signup(client, username, email, password):
     return client.post('/signup', data={
         'username': username,
@@ -50,52 +64,127 @@ def test_inbox_requires_login(client):
     rv = client.get('/inbox', follow_redirects=True)
     assert b'Log In' in rv.data
 
-@patch('app.ocr_pdf')
-def test_per_user_document_tracking(mock_ocr_pdf, client):
+@patch('core.document_jobs.enqueue_document')
+def test_dashboard_views_do_not_enqueue_ocr(mock_enqueue, client, stored_emails):
     signup(client, 'bob', 'bob@example.com', 'pw')
     login(client, 'bob', 'pw')
-    # Simulate dashboard load triggers OCR for a legal email
-    with patch('app.load_emails') as mock_load_emails:
-        mock_load_emails.return_value = [{
-            'id': '1',
-            'subject': 'Motion to Dismiss',
-            'from': 'court@example.com',
-            'timestamp': '2024-06-01T10:00:00',
-        }]
-        client.get('/dashboard')
-        assert mock_ocr_pdf.delay.called
-        args, kwargs = mock_ocr_pdf.delay.call_args
-        # Should pass user_id as second arg
-        assert kwargs or (len(args) > 1 and args[1] is not None)
-
-@patch('app.ocr_pdf')
-def test_my_documents_filter(mock_ocr_pdf, client):
+    stored_emails({
+        'id': 'test-1',
+        'subject': 'Motion to Dismiss',
+        'from': 'court@example.com',
+        'timestamp': '2099-06-01T10:00:00',
+    })
+    # OCR is queued once, at ingestion; page views never enqueue it again
+    mock_enqueue.reset_mock()
+    client.get('/dashboard')
+    client.get('/dashboard')
+    assert not mock_enqueue.called
+
+def test_my_documents_filter(client, stored_emails):
     signup(client, 'carol', 'carol@example.com', 'pw')
     login(client, 'carol', 'pw')
     # Simulate dashboard with filter
-    with patch('app.load_emails') as mock_load_emails:
-        mock_load_emails.return_value = [{
-            'id': '2',
-            'subject': 'Order for Hearing',
-            'from': 'court@example.com',
-            'timestamp': '2024-06-02T10:00:00',
-        }]
-        rv = client.get('/dashboard?filter=mydocs')
-        assert b'(Mine)' in rv.data
-
-@patch('app.ocr_pdf')
-def test_my_events_filter(mock_ocr_pdf, client):
+    stored_emails({
+        'id': 'test-2',
+        'subject': 'Order for Hearing',
+        'from': 'court@example.com',
+        'timestamp': '2099-06-02T10:00:00',
+    })
+    rv = client.get('/dashboard?filter=mydocs')
+    assert b'(Mine)' in rv.data
+
+def test_my_events_filter(client, stored_emails):
     signup(client, 'dave', 'dave@example.com', 'pw')
     login(client, 'dave', 'pw')
-    with patch('app.load_emails') as mock_load_emails:
-        mock_load_emails.return_value = [{
-            'id': '3',
-            'subject': 'Notice of Hearing',
-            'from': 'court@example.com',
-            'timestamp': '2024-06-03T10:00:00',
-        }]
-        rv = client.get('/dashboard?filter=myevents')
-        assert b'(Mine)' in rv.data
+    stored_emails({
+        'id': 'test-3',
+        'subject': 'Notice of Hearing',
+        'from': 'court@example.com',
+        'timestamp': '2099-06-03T10:00:00',
+    })
+    rv = client.get('/dashboard?filter=myevents')
+    assert b'(Mine)' in rv.data
+
+def test_dashboard_reads_legal_results_from_store(client):
+    from core.database import setup_database, db_cursor
+    from core.legal_results import store_analysis
+    signup(client, 'gina', 'gina@example.com', 'pw')
+    login(client, 'gina', 'pw')
+    with app.app_context():
+        user_id = User.query.filter_by(username='gina').first().id
+    setup_database()
+    try:
+        for i in range(3):
+            store_analysis(f'test-legal-{i}', {'document_type': 'Order', 'case_number': f'CASE-{i}', 'court': 'Court',
+                                               'parties': [], 'event_dates': [f'2099-09-0{i + 1}T10:00:00']}, user_id)
+        with patch('app.DASHBOARD_LEGAL_PAGE_SIZE', 2):
+            first = client.get('/dashboard?filter=mydocs')
+            assert b'CASE-2' in first.data and b'CASE-1' in first.data and b'/summarize/test-legal-2' in first.data
+            cursor = first.data.split(b'docs_before=')[1].split(b'"')[0].decode()
+            second = client.get('/dashboard?filter=mydocs&docs_before=' + cursor.replace('%7E', '~'))
+        assert b'/summarize/test-legal-0' in second.data and b'/summarize/test-legal-2' not in second.data
+        assert f'CASE-0_Order_20990901_100000_user{user_id}.ics'.encode() in first.data
+    finally:
+        with db_cursor() as cursor:
+            cursor.execute("DELETE FROM legal_documents WHERE doc_id LIKE 'test-legal-%'")
+
+def test_inbox_pages_by_keyset(client, stored_emails):
+    signup(client, 'frank', 'frank@example.com', 'pw')
+    login(client, 'frank', 'pw')
+    stored_emails(*[{
+        'id': f'test-page-{i}',
+        'subject': f'Paged subject {i}',
+        'from': 'tenant@example.com',
+        'timestamp': f'2099-07-0{i}T10:00:00',
+    } for i in range(1, 4)])
+    with patch('app.INBOX_PAGE_SIZE', 2):
+        first = client.get('/inbox')
+        assert b'Paged subject 3' in first.data and b'Paged subject 2' in first.data
+        assert b'Paged subject 1' not in first.data
+        cursor = first.data.split(b'before=')[1].split(b'"')[0].decode()
+        second = client.get('/inbox?before=' + cursor.replace('&amp;', '&'))
+    assert b'Paged subject 1' in second.data and b'Paged subject 2' not in second.data
+
+def test_submit_response_marks_email_replied(client, stored_emails):
+    from core.database import get_email
+    stored_emails({'id': 'test-reply', 'subject': 'Heater', 'from': 'tenant@example.com', 'timestamp': '2099-08-01T10:00:00'})
+    assert client.get('/email/test-reply').status_code == 200
+    client.post('/email/test-reply/submit', data={'response': 'On it', 'action': 'send'})
+    assert get_email('test-reply')["replied"] is True
+    assert client.get('/email/missing-id', follow_redirects=True).status_code == 200
+
+def test_response_is_generated_by_a_task_and_relayed(client, stored_emails):
+    from unittest.mock import MagicMock
+    signup(client, 'ivan', 'ivan@example.com', 'pw')
+    login(client, 'ivan', 'pw')
+    with app.app_context():
+        user_id = User.query.filter_by(username='ivan').first().id
+    stored_emails({'id': 'test-stream', 'subject': 'Heater', 'from': 'tenant@example.com', 'timestamp': '2099-08-02T10:00:00'})
+    with patch('app.generate_email_response') as task, patch('app.set_response_owner') as set_owner:
+        task.delay.return_value.id = 'task-stream-1'
+        page = client.post('/email/test-stream', data={'your_name': 'Me', 'recipient_name': 'Tenant'})
+        queued = client.post('/email/test-stream', headers={'Accept': 'application/json'})
+    task.delay.assert_called_with('test-stream', user_id=user_id)
+    set_owner.assert_called_with('task-stream-1', user_id)
+    assert page.status_code == 200 and b'/email/task/task-stream-1/events' in page.data
+    assert queued.status_code == 202 and queued.get_json()['status_url'] == '/email/task/task-stream-1'
+    with patch('app.generate_email_response', None):
+        assert client.post('/email/test-stream', headers={'Accept': 'application/json'}).status_code == 503
+
+    # Without Redis, the owner comes from the finished task's result
+    finished = MagicMock(status='SUCCESS', result={'response': 'Hi,\n\nOn it', 'step_timings': {'classification': 0.5},
+                                                   'user_id': user_id})
+    with patch('app.AsyncResult', return_value=finished), patch('core.task_events._client', side_effect=ConnectionError):
+        status = client.get('/email/task/task-stream-1').get_json()
+        events = client.get('/email/task/task-stream-1/events')
+        assert events.mimetype == 'text/event-stream'
+        assert events.get_data(as_text=True) == 'event: done\ndata: {"response": "Hi,\\n\\nOn it"}\n\n'
+        logout(client)
+        signup(client, 'jill', 'jill@example.com', 'pw')
+        login(client, 'jill', 'pw')
+        assert client.get('/email/task/task-stream-1').status_code == 404
+        assert client.get('/email/task/task-stream-1/events').status_code == 404
+    assert status['result']['step_timings'] == {'classification': 0.5}
 
 def test_ics_download(client):
     signup(client, 'eve', 'eve@example.com', 'pw')
@@ -108,4 +197,58 @@ def test_ics_download(client):
         f.write('BEGIN:VCALENDAR\nEND:VCALENDAR')
     rv = client.get('/ics/test_event.ics')
     assert rv.status_code == 200
-    assert b'VCALENDAR' in rv.data 
\ No newline at end of file
+    assert b'VCALENDAR' in rv.data 
+@patch('app.AsyncResult')
+def test_task_status_and_events_are_looked_up_by_task_id(mock_async_result, client):
+    from app import LegalDocumentResult
+    signup(client, 'hana', 'hana@example.com', 'pw')
+    login(client, 'hana', 'pw')
+    mock_async_result.return_value.status = 'STARTED'
+    with app.app_context():
+        user_id = User.query.filter_by(username='hana').first().id
+        for task_id, content in (('task-older', 'Older summary'), ('task-newer', 'Newer summary')):
+            db.session.add(LegalDocumentResult(user_id=user_id, doc_id='doc-status', result_type='summary',
+                                               content=content, task_id=task_id))
+            db.session.commit()
+    try:
+        # The older task's own result, not the user's newest one
+        assert client.get('/task_status/task-older').get_json()['result']['content'] == 'Older summary'
+        assert client.get('/task_status/task-running').get_json() == {'task_id': 'task-running', 'status': 'STARTED', 'result': None}
+        with patch('core.task_events.subscribe', return_value=None):
+            rv = client.get('/task_events?task_id=task-newer&task_id=task-older')
+        assert rv.mimetype == 'text/event-stream'
+        events = [line for line in rv.get_data(as_text=True).split('\n') if line.startswith('data: ')]
+        assert [e.split('"task_id": ')[1].split(',')[0] for e in events] == ['"task-newer"', '"task-older"']
+    finally:
+        with app.app_context():
+            LegalDocumentResult.query.filter_by(doc_id='doc-status').delete()
+            db.session.commit()
+
+def test_results_are_searched_and_paged(client):
+    from app import LegalDocumentResult
+    from datetime import datetime
+    signup(client, 'ines', 'ines@example.com', 'pw')
+    login(client, 'ines', 'pw')
+    with app.app_context():
+        user_id = User.query.filter_by(username='ines').first().id
+        for day, content in enumerate(('Sublease allowed.', 'Sublease of the garage & shed.', 'Deposit returned.'), start=1):
+            db.session.add(LegalDocumentResult(user_id=user_id, doc_id=f'doc-search-{day}', result_type='summary',
+                                               content=content, created_at=datetime(2099, 1, day)))
+        db.session.commit()
+    try:
+        with patch('app.RESULTS_PAGE_SIZE', 1):
+            first = client.get('/results?q=subleases')
+            assert first.data.count(b'/document/doc-search-') == 1 and b'<mark>Sublease</mark>' in first.data
+            cursor = first.data.split(b'after=')[1].split(b'"')[0].decode()
+            second = client.get('/results?q=subleases&after=' + cursor.replace('%7E', '~'))
+            assert second.data.count(b'/document/doc-search-') == 1 and b'after=' not in second.data
+            assert {first.data.count(b'doc-search-2'), second.data.count(b'doc-search-2')} == {0, 2}
+            newest = client.get('/results')
+            assert b'doc-search-3' in newest.data and b'doc-search-2' not in newest.data
+            cursor = newest.data.split(b'after=')[1].split(b'"')[0].decode()
+            older = client.get('/results?after=' + cursor.replace('%7E', '~'))
+        assert b'doc-search-2' in older.data and b'doc-search-3' not in older.data
+    finally:
+        with app.app_context():
+            LegalDocumentResult.query.filter(LegalDocumentResult.doc_id.like('doc-search-%')).delete()
+            db.session.commit()
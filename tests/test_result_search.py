@@ -0,0 +1,77 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from core.app_database import setup_schema
+from core.result_search import search_results, encode_search_cursor, decode_search_cursor
+from app import db, User, LegalDocumentResult
+
+POSTGRES_URL = "postgresql+psycopg2://secretary:secretarypass@db:5432/secretary_pm"
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def engine(request, tmp_path):
+    """An engine on an empty app database with the search index set up: a SQLite file or a Postgres schema."""
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'paralegal.db'}")
+        setup_schema(db.metadata, engine)
+        yield engine
+        engine.dispose()
+        return
+    admin = create_engine(POSTGRES_URL)
+    with admin.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS test_result_search CASCADE"))
+        connection.execute(text("CREATE SCHEMA test_result_search"))
+    engine = create_engine(POSTGRES_URL, connect_args={"options": "-csearch_path=test_result_search"})
+    setup_schema(db.metadata, engine)
+    yield engine
+    engine.dispose()
+    with admin.begin() as connection:
+        connection.execute(text("DROP SCHEMA test_result_search CASCADE"))
+    admin.dispose()
+
+
+def add_results(session, user_id, *contents, **columns):
+    results = [LegalDocumentResult(user_id=user_id, doc_id=columns.get("doc_id", f"doc-{n}"), result_type="summary",
+                                   content=content, party=columns.get("party"), created_at=datetime(2099, 1, 1))
+               for n, content in enumerate(contents)]
+    session.add_all(results)
+    session.commit()
+    return [result.id for result in results]
+
+
+def test_matches_are_ranked_and_highlighted(engine):
+    with Session(engine) as session:
+        session.add_all([User(id=1, username="ann", email="a@example.com", password_hash="h"),
+                         User(id=2, username="bob", email="b@example.com", password_hash="h")])
+        weak, strong, _ = add_results(session, 1, "The tenant paid the rent late.",
+                                      "Eviction notice: the eviction hearing is set & <b>eviction</b> may follow.",
+                                      "The landlord repaired the boiler.")
+        add_results(session, 2, "Eviction of another user's tenant.")
+        assert search_results(session, 1, "boiler heating") == []
+        found = search_results(session, 1, "evictions")
+        assert [row["id"] for row in found] == [strong]
+        assert "<mark>" in found[0]["snippet"] and "&amp;" in found[0]["snippet"] and "<b>" not in found[0]["snippet"]
+        assert [row["id"] for row in search_results(session, 1, "tenant rent")] == [weak]
+
+        # Edits and deletes reach the index
+        session.get(LegalDocumentResult, weak).content = "The boiler is broken."
+        session.delete(session.get(LegalDocumentResult, strong))
+        session.commit()
+        assert search_results(session, 1, "eviction") == [] and search_results(session, 1, "tenant") == []
+        assert len(search_results(session, 1, "boiler")) == 2
+
+
+def test_search_pages_by_rank_and_id_and_applies_filters(engine):
+    with Session(engine) as session:
+        session.add(User(id=1, username="ann", email="a@example.com", password_hash="h"))
+        ids = add_results(session, 1, *["Lease renewal terms."] * 5, party="tenant")
+        add_results(session, 1, "Lease renewal refused.", party="landlord", doc_id="doc-landlord")
+        seen, after = [], None
+        while page := search_results(session, 1, "lease", {"party": "tenant"}, after=after, limit=2):
+            seen.extend(row["id"] for row in page)
+            after = decode_search_cursor(encode_search_cursor(page[-1]))
+        # Equal ranks fall back to the newest id first
+        assert seen == sorted(ids, reverse=True)
+        assert [row["doc_id"] for row in search_results(session, 1, "lease", {"doc_id": "doc-landlord"})] == ["doc-landlord"]
+    assert decode_search_cursor("not-a-cursor") is None and decode_search_cursor("x~1") is None
@@ -0,0 +1,68 @@
+import os
+from unittest.mock import patch, MagicMock
+import numpy as np
+from core.retrieval import build_passage_index, load_passage_index, index_dir
+
+BOILERPLATE = "The parties shall comply with all applicable rules of civil procedure and local rules. " * 12
+
+
+def write_filing(tmp_path, pages=40):
+    path = tmp_path / "filing.txt"
+    text = []
+    for page in range(pages):
+        body = BOILERPLATE
+        if page == 27:
+            body += "The deposition of the building superintendent is scheduled for June 3, 2099 in Courtroom 4B. "
+        if page == 33:
+            body += "The eviction of the tenant is stayed pending appeal. "
+        text.append(f"Page {page + 1}. {body}")
+    path.write_text("\f".join(text))
+    return str(path)
+
+
+def test_search_finds_a_fact_deep_in_the_document(tmp_path):
+    path = write_filing(tmp_path)
+    index = load_passage_index(path)
+    assert isinstance(index.postings, np.memmap) and os.path.exists(os.path.join(index_dir(path), "meta.json"))
+    best = index.search("When is the superintendent deposition?", k=3)
+    assert "superintendent is scheduled for June 3, 2099" in best[0].text
+    assert best[0].score > best[-1].score and len(best) == 3
+    assert load_passage_index(path) is index
+
+
+def test_index_is_rebuilt_when_the_text_changes(tmp_path):
+    path = write_filing(tmp_path, pages=5)
+    first = load_passage_index(path)
+    assert "arbitration" not in first.term_ids
+    with open(path, "a") as f:
+        f.write("\fThe matter is referred to binding arbitration.")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    rebuilt = load_passage_index(path)
+    assert "arbitration" in rebuilt.term_ids
+    assert "binding arbitration" in rebuilt.search("arbitration", k=1)[0].text
+
+
+def test_embeddings_rank_passages_without_shared_terms(tmp_path):
+    path = write_filing(tmp_path)
+    def encoder(texts):
+        # Stand-in embedding model: "eviction" and "removal" mean the same thing
+        vectors = np.array([[1.0, 0.0] if ("eviction" in t or "removal" in t) else [0.0, 1.0] for t in texts], dtype=np.float32)
+        return vectors
+    build_passage_index(path, encoder=encoder, embedding_model="stand-in")
+    index = load_passage_index(path)
+    assert index.embeddings.shape == (len(index), 2)
+    assert "eviction of the tenant is stayed" in index.search("Is the removal halted?", k=1, encoder=encoder)[0].text
+
+
+@patch("celery_worker.get_llm_for_user")
+def test_qa_sends_only_retrieved_passages(mock_llm, tmp_path):
+    import celery_worker
+    mock_llm.return_value = MagicMock(model="fake")
+    mock_llm.return_value.invoke.return_value.content = "June 3, 2099."
+    path = write_filing(tmp_path)
+    question = "When is the superintendent deposition scheduled?"
+    assert celery_worker.qa_legal_document(path, question) == "June 3, 2099."
+    prompt = mock_llm.return_value.invoke.call_args.args[0]
+    assert "superintendent is scheduled for June 3, 2099" in prompt
+    assert len(prompt) < os.path.getsize(path) / 4
+    assert mock_llm.return_value.invoke.call_count == 1
@@ -0,0 +1,178 @@
+import json
+import time
+from unittest.mock import patch
+from core import task_events
+from core.task_events import stream_task_events, publish_task_event, stream_response_events, append_response_event
+
+
+class StandInPubSub:
+    """Delivers the messages given to it, one per get_message call, then waits out the timeout."""
+    def __init__(self, *events):
+        self.messages = [{"type": "message", "data": json.dumps(event).encode()} for event in events]
+        self.closed = False
+
+    def get_message(self, timeout=0):
+        if self.messages:
+            return self.messages.pop(0)
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def events(chunks):
+    return [json.loads(chunk[len("data: "):]) for chunk in chunks if chunk.startswith("data: ")]
+
+
+def test_stream_reports_finished_and_published_tasks_then_ends():
+    pubsub = StandInPubSub({"task_id": "other", "status": "SUCCESS"}, {"task_id": "running", "status": "SUCCESS"})
+    done = {"finished"}
+    lookups = []
+    def lookup(task_id, status):
+        lookups.append((task_id, status))
+        if task_id in done or status:
+            return {"task_id": task_id, "status": status or "SUCCESS"}
+        return None
+
+    with patch.object(task_events, "subscribe", return_value=pubsub):
+        chunks = list(stream_task_events(7, ["finished", "running"], lookup, timeout=5, keepalive=1))
+    assert [event["task_id"] for event in events(chunks)] == ["finished", "running"]
+    # The message for another task costs no lookup; the published one is looked up with its state
+    assert lookups == [("finished", None), ("running", None), ("running", "SUCCESS")]
+    assert pubsub.closed
+
+
+def test_stream_without_redis_rechecks_until_timeout():
+    lookups = []
+    def lookup(task_id, status):
+        lookups.append(task_id)
+        return {"task_id": task_id, "status": "SUCCESS"} if len(lookups) == 3 else None
+
+    with patch.object(task_events, "subscribe", return_value=None):
+        chunks = list(stream_task_events(7, ["slow"], lookup, timeout=5, keepalive=0.01))
+    assert chunks[-1].startswith("data: ") and chunks.count(": keepalive\n\n") == 2
+    with patch.object(task_events, "subscribe", return_value=None):
+        chunks = list(stream_task_events(7, ["stuck"], lambda task_id, status: None, timeout=0.05, keepalive=0.01))
+    assert chunks and all(chunk == ": keepalive\n\n" for chunk in chunks)
+
+
+def test_streams_end_before_a_sync_worker_times_out():
+    with patch.object(task_events, "TASK_EVENTS_SYNC_TIMEOUT", 0.2), \
+         patch.object(task_events, "subscribe", return_value=StandInPubSub()):
+        started = time.monotonic()
+        assert list(stream_task_events(7, ["t1"], lambda task_id, status: None, keepalive=0.05))[-1] == ": keepalive\n\n"
+        assert time.monotonic() - started < 1
+        # gevent workers are not tied up by a stream, which can then stay open longer
+        with patch.object(task_events, "gevent_active", return_value=True):
+            assert task_events.stream_timeout() == task_events.TASK_EVENTS_TIMEOUT
+
+
+def test_published_events_go_to_the_users_channel():
+    class StandInRedis:
+        published = []
+        def publish(self, channel, message):
+            self.published.append((channel, json.loads(message)))
+
+    with patch.object(task_events, "_client", return_value=StandInRedis()):
+        publish_task_event(7, "task-1", "SUCCESS")
+        publish_task_event(None, "task-2", "SUCCESS")
+    assert StandInRedis.published == [("task_events:7", {"task_id": "task-1", "status": "SUCCESS"})]
+
+
+@patch("celery_worker.get_llm_for_user")
+@patch("celery_worker.publish_task_event")
+def test_saved_answers_carry_their_task_id(mock_publish, mock_llm, tmp_path):
+    import celery_worker
+    from app import app, db, LegalDocumentResult
+    path = tmp_path / "doc.txt"
+    path.write_text("The tenant shall vacate.")
+    # celery_worker only binds the app's models when it is imported before app
+    with app.app_context(), patch.multiple(celery_worker, db=db, LegalDocumentResult=LegalDocumentResult):
+        try:
+            celery_worker.reduce_chunks("qa", ["By June 1."], str(path), question="When?", user_id=7,
+                                        doc_id="doc-events", task_id="task-events-1")
+            result = LegalDocumentResult.query.filter_by(task_id="task-events-1").one()
+            assert (result.content, result.user_id, result.question) == ("By June 1.", 7, "When?")
+        finally:
+            LegalDocumentResult.query.filter_by(doc_id="doc-events").delete()
+            db.session.commit()
+    mock_publish.assert_called_once_with(7, "task-events-1", "SUCCESS")
+
+
+class StandInStreams:
+    """Keeps XADDed entries per key; XREAD returns those after the given id, or waits out the block."""
+    def __init__(self):
+        self.entries = {}
+
+    def xadd(self, key, fields):
+        entries = self.entries.setdefault(key, [])
+        entries.append((f"{len(entries) + 1}-0".encode(), {k.encode(): v.encode() for k, v in fields.items()}))
+
+    def expire(self, key, seconds):
+        pass
+
+    def xread(self, streams, count=None, block=None):
+        (key, last_id), = streams.items()
+        after = int(str(last_id if isinstance(last_id, str) else last_id.decode()).split("-")[0])
+        entries = self.entries.get(key, [])[after:after + count]
+        if not entries:
+            time.sleep(block / 1000)
+            return []
+        return [(key.encode(), entries)]
+
+
+def test_response_events_are_relayed_from_the_start_until_done():
+    streams = StandInStreams()
+    with patch.object(task_events, "_client", return_value=streams):
+        append_response_event("t1", "status", {"step": "classifying"})
+        append_response_event("t1", "text", {"text": "Hi"})
+        append_response_event("t1", "done", {"response": "Hi."})
+        append_response_event("t2", "status", {"step": "classifying"})
+        chunks = list(stream_response_events("t1", lambda task_id: None, timeout=5))
+        assert chunks == ['event: status\ndata: {"step": "classifying"}\n\n', 'event: text\ndata: {"text": "Hi"}\n\n',
+                          'event: done\ndata: {"response": "Hi."}\n\n']
+        # A task without further events ends with the event its result gives once it has finished
+        lookups = []
+        finished = lambda task_id: lookups.append(task_id) or (("error", {"error": "failed"}) if len(lookups) == 2 else None)
+        chunks = list(stream_response_events("t2", finished, timeout=5, keepalive=0.01))
+    assert chunks == ['event: status\ndata: {"step": "classifying"}\n\n', ": keepalive\n\n",
+                      'event: error\ndata: {"error": "failed"}\n\n']
+
+
+def test_email_response_task_streams_its_events_and_returns_timings():
+    import celery_worker
+    added = []
+    events = iter([("status", {"step": "classifying"}), ("text", {"text": "On it"}), ("done", {"response": "Hi,\n\nOn it"})])
+    def workflow(email, state):
+        state.current_email = dict(email, category="general_inquiry", actions_taken=[], response="Hi,\n\nOn it",
+                                   step_timings={"classification": 0.5})
+        yield from events
+    with patch.object(celery_worker, "get_email", return_value={"id": "e1", "subject": "Heater"}), \
+         patch.object(celery_worker, "stream_pm_workflow", side_effect=workflow), \
+         patch.object(celery_worker, "append_response_event", side_effect=lambda *event: added.append(event)):
+        result = celery_worker.generate_email_response.apply(args=("e1",), task_id="task-e1").get()
+    assert [event[1] for event in added] == ["status", "text", "done"] and added[0][0] == "task-e1"
+    assert result["response"] == "Hi,\n\nOn it" and result["step_timings"] == {"classification": 0.5}
+    assert celery_worker.celery_app.conf.task_routes["celery_worker.generate_email_response"] == {"queue": "llm-interactive"}
+
+
+def test_retried_email_response_task_does_not_replay_classifying():
+    import celery_worker
+    from core.llm_dispatch import LLMRateLimited
+    added, runs = [], []
+    def workflow(email, state):
+        runs.append(email["id"])
+        state.current_email = dict(email, category="maintenance_request", response="Hi,\n\nOn it")
+        yield "status", {"step": "classifying"}
+        yield "status", {"step": "responding", "category": "maintenance_request"}
+        if len(runs) == 1:
+            raise LLMRateLimited("rate limited", retry_after=0.1)
+        yield "done", {"response": "Hi,\n\nOn it"}
+    with patch.object(celery_worker, "get_email", return_value={"id": "e1", "subject": "Heater"}), \
+         patch.object(celery_worker, "stream_pm_workflow", side_effect=workflow), \
+         patch.object(celery_worker, "append_response_event", side_effect=lambda *event: added.append(event)), \
+         patch.object(celery_worker.generate_email_response, "retry_backoff", False):
+        result = celery_worker.generate_email_response.apply(args=("e1",), task_id="task-e1").get()
+    assert len(runs) == 2 and result["response"] == "Hi,\n\nOn it"
+    assert [event[2].get("step", event[1]) for event in added] == ["classifying", "responding", "rate_limited", "responding", "done"]
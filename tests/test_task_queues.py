@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock
+import pytest
+from celery import Celery
+from core.task_queues import QueueMonitor, QUEUES, OCR_QUEUE, INTERACTIVE_QUEUE, BATCH_QUEUE
+
+
+class StandInRedis:
+    """The list commands QueueMonitor and SharedLatencies use, in memory."""
+    def __init__(self):
+        self.lists = {}
+
+    def pipeline(self):
+        return self
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+        return self
+
+    def ltrim(self, key, start, stop):
+        self.lists[key] = self.lists.get(key, [])[start:stop + 1]
+        return self
+
+    def lrange(self, key, start, stop):
+        values = self.lists.get(key, [])
+        return values[start:] if stop == -1 else values[start:stop + 1]
+
+    def execute(self):
+        pass
+
+
+@pytest.mark.parametrize("task, queue", [
+    ("ocr_pdf", OCR_QUEUE), ("ocr_pdf_shard", OCR_QUEUE), ("qa_legal_document", INTERACTIVE_QUEUE),
+    ("summarize_legal_document", INTERACTIVE_QUEUE), ("analyze_for_party", INTERACTIVE_QUEUE),
+    ("analyze_legal_document", BATCH_QUEUE), ("process_incoming_email", BATCH_QUEUE),
+])
+def test_tasks_are_routed_to_their_queue(task, queue):
+    from celery_worker import celery_app
+    route = celery_app.amqp.router.route({}, f"celery_worker.{task}")
+    assert route["queue"].name == queue
+
+
+def test_chunk_subtasks_stay_on_the_callers_queue(tmp_path):
+    from celery_worker import run_chunked
+    path = tmp_path / "long.txt"
+    path.write_text("\f".join(f"Page {i}. " + "The tenant shall vacate. " * 200 for i in range(4)))
+    task = MagicMock()
+    task.request.delivery_info = {"routing_key": INTERACTIVE_QUEUE}
+    task.replace.side_effect = RuntimeError("replaced")
+    with pytest.raises(RuntimeError):
+        run_chunked(task, "summary", str(path))
+    workflow = task.replace.call_args.args[0]
+    assert len(workflow.tasks) > 1
+    assert {t.options["queue"] for t in workflow.tasks} == {INTERACTIVE_QUEUE} == {workflow.body.options["queue"]}
+
+
+def test_queue_depths_and_waits(tmp_path):
+    app = Celery("queue-test", broker="filesystem://", backend="cache+memory://")
+    app.conf.broker_transport_options = {"data_folder_in": str(tmp_path), "data_folder_out": str(tmp_path),
+                                         "control_folder": str(tmp_path)}
+    app.conf.task_routes = {"ocr-task": {"queue": OCR_QUEUE}, "ask-task": {"queue": INTERACTIVE_QUEUE}}
+    for _ in range(3):
+        app.send_task("ocr-task")
+    app.send_task("ask-task")
+    monitor = QueueMonitor(app, redis_url="redis://stand-in")
+    monitor._redis = StandInRedis()
+    for seconds in (0.2, 0.4, 5.0):
+        monitor.record_wait(INTERACTIVE_QUEUE, seconds)
+
+    stats = monitor.stats()
+    assert set(stats) == set(QUEUES)
+    assert stats[OCR_QUEUE] == {"depth": 3, "wait": None}
+    assert stats[INTERACTIVE_QUEUE]["depth"] == 1 and stats[BATCH_QUEUE]["depth"] == 0
+    assert stats[INTERACTIVE_QUEUE]["wait"] == {"count": 3, "p50_ms": 400.0, "p95_ms": 400.0, "max_ms": 5000.0}
+
+
+def test_unreachable_broker_reports_unknown_depths():
+    monitor = QueueMonitor(Celery("down", broker="redis://127.0.0.1:1/0"), redis_url="")
+    assert monitor.stats() == {queue: {"depth": None, "wait": None} for queue in QUEUES}
@@ -0,0 +1,92 @@
+# utils/metrics.py
+"""In-process latency metrics.
+
+Each process (web, Celery worker, IMAP listener) keeps its own recent samples per metric name and
+logs every sample, so numbers for work done elsewhere show up in that process's log and snapshot.
+SharedLatencies also pushes the samples of some metrics to Redis, for the web process to report."""
+import threading
+from collections import defaultdict, deque
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class LatencyTracker:
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+    def stats(self):
+        """Per metric: total count and p50/p95/max over the most recent samples, in milliseconds."""
+        with self._lock:
+            snapshot = {name: (sorted(samples), self._counts[name]) for name, samples in self._samples.items()}
+        return {name: summarize(samples, count) for name, (samples, count) in snapshot.items() if samples}
+
+def summarize(samples, count=None):
+    """Count and p50/p95/max in milliseconds of sorted samples in seconds."""
+    return {
+        "count": len(samples) if count is None else count,
+        "p50_ms": round(1000 * samples[int(0.5 * (len(samples) - 1))], 1),
+        "p95_ms": round(1000 * samples[int(0.95 * (len(samples) - 1))], 1),
+        "max_ms": round(1000 * samples[-1], 1),
+    }
+
+latency = LatencyTracker()
+
+def record_latency(name, seconds):
+    latency.record(name, seconds)
+    logger.info(f"latency {name}={1000 * seconds:.0f}ms")
+
+class SharedLatencies:
+    """
+    Metrics recorded in one process and reported by another: each sample also goes to a short Redis list
+    per metric (as for the queue waits of core/task_queues.py), so /admin/metrics sees those of every process.
+    """
+    def __init__(self, names, redis_url, max_samples=500, key_prefix="latency:"):
+        self.names = names
+        self.redis_url = redis_url or ""
+        self.max_samples = max_samples
+        self.key_prefix = key_prefix
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None and self.redis_url.startswith(("redis://", "rediss://")):
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def record(self, name, seconds):
+        record_latency(name, seconds)
+        try:
+            client = self._client()
+            if client is not None:
+                key = self.key_prefix + name
+                client.pipeline().lpush(key, f"{seconds:.3f}").ltrim(key, 0, self.max_samples - 1).execute()
+        except Exception as e:
+            logger.debug(f"Storing a {name} sample failed: {e}")
+
+    def stats(self):
+        """Per metric: count and p50/p95/max of the most recent samples of all processes, None without samples."""
+        stats = {name: None for name in self.names}
+        try:
+            client = self._client()
+            if client is None:
+                return stats
+            for name in self.names:
+                samples = sorted(float(sample) for sample in client.lrange(self.key_prefix + name, 0, -1))
+                if samples:
+                    stats[name] = summarize(samples)
+        except Exception as e:
+            logger.warning(f"Reading shared latencies failed: {e}")
+        return stats